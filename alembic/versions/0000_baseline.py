@@ -0,0 +1,94 @@
+"""исходная схема: организации, здания, виды деятельности, телефоны
+
+Revision ID: 0000_baseline
+Revises:
+Create Date: 2026-10-19 09:00:00
+
+Схема до появления миграций (ее создавал create_all при старте). На пустой БД создает таблицы,
+которые дополняют следующие ревизии; существующие таблицы не трогает, поэтому
+`alembic upgrade head` подходит и для новой, и для уже работающей БД.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0000_baseline'
+down_revision: Union[str, Sequence[str], None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    existing = set(sa.inspect(op.get_bind()).get_table_names())
+
+    if 'buildings' not in existing:
+        op.create_table(
+            'buildings',
+            sa.Column('id', sa.Integer(), primary_key=True),
+            sa.Column('address', sa.String(length=500), nullable=False),
+            sa.Column('latitude', sa.Float(), nullable=False),
+            sa.Column('longitude', sa.Float(), nullable=False),
+            sa.Column('description', sa.Text(), nullable=True),
+            sa.CheckConstraint('latitude >= -90 AND latitude <= 90', name='check_latitude'),
+            sa.CheckConstraint('longitude >= -180 AND longitude <= 180', name='check_longitude'),
+        )
+        op.create_index('ix_buildings_id', 'buildings', ['id'])
+
+    if 'activities' not in existing:
+        op.create_table(
+            'activities',
+            sa.Column('id', sa.Integer(), primary_key=True),
+            sa.Column('name', sa.String(length=255), nullable=False),
+            sa.Column('description', sa.Text(), nullable=True),
+            sa.Column('parent_id', sa.Integer(), sa.ForeignKey('activities.id', ondelete='CASCADE'), nullable=True),
+            sa.Column('level', sa.Integer(), nullable=False),
+            sa.CheckConstraint('level >= 0 AND level < 4', name='check_activity_level'),
+        )
+        op.create_index('ix_activities_id', 'activities', ['id'])
+        op.create_index('ix_activities_name', 'activities', ['name'])
+
+    if 'organizations' not in existing:
+        op.create_table(
+            'organizations',
+            sa.Column('id', sa.Integer(), primary_key=True),
+            sa.Column('name', sa.String(length=255), nullable=False),
+            sa.Column('description', sa.Text(), nullable=True),
+            sa.Column(
+                'building_id', sa.Integer(), sa.ForeignKey('buildings.id', ondelete='SET NULL'), nullable=True
+            ),
+            sa.Column('created_at', sa.Integer(), nullable=True),
+            sa.Column('updated_at', sa.Integer(), nullable=True),
+        )
+        op.create_index('ix_organizations_id', 'organizations', ['id'])
+        op.create_index('ix_organizations_name', 'organizations', ['name'])
+
+    if 'phones' not in existing:
+        op.create_table(
+            'phones',
+            sa.Column('id', sa.Integer(), primary_key=True),
+            sa.Column('number', sa.String(length=50), nullable=False),
+            sa.Column(
+                'organization_id', sa.Integer(), sa.ForeignKey('organizations.id', ondelete='CASCADE'), nullable=False
+            ),
+        )
+        op.create_index('ix_phones_id', 'phones', ['id'])
+
+    if 'organization_activity' not in existing:
+        op.create_table(
+            'organization_activity',
+            sa.Column('organization_id', sa.Integer(), sa.ForeignKey('organizations.id', ondelete='CASCADE')),
+            sa.Column('activity_id', sa.Integer(), sa.ForeignKey('activities.id', ondelete='CASCADE')),
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('organization_activity')
+    op.drop_table('phones')
+    op.drop_table('organizations')
+    op.drop_table('activities')
+    op.drop_table('buildings')
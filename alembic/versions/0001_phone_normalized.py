@@ -0,0 +1,68 @@
+"""phones.normalized: нормализованные номера с индексом
+
+Revision ID: 0001_phone_normalized
+Revises: 0000_baseline
+Create Date: 2026-10-19 10:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from app.phones import normalize_phone
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0001_phone_normalized'
+down_revision: Union[str, Sequence[str], None] = '0000_baseline'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+BATCH_SIZE = 1000
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+
+    # Таблица могла быть создана create_all уже с новой колонкой
+    columns = {column['name'] for column in inspector.get_columns('phones')}
+    if 'normalized' not in columns:
+        op.add_column('phones', sa.Column('normalized', sa.String(length=50), nullable=True))
+
+    phones = sa.table(
+        'phones',
+        sa.column('id', sa.Integer),
+        sa.column('number', sa.String),
+        sa.column('normalized', sa.String),
+    )
+
+    # Заполняем пакетами, чтобы не держать все строки в памяти
+    last_id = 0
+    while True:
+        rows = bind.execute(
+            sa.select(phones.c.id, phones.c.number)
+            .where(phones.c.id > last_id, phones.c.normalized.is_(None))
+            .order_by(phones.c.id)
+            .limit(BATCH_SIZE)
+        ).all()
+        if not rows:
+            break
+
+        bind.execute(
+            phones.update().where(phones.c.id == sa.bindparam('phone_id')).values(normalized=sa.bindparam('value')),
+            [{'phone_id': row.id, 'value': normalize_phone(row.number)} for row in rows]
+        )
+        last_id = rows[-1].id
+
+    indexes = {index['name'] for index in inspector.get_indexes('phones')}
+    if 'ix_phones_normalized' not in indexes:
+        op.create_index('ix_phones_normalized', 'phones', ['normalized'])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_phones_normalized', table_name='phones')
+    op.drop_column('phones', 'normalized')
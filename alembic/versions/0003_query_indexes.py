@@ -0,0 +1,63 @@
+"""индексы внешних ключей и триграммные индексы для поиска по названиям
+
+Revision ID: 0003_query_indexes
+Revises: 0002_jobs
+Create Date: 2026-10-19 14:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0003_query_indexes'
+down_revision: Union[str, Sequence[str], None] = '0002_jobs'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# (имя, таблица, колонки, только для Postgres)
+INDEXES = [
+    ('ix_organizations_building_id', 'organizations', ['building_id'], False),
+    ('ix_phones_organization_id', 'phones', ['organization_id'], False),
+    ('ix_organization_activity_organization_id', 'organization_activity', ['organization_id'], False),
+    ('ix_organization_activity_activity_id', 'organization_activity', ['activity_id'], False),
+    ('ix_organizations_name_trgm', 'organizations', ['name'], True),
+    ('ix_activities_name_trgm', 'activities', ['name'], True),
+]
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    bind = op.get_bind()
+    is_postgresql = bind.dialect.name == 'postgresql'
+    inspector = sa.inspect(bind)
+
+    if is_postgresql:
+        op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+
+    missing = [
+        (name, table, columns, trigram)
+        for name, table, columns, trigram in INDEXES
+        if (is_postgresql or not trigram)
+        and name not in {index['name'] for index in inspector.get_indexes(table)}
+    ]
+    if not missing:
+        return
+
+    # На Postgres индексы строятся CONCURRENTLY, без блокировки записи в большие таблицы
+    with op.get_context().autocommit_block():
+        for name, table, columns, trigram in missing:
+            kwargs = {'postgresql_concurrently': True} if is_postgresql else {}
+            if trigram:
+                kwargs.update(postgresql_using='gin', postgresql_ops={columns[0]: 'gin_trgm_ops'})
+            op.create_index(name, table, columns, **kwargs)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    is_postgresql = op.get_bind().dialect.name == 'postgresql'
+    for name, table, columns, trigram in reversed(INDEXES):
+        if is_postgresql or not trigram:
+            op.drop_index(name, table_name=table)
@@ -0,0 +1,95 @@
+"""buildings.geo_region и organizations.geo_region: георегионы для отсечения по координатам
+
+Revision ID: 0004_geo_region
+Revises: 0003_query_indexes
+Create Date: 2026-10-19 16:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from app.models import building_region
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0004_geo_region'
+down_revision: Union[str, Sequence[str], None] = '0003_query_indexes'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+BATCH_SIZE = 1000
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+
+    # Таблицы могли быть созданы create_all уже с новыми колонками
+    for table in ('buildings', 'organizations'):
+        columns = {column['name'] for column in inspector.get_columns(table)}
+        if 'geo_region' not in columns:
+            op.add_column(table, sa.Column('geo_region', sa.String(length=12), nullable=True))
+
+    buildings = sa.table(
+        'buildings',
+        sa.column('id', sa.Integer),
+        sa.column('latitude', sa.Float),
+        sa.column('longitude', sa.Float),
+        sa.column('geo_region', sa.String),
+    )
+
+    # Пересчитываются все здания: повторный запуск после смены GEO_REGION_PRECISION
+    # обновит регионы под новую длину
+    last_id = 0
+    while True:
+        rows = bind.execute(
+            sa.select(buildings.c.id, buildings.c.latitude, buildings.c.longitude, buildings.c.geo_region)
+            .where(buildings.c.id > last_id)
+            .order_by(buildings.c.id)
+            .limit(BATCH_SIZE)
+        ).all()
+        if not rows:
+            break
+
+        changed = [
+            {'building_id': row.id, 'value': building_region(row.latitude, row.longitude)}
+            for row in rows
+            if row.geo_region != building_region(row.latitude, row.longitude)
+        ]
+        if changed:
+            bind.execute(
+                buildings.update().where(buildings.c.id == sa.bindparam('building_id')).values(
+                    geo_region=sa.bindparam('value')
+                ),
+                changed
+            )
+        last_id = rows[-1].id
+
+    op.execute(
+        'UPDATE organizations SET geo_region = '
+        '(SELECT buildings.geo_region FROM buildings WHERE buildings.id = organizations.building_id)'
+    )
+
+    with op.batch_alter_table('buildings') as batch_op:
+        batch_op.alter_column('geo_region', existing_type=sa.String(length=12), nullable=False)
+
+    inspector = sa.inspect(bind)
+    if 'ix_buildings_geo_region' not in {index['name'] for index in inspector.get_indexes('buildings')}:
+        op.create_index('ix_buildings_geo_region', 'buildings', ['geo_region'])
+    if 'ix_organizations_geo_region_building_id' not in {
+        index['name'] for index in inspector.get_indexes('organizations')
+    }:
+        op.create_index('ix_organizations_geo_region_building_id', 'organizations', ['geo_region', 'building_id'])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_organizations_geo_region_building_id', table_name='organizations')
+    op.drop_index('ix_buildings_geo_region', table_name='buildings')
+    with op.batch_alter_table('organizations') as batch_op:
+        batch_op.drop_column('geo_region')
+    with op.batch_alter_table('buildings') as batch_op:
+        batch_op.drop_column('geo_region')
@@ -0,0 +1,125 @@
+"""секционирование buildings по geo_region (только Postgres, при GEO_PARTITIONING)
+
+Revision ID: 0005_partition_buildings
+Revises: 0004_geo_region
+Create Date: 2026-10-19 16:30:00
+
+Таблица buildings пересоздается как PARTITION BY LIST (geo_region): по секции на каждый
+встречающийся регион и секция DEFAULT для новых регионов. Первичный ключ секционированной
+таблицы обязан включать ключ секционирования, поэтому он становится (id, geo_region),
+а внешний ключ organizations - (building_id, geo_region) с ON UPDATE CASCADE: при переносе
+здания в другой регион организации переезжают вместе с ним. Перенос строки между секциями
+с таким внешним ключом корректно работает начиная с Postgres 15. Ключ объявлен MATCH FULL:
+при MATCH SIMPLE строка с building_id и geo_region = NULL не проверялась бы вовсе.
+
+organizations не секционируется: на нее ссылаются phones и organization_activity по id,
+а внешние ключи на секционированную таблицу должны включать ключ секционирования.
+Вместо этого строки организаций физически упорядочиваются по (geo_region, building_id)
+командой CLUSTER, и организации одного региона читаются с соседних страниц.
+
+Миграция держит ACCESS EXCLUSIVE на buildings и organizations на время копирования.
+Без GEO_PARTITIONING и на других СУБД ничего не делает.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from app.config import settings
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0005_partition_buildings'
+down_revision: Union[str, Sequence[str], None] = '0004_geo_region'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def _is_partitioned(bind) -> bool:
+    return bind.execute(sa.text(
+        "SELECT relkind = 'p' FROM pg_class WHERE oid = 'buildings'::regclass"
+    )).scalar()
+
+
+def _swap_buildings(bind, partitioned: bool) -> None:
+    """
+    Переносит данные buildings в новую таблицу с той же структурой и подменяет ею старую
+    """
+    op.execute('LOCK TABLE buildings, organizations IN ACCESS EXCLUSIVE MODE')
+
+    primary_key = sa.inspect(bind).get_pk_constraint('buildings')['name']
+    indexes = bind.execute(sa.text(
+        "SELECT indexdef FROM pg_indexes WHERE tablename = 'buildings' AND indexname != :primary_key"
+    ), {'primary_key': primary_key}).scalars().all()
+    sequence = bind.execute(sa.text("SELECT pg_get_serial_sequence('buildings', 'id')")).scalar()
+
+    if partitioned:
+        op.execute(
+            'CREATE TABLE buildings_new (LIKE buildings INCLUDING DEFAULTS INCLUDING CONSTRAINTS) '
+            'PARTITION BY LIST (geo_region)'
+        )
+        op.execute('ALTER TABLE buildings_new ADD PRIMARY KEY (id, geo_region)')
+        regions = bind.execute(sa.text('SELECT DISTINCT geo_region FROM buildings ORDER BY 1')).scalars().all()
+        for region in regions:
+            # Символы geohash - [0-9a-z], имя секции и литерал не требуют экранирования
+            op.execute(f"CREATE TABLE buildings_{region} PARTITION OF buildings_new FOR VALUES IN ('{region}')")
+        op.execute('CREATE TABLE buildings_default PARTITION OF buildings_new DEFAULT')
+    else:
+        op.execute('CREATE TABLE buildings_new (LIKE buildings INCLUDING DEFAULTS INCLUDING CONSTRAINTS)')
+        op.execute('ALTER TABLE buildings_new ADD PRIMARY KEY (id)')
+
+    op.execute('INSERT INTO buildings_new SELECT * FROM buildings')
+
+    for foreign_key in sa.inspect(bind).get_foreign_keys('organizations'):
+        if foreign_key['referred_table'] == 'buildings':
+            op.drop_constraint(foreign_key['name'], 'organizations', type_='foreignkey')
+
+    if sequence:
+        op.execute(f'ALTER SEQUENCE {sequence} OWNED BY buildings_new.id')
+    op.execute('DROP TABLE buildings')
+    op.execute('ALTER TABLE buildings_new RENAME TO buildings')
+    op.execute(f'ALTER TABLE buildings RENAME CONSTRAINT buildings_new_pkey TO {primary_key}')
+
+    # Определения индексов ссылаются на таблицу по имени и применяются к новой таблице;
+    # на секционированной таблице индекс создается в каждой секции
+    for indexdef in indexes:
+        op.execute(indexdef)
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    bind = op.get_bind()
+    if bind.dialect.name != 'postgresql' or not settings.GEO_PARTITIONING or _is_partitioned(bind):
+        return
+
+    _swap_buildings(bind, partitioned=True)
+    # MATCH FULL требует, чтобы обе колонки были заданы или обе пусты
+    op.execute('UPDATE organizations SET geo_region = NULL WHERE building_id IS NULL AND geo_region IS NOT NULL')
+    op.create_foreign_key(
+        'organizations_building_id_geo_region_fkey',
+        'organizations', 'buildings',
+        ['building_id', 'geo_region'], ['id', 'geo_region'],
+        ondelete='SET NULL',
+        onupdate='CASCADE',
+        match='FULL'
+    )
+
+    op.execute('CLUSTER organizations USING ix_organizations_geo_region_building_id')
+    op.execute('ANALYZE buildings')
+    op.execute('ANALYZE organizations')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    bind = op.get_bind()
+    if bind.dialect.name != 'postgresql' or not _is_partitioned(bind):
+        return
+
+    _swap_buildings(bind, partitioned=False)
+    op.create_foreign_key(
+        'organizations_building_id_fkey',
+        'organizations', 'buildings',
+        ['building_id'], ['id'],
+        ondelete='SET NULL'
+    )
+    op.execute('ANALYZE buildings')
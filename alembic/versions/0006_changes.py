@@ -0,0 +1,45 @@
+"""changes: журнал изменений справочника
+
+Revision ID: 0006_changes
+Revises: 0005_partition_buildings
+Create Date: 2026-10-20 10:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0006_changes'
+down_revision: Union[str, Sequence[str], None] = '0005_partition_buildings'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Таблица могла быть создана create_all при старте приложения
+    if sa.inspect(op.get_bind()).has_table('changes'):
+        return
+
+    op.create_table(
+        'changes',
+        sa.Column('seq', sa.BigInteger().with_variant(sa.Integer(), 'sqlite'), primary_key=True, autoincrement=True),
+        sa.Column('entity_type', sa.String(length=50), nullable=False),
+        sa.Column('entity_id', sa.Integer(), nullable=False),
+        sa.Column('operation', sa.String(length=10), nullable=False),
+        sa.Column('created_at', sa.Integer(), nullable=False),
+    )
+    op.create_index('ix_changes_entity', 'changes', ['entity_type', 'entity_id', 'seq'])
+    op.create_index('ix_changes_type_seq', 'changes', ['entity_type', 'seq'])
+    op.create_index('ix_changes_operation_created', 'changes', ['entity_type', 'operation', 'created_at'])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_changes_operation_created', table_name='changes')
+    op.drop_index('ix_changes_type_seq', table_name='changes')
+    op.drop_index('ix_changes_entity', table_name='changes')
+    op.drop_table('changes')
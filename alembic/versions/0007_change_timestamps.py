@@ -0,0 +1,59 @@
+"""buildings и activities: created_at/updated_at; индексы updated_at для выгрузки дельт
+
+Revision ID: 0007_change_timestamps
+Revises: 0006_changes
+Create Date: 2026-10-20 10:30:00
+
+"""
+import time
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0007_change_timestamps'
+down_revision: Union[str, Sequence[str], None] = '0006_changes'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+TABLES = ('buildings', 'activities')
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+
+    # Таблицы могли быть созданы create_all уже с новыми колонками
+    for table in TABLES:
+        columns = {column['name'] for column in inspector.get_columns(table)}
+        for column in ('created_at', 'updated_at'):
+            if column not in columns:
+                op.add_column(table, sa.Column(column, sa.Integer(), nullable=True))
+
+    # Время создания существующих строк неизвестно: считаем их измененными сейчас,
+    # чтобы клиенты с updated_since получили их при следующей синхронизации
+    now = int(time.time())
+    for table in TABLES:
+        op.execute(sa.text(
+            f'UPDATE {table} SET created_at = COALESCE(created_at, :now), updated_at = :now '
+            'WHERE updated_at IS NULL'
+        ).bindparams(now=now))
+
+    inspector = sa.inspect(bind)
+    for table in ('organizations',) + TABLES:
+        name = f'ix_{table}_updated_at'
+        if name not in {index['name'] for index in inspector.get_indexes(table)}:
+            op.create_index(name, table, ['updated_at'])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_organizations_updated_at', table_name='organizations')
+    for table in TABLES:
+        op.drop_index(f'ix_{table}_updated_at', table_name=table)
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.drop_column('updated_at')
+            batch_op.drop_column('created_at')
@@ -0,0 +1,41 @@
+"""buildings.deleted_at и activities.deleted_at: мягкое удаление
+
+Revision ID: 0008_soft_delete
+Revises: 0007_change_timestamps
+Create Date: 2026-10-20 11:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0008_soft_delete'
+down_revision: Union[str, Sequence[str], None] = '0007_change_timestamps'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+TABLES = ('buildings', 'activities')
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    inspector = sa.inspect(op.get_bind())
+
+    # Таблицы могли быть созданы create_all уже с новыми колонками;
+    # колонка допускает NULL, поэтому добавляется без перезаписи таблицы
+    for table in TABLES:
+        if 'deleted_at' not in {column['name'] for column in inspector.get_columns(table)}:
+            op.add_column(table, sa.Column('deleted_at', sa.Integer(), nullable=True))
+        if f'ix_{table}_deleted_at' not in {index['name'] for index in inspector.get_indexes(table)}:
+            op.create_index(f'ix_{table}_deleted_at', table, ['deleted_at'])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    for table in TABLES:
+        op.drop_index(f'ix_{table}_deleted_at', table_name=table)
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.drop_column('deleted_at')
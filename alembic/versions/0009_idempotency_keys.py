@@ -0,0 +1,37 @@
+"""idempotency_keys: результаты импортов по ключу идемпотентности
+
+Revision ID: 0009_idempotency_keys
+Revises: 0008_soft_delete
+Create Date: 2026-10-20 11:30:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0009_idempotency_keys'
+down_revision: Union[str, Sequence[str], None] = '0008_soft_delete'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Таблица могла быть создана create_all при старте приложения
+    if sa.inspect(op.get_bind()).has_table('idempotency_keys'):
+        return
+
+    op.create_table(
+        'idempotency_keys',
+        sa.Column('key', sa.String(length=255), primary_key=True),
+        sa.Column('result', sa.JSON(), nullable=False),
+        sa.Column('created_at', sa.Integer(), nullable=False),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('idempotency_keys')
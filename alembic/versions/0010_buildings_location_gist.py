@@ -0,0 +1,68 @@
+"""GiST-индекс по точке зданий для KNN-сортировки (только Postgres)
+
+Revision ID: 0010_buildings_location_gist
+Revises: 0009_idempotency_keys
+Create Date: 2026-10-20 12:00:00
+
+Индекс ix_buildings_location_gist из модели Building: без него поиск ближайших
+(GEO_KNN_USE_GIST) сортирует все здания по point(longitude, latitude) <-> точка.
+Строится CONCURRENTLY, без блокировки записи. Секционированную таблицу (0005) так
+проиндексировать нельзя, поэтому индекс строится CONCURRENTLY в каждой секции,
+создается ON ONLY на родительской таблице и секции к нему присоединяются.
+На других СУБД ничего не делает.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0010_buildings_location_gist'
+down_revision: Union[str, Sequence[str], None] = '0009_idempotency_keys'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+INDEX = 'ix_buildings_location_gist'
+
+
+def _partitions(bind) -> list:
+    return bind.execute(sa.text(
+        "SELECT inhrelid::regclass::text FROM pg_inherits WHERE inhparent = 'buildings'::regclass ORDER BY 1"
+    )).scalars().all()
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    bind = op.get_bind()
+    if bind.dialect.name != 'postgresql':
+        return
+
+    partitions = _partitions(bind)
+    with op.get_context().autocommit_block():
+        if not partitions:
+            op.execute(
+                f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {INDEX} ON buildings USING gist (point(longitude, latitude))'
+            )
+            return
+
+        for partition in partitions:
+            op.execute(
+                f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {partition}_location_gist '
+                f'ON {partition} USING gist (point(longitude, latitude))'
+            )
+        op.execute(f'CREATE INDEX IF NOT EXISTS {INDEX} ON ONLY buildings USING gist (point(longitude, latitude))')
+        attached = set(bind.execute(sa.text(
+            "SELECT inhrelid::regclass::text FROM pg_inherits WHERE inhparent = CAST(:index AS regclass)"
+        ), {'index': INDEX}).scalars().all())
+        for partition in partitions:
+            if f'{partition}_location_gist' not in attached:
+                op.execute(f'ALTER INDEX {INDEX} ATTACH PARTITION {partition}_location_gist')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    # Индексы секций удаляются вместе с индексом родительской таблицы
+    op.execute(f'DROP INDEX IF EXISTS {INDEX}')
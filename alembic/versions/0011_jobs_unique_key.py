@@ -0,0 +1,44 @@
+"""jobs.unique_key: не больше одной ожидающей задачи с ключом enqueue(unique=True)
+
+Revision ID: 0011_jobs_unique_key
+Revises: 0010_buildings_location_gist
+Create Date: 2026-10-20 12:30:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0011_jobs_unique_key'
+down_revision: Union[str, Sequence[str], None] = '0010_buildings_location_gist'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+INDEX = 'ux_jobs_unique_key_queued'
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    inspector = sa.inspect(op.get_bind())
+
+    # Таблица могла быть создана create_all уже с новой колонкой и индексом;
+    # у существующих задач ключа нет, поэтому уникальный индекс строится без конфликтов
+    if 'unique_key' not in {column['name'] for column in inspector.get_columns('jobs')}:
+        op.add_column('jobs', sa.Column('unique_key', sa.String(length=100), nullable=True))
+    if INDEX not in {index['name'] for index in inspector.get_indexes('jobs')}:
+        op.create_index(
+            INDEX, 'jobs', ['unique_key'],
+            unique=True,
+            postgresql_where=sa.text("status = 'queued'"),
+            sqlite_where=sa.text("status = 'queued'")
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(INDEX, table_name='jobs')
+    with op.batch_alter_table('jobs') as batch_op:
+        batch_op.drop_column('unique_key')
@@ -0,0 +1,235 @@
+"""
+Контроль нагрузки: ограничение одновременных запросов по маршрутам и дедлайн запроса.
+
+У каждого маршрута свой лимит одновременно выполняемых запросов и своя очередь ограниченной длины.
+Когда очередь заполнена или ожидание в ней дольше ADMISSION_QUEUE_TIMEOUT (или оставшегося времени
+до дедлайна), запрос сразу получает 503 с Retry-After и не ждет соединения пула в потоке.
+Дорогие маршруты поиска ограничены сильнее, поэтому при медленной БД отбрасываются они,
+а дешевые (например /activities/tree) продолжают обслуживаться.
+
+Дедлайн задает заголовок X-Request-Timeout (секунды) или REQUEST_TIMEOUT; оставшееся время
+хранится в contextvar и на Postgres ограничивает запросы транзакции через statement_timeout
+(app/database.py). У маршрутов ADMISSION_EXEMPT_ROUTES дедлайна нет, лидер single-flight
+выполняется без дедлайна. Лимиты и счетчики - в пределах одного воркера.
+"""
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterable, Optional
+
+import anyio
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.routing import Match, Router
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from app.config import Settings
+
+TIMEOUT_HEADER = "X-Request-Timeout"
+
+# Момент (time.monotonic()), после которого результат запроса уже не нужен клиенту
+_deadline: ContextVar[Optional[float]] = ContextVar("request_deadline", default=None)
+
+
+class DeadlineExceeded(Exception):
+    """
+    Время запроса истекло до обращения к БД
+    """
+
+
+def current_deadline() -> Optional[float]:
+    """
+    Дедлайн текущего запроса (time.monotonic()); None - дедлайна нет
+    """
+    return _deadline.get()
+
+
+def remaining() -> Optional[float]:
+    """
+    Секунды до дедлайна текущего запроса; None - дедлайна нет
+    """
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+@contextmanager
+def without_deadline():
+    """
+    Снимает дедлайн на время блока: работа, результат которой ждут и другие запросы
+    (лидер single-flight), не обрывается по дедлайну запроса, который ее начал
+    """
+    token = _deadline.set(None)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def request_timeout(value: Optional[str], app_settings: Settings) -> Optional[float]:
+    """
+    Таймаут запроса из заголовка (ограничен REQUEST_TIMEOUT_MAX) или по умолчанию
+    """
+    timeout = app_settings.REQUEST_TIMEOUT or None
+    if value:
+        try:
+            requested = float(value)
+        except ValueError:
+            requested = None
+        if requested is not None and requested > 0:
+            timeout = requested
+    if timeout is not None and app_settings.REQUEST_TIMEOUT_MAX > 0:
+        timeout = min(timeout, app_settings.REQUEST_TIMEOUT_MAX)
+    return timeout
+
+
+def overloaded_response(retry_after: int, detail: str = "Server is overloaded, retry later") -> JSONResponse:
+    return JSONResponse(
+        status_code=503,
+        content={"detail": detail},
+        headers={"Retry-After": str(retry_after)}
+    )
+
+
+class RouteLimiter:
+    def __init__(self, concurrency: int, queue_size: int):
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self.active = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self._semaphore: Optional[anyio.Semaphore] = None
+
+    async def acquire(self, timeout: float) -> bool:
+        if self._semaphore is None:
+            self._semaphore = anyio.Semaphore(self.concurrency)
+
+        try:
+            self._semaphore.acquire_nowait()
+        except anyio.WouldBlock:
+            if self.waiting >= self.queue_size or timeout <= 0:
+                self.rejected += 1
+                return False
+            self.waiting += 1
+            try:
+                with anyio.move_on_after(timeout):
+                    await self._semaphore.acquire()
+                    self.active += 1
+                    self.admitted += 1
+                    return True
+            finally:
+                self.waiting -= 1
+            self.timed_out += 1
+            return False
+
+        self.active += 1
+        self.admitted += 1
+        return True
+
+    def release(self):
+        self.active -= 1
+        self._semaphore.release()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "concurrency": self.concurrency,
+            "queue_size": self.queue_size,
+            "active": self.active,
+            "waiting": self.waiting,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+        }
+
+
+class AdmissionControl:
+    def __init__(self, app_settings: Settings):
+        self.enabled = app_settings.ADMISSION_CONTROL_ENABLED
+        self.settings = app_settings
+        self.expensive = set(app_settings.ADMISSION_EXPENSIVE_ROUTES)
+        self.exempt = set(app_settings.ADMISSION_EXEMPT_ROUTES)
+        self.limiters: Dict[str, RouteLimiter] = {}
+
+    def limiter(self, route: str) -> Optional[RouteLimiter]:
+        if route in self.exempt:
+            return None
+        limiter = self.limiters.get(route)
+        if limiter is None:
+            if route in self.expensive:
+                limits = self.settings.ADMISSION_EXPENSIVE_CONCURRENCY, self.settings.ADMISSION_EXPENSIVE_QUEUE_SIZE
+            else:
+                limits = self.settings.ADMISSION_CONCURRENCY, self.settings.ADMISSION_QUEUE_SIZE
+            limiter = self.limiters[route] = RouteLimiter(*limits)
+        return limiter
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        return {route: self.limiters[route].stats() for route in sorted(self.limiters)}
+
+    def reset(self):
+        for limiter in self.limiters.values():
+            limiter.admitted = limiter.rejected = limiter.timed_out = 0
+
+
+def _route_name(routes: Iterable, scope: Scope) -> Optional[str]:
+    for route in routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return f"{scope['method']} {route.path}"
+    return None
+
+
+class AdmissionControlMiddleware:
+    """
+    ASGI middleware: дедлайн запроса и очередь с лимитом по маршруту (шаблону пути и методу)
+    """
+
+    def __init__(self, app: ASGIApp, router: Router, control: AdmissionControl):
+        self.app = app
+        self.router = router
+        self.control = control
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        app_settings = self.control.settings
+        route = _route_name(self.router.routes, scope)
+        # Исключенные маршруты - долгие потоки и скачивание файлов: дедлайн оборвал бы их на середине
+        if route in self.control.exempt:
+            timeout = None
+        else:
+            timeout = request_timeout(Request(scope).headers.get(TIMEOUT_HEADER), app_settings)
+        token = _deadline.set(time.monotonic() + timeout if timeout is not None else None)
+        try:
+            limiter = None
+            if self.control.enabled and route is not None:
+                limiter = self.control.limiter(route)
+
+            if limiter is not None:
+                wait = app_settings.ADMISSION_QUEUE_TIMEOUT
+                if timeout is not None:
+                    wait = min(wait, remaining())
+                if not await limiter.acquire(wait):
+                    await overloaded_response(app_settings.ADMISSION_RETRY_AFTER)(scope, receive, send)
+                    return
+                try:
+                    await self.app(scope, receive, send)
+                finally:
+                    limiter.release()
+            else:
+                await self.app(scope, receive, send)
+        finally:
+            _deadline.reset(token)
+
+
+def is_statement_timeout(error: BaseException) -> bool:
+    """
+    Запрос отменен сервером по statement_timeout (SQLSTATE 57014)
+    """
+    original = getattr(error, "orig", None)
+    return (getattr(original, "pgcode", None) or getattr(original, "sqlstate", None)) == "57014"
+
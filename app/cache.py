@@ -0,0 +1,421 @@
+import logging
+import select
+import threading
+from collections import Counter, defaultdict
+from typing import Callable, Dict, List, Optional, Set
+
+from sqlalchemy import event, func, select, text
+from sqlalchemy.orm import Session
+
+from app import database, models
+from app.clusters import ClusterIndex
+from app.config import settings
+from app.geo import GeoIndex
+from app.suggest import Suggester
+
+logger = logging.getLogger(__name__)
+
+
+class CachedValue:
+    """
+    Лениво загружаемое значение, общее для всех запросов воркера
+    """
+
+    def __init__(
+            self,
+            name: str,
+            loader: Callable[[Session], object],
+            refresh_in_background: bool = False,
+            updater: Optional[Callable[[Session, object], object]] = None
+    ):
+        self.name = name
+        self._loader = loader
+        self._value = None
+        self._generation = 0
+        self._lock = threading.Lock()
+        # Для дорогих в построении значений: после сброса отдается прежнее значение,
+        # пока новое строится в фоновом потоке
+        self._refresh_in_background = refresh_in_background
+        self._stale = None
+        self._refreshing = False
+        # updater(db, value) догоняет значение после сброса вместо перестройки: возвращает новое значение,
+        # то же самое, если изменений нет, или None, если изменений слишком много и нужно построить заново
+        self._updater = updater
+        self._outdated = False
+        self._updating = threading.Lock()
+
+    def get(self, db: Session):
+        value = self._value
+        if value is not None:
+            if self._outdated:
+                return self._update(db, value)
+            return value
+
+        stale = self._stale
+        if stale is not None:
+            self._start_refresh()
+            return stale
+
+        generation = self._generation
+        value = self._loader(db)
+
+        with self._lock:
+            # Если кэш сбросили во время загрузки, значение уже устарело
+            if generation == self._generation:
+                self._value = value
+        return value
+
+    @property
+    def stale(self) -> bool:
+        """
+        Сброшено и еще строится в фоне: get отдает прежнее значение
+        """
+        return self._value is None and self._stale is not None
+
+    def invalidate(self):
+        with self._lock:
+            self._generation += 1
+            if self._updater is not None and self._value is not None:
+                self._outdated = True
+                return
+            if self._refresh_in_background and self._value is not None:
+                self._stale = self._value
+            self._value = None
+
+    def _update(self, db: Session, value):
+        # Догоняет один поток, остальные пока получают текущее значение
+        if not self._updating.acquire(blocking=False):
+            return value
+        try:
+            generation = self._generation
+            updated = self._updater(db, value)
+            with self._lock:
+                if updated is None:
+                    self._generation += 1
+                    self._outdated = False
+                    if self._refresh_in_background:
+                        self._stale = value
+                    self._value = None
+                elif self._value is value:
+                    self._value = updated
+                    # Значение актуально, когда догонять уже нечего и за это время его снова не сбросили
+                    if updated is value and generation == self._generation:
+                        self._outdated = False
+        finally:
+            self._updating.release()
+        if updated is None:
+            if self._refresh_in_background:
+                self._start_refresh()
+            return value
+        return updated
+
+    def _start_refresh(self):
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        threading.Thread(target=self._refresh, name=f"cache-refresh-{self.name}", daemon=True).start()
+
+    def _refresh(self):
+        db = database.SessionLocal()
+        try:
+            generation = self._generation
+            value = self._loader(db)
+            with self._lock:
+                # Если за время построения кэш снова сбросили, следующий get запустит еще одно
+                if generation == self._generation:
+                    self._value = value
+                    self._stale = None
+        except Exception:
+            logger.exception("Background refresh of cache %s failed", self.name)
+        finally:
+            db.close()
+            with self._lock:
+                self._refreshing = False
+
+
+_registry: Dict[str, CachedValue] = {}
+
+
+def register(
+        name: str,
+        loader: Callable[[Session], object],
+        refresh_in_background: bool = False,
+        updater: Optional[Callable[[Session, object], object]] = None
+) -> CachedValue:
+    cached = CachedValue(name, loader, refresh_in_background, updater)
+    _registry[name] = cached
+    return cached
+
+
+def invalidate(*names: str):
+    for name in names:
+        cached = _registry.get(name)
+        if cached is not None:
+            cached.invalidate()
+
+
+def invalidate_all():
+    for cached in _registry.values():
+        cached.invalidate()
+
+
+def mark_stale(db: Session, *names: str):
+    """
+    Помечает кэши устаревшими в текущей транзакции.
+    Локально кэши сбрасываются после commit, остальным воркерам уходит NOTIFY
+    (Postgres доставляет его только при успешном commit)
+    """
+    db.info.setdefault("stale_caches", set()).update(names)
+
+    if settings.CACHE_NOTIFY_ENABLED and names and db.get_bind().dialect.name == "postgresql":
+        # Все уведомления одним запросом
+        db.execute(
+            text("SELECT pg_notify(:channel, payload) FROM unnest(CAST(:payloads AS text[])) AS payload"),
+            {"channel": settings.CACHE_NOTIFY_CHANNEL, "payloads": list(names)}
+        )
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_after_commit(db: Session):
+    invalidate(*db.info.pop("stale_caches", ()))
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_after_rollback(db: Session):
+    db.info.pop("stale_caches", None)
+
+
+class InvalidationListener(threading.Thread):
+    """
+    Поток воркера, который слушает канал NOTIFY и сбрасывает локальные кэши
+    """
+
+    def __init__(self, channel: str, poll_timeout: float = 5.0, reconnect_delay: float = 1.0):
+        super().__init__(name="cache-invalidation-listener", daemon=True)
+        self.channel = channel
+        self.poll_timeout = poll_timeout
+        self.reconnect_delay = reconnect_delay
+        self._stopped = threading.Event()
+        self._reconnecting = False
+
+    def stop(self):
+        self._stopped.set()
+
+    def run(self):
+        while not self._stopped.is_set():
+            try:
+                self._listen()
+            except Exception:
+                logger.exception("Cache invalidation listener failed, reconnecting")
+                self._stopped.wait(self.reconnect_delay)
+
+    def _listen(self):
+        # Отдельное соединение вне пула, чтобы не занимать слот запросов
+        connection = database.engine.raw_connection()
+        connection.detach()
+        dbapi_connection = connection.driver_connection
+        try:
+            dbapi_connection.autocommit = True
+            with dbapi_connection.cursor() as cursor:
+                cursor.execute(f'LISTEN "{self.channel}"')
+
+            # Пока соединения не было, уведомления могли потеряться
+            if self._reconnecting:
+                invalidate_all()
+            self._reconnecting = True
+
+            while not self._stopped.is_set():
+                names = self._receive(dbapi_connection)
+                if names:
+                    invalidate(*names)
+        finally:
+            connection.close()
+
+    def _receive(self, dbapi_connection) -> Set[str]:
+        """
+        Имена кэшей из уведомлений, пришедших за poll_timeout
+        """
+        if not hasattr(dbapi_connection, "poll"):
+            # psycopg 3: генератор уведомлений, возвращается после первого или по таймауту
+            return {
+                notify.payload
+                for notify in dbapi_connection.notifies(timeout=self.poll_timeout, stop_after=1)
+            }
+
+        readable, _, _ = select.select([dbapi_connection], [], [], self.poll_timeout)
+        if not readable:
+            return set()
+        dbapi_connection.poll()
+        names = set()
+        while dbapi_connection.notifies:
+            names.add(dbapi_connection.notifies.pop(0).payload)
+        return names
+
+
+def start_listener() -> Optional[InvalidationListener]:
+    if not settings.CACHE_NOTIFY_ENABLED or database.engine.dialect.name != "postgresql":
+        return None
+
+    listener = InvalidationListener(settings.CACHE_NOTIFY_CHANNEL)
+    listener.start()
+    return listener
+
+
+def prime(db: Session):
+    """
+    Заполняет все зарегистрированные кэши
+    """
+    for cached in _registry.values():
+        cached.get(db)
+
+
+class ActivityTree:
+    """
+    Структура дерева видов деятельности: parent_id -> [id детей]
+    """
+
+    def __init__(self, edges: List[tuple]):
+        self.children: Dict[Optional[int], List[int]] = defaultdict(list)
+        self.parents: Dict[int, Optional[int]] = {}
+        for activity_id, parent_id in edges:
+            self.children[parent_id].append(activity_id)
+            self.parents[activity_id] = parent_id
+
+    def descendants(self, activity_id: int) -> List[int]:
+        """
+        ID активности и всех её потомков
+        """
+        result = [activity_id]
+        stack = [activity_id]
+        while stack:
+            children = self.children.get(stack.pop(), [])
+            result.extend(children)
+            stack.extend(children)
+        return result
+
+    def root(self, activity_id: int) -> Optional[int]:
+        """
+        ID вида деятельности верхнего уровня, к которому относится активность
+        """
+        if activity_id not in self.parents:
+            return None
+        while self.parents.get(activity_id) is not None:
+            activity_id = self.parents[activity_id]
+        return activity_id
+
+
+def _load_activity_tree(db: Session) -> ActivityTree:
+    return ActivityTree(
+        db.query(models.Activity.id, models.Activity.parent_id).filter(models.Activity.deleted_at.is_(None)).all()
+    )
+
+
+def _load_geo_index(db: Session) -> GeoIndex:
+    points = db.query(models.Building.id, models.Building.latitude, models.Building.longitude).filter(
+        models.Building.deleted_at.is_(None)
+    ).all()
+    return GeoIndex(points, settings.GEO_INDEX_CELL_SIZE)
+
+
+def _load_building_clusters(db: Session) -> ClusterIndex:
+    buildings = db.query(models.Building.id, models.Building.latitude, models.Building.longitude).filter(
+        models.Building.deleted_at.is_(None)
+    ).all()
+
+    organizations_count = dict(
+        db.query(models.Organization.building_id, func.count(models.Organization.id)).filter(
+            models.Organization.building_id.isnot(None)
+        ).group_by(models.Organization.building_id).all()
+    )
+
+    # Организация учитывается в виде деятельности верхнего уровня один раз,
+    # даже если у нее несколько видов из одного поддерева
+    tree = activity_tree.get(db)
+    roots_by_organization = defaultdict(set)
+    for building_id, organization_id, activity_id in db.query(
+            models.Organization.building_id, models.Organization.id, models.organization_activity.c.activity_id
+    ).join(
+        models.organization_activity, models.organization_activity.c.organization_id == models.Organization.id
+    ).filter(models.Organization.building_id.isnot(None)).all():
+        root_id = tree.root(activity_id)
+        if root_id is not None:
+            roots_by_organization[(building_id, organization_id)].add(root_id)
+
+    activities = defaultdict(Counter)
+    for (building_id, _), root_ids in roots_by_organization.items():
+        activities[building_id].update(root_ids)
+
+    return ClusterIndex(buildings, organizations_count, activities, settings.CLUSTER_CELLS_PER_TILE)
+
+
+SUGGEST_ENTITY_TYPES = ("organization", "activity")
+
+
+def _suggest_names(model, ids=None):
+    query = select(model.id, model.name)
+    if model is models.Activity:
+        query = query.where(models.Activity.deleted_at.is_(None))
+    if ids is not None:
+        query = query.where(model.id.in_(ids))
+    return query
+
+
+def _load_suggest_index(db: Session) -> Suggester:
+    # Граница журнала читается до названий: изменения после нее применит _update_suggest_index
+    from app.crud import get_change_watermark
+    version = get_change_watermark(db)
+    return Suggester({
+        "organization": db.execute(_suggest_names(models.Organization)).all(),
+        "activity": db.execute(_suggest_names(models.Activity)).all(),
+    }, version)
+
+
+def _update_suggest_index(db: Session, suggester: Suggester) -> Optional[Suggester]:
+    """
+    Применяет к индексу подсказок изменения организаций и видов деятельности из журнала после suggester.version:
+    текущие названия измененных записей (удаленные - None). Если изменений накопилось больше
+    SUGGEST_MAX_CHANGES, возвращает None - индекс строится заново
+    """
+    from app.crud import get_change_watermark
+    watermark = get_change_watermark(db)
+    limit = settings.SUGGEST_MAX_CHANGES - suggester.changed_count() + 1
+    rows = db.execute(
+        select(models.Change.seq, models.Change.entity_type, models.Change.entity_id).where(
+            models.Change.seq > suggester.version,
+            models.Change.entity_type.in_(SUGGEST_ENTITY_TYPES)
+        ).order_by(models.Change.seq).limit(limit)
+    ).all()
+    if not rows:
+        return suggester
+    if len(rows) == limit:
+        return None
+
+    # Записи за границей журнала применяются, когда граница до них дойдет: значение остается устаревшим
+    visible = [row for row in rows if row.seq <= watermark]
+    changed_ids = defaultdict(set)
+    for row in visible:
+        changed_ids[row.entity_type].add(row.entity_id)
+
+    changes = {}
+    for entity_type, model in (("organization", models.Organization), ("activity", models.Activity)):
+        ids = changed_ids.get(entity_type)
+        if ids:
+            names = dict(db.execute(_suggest_names(model, ids)).all())
+            changes[entity_type] = {entity_id: names.get(entity_id) for entity_id in ids}
+    return suggester.with_changes(changes, max(suggester.version, watermark))
+
+
+ACTIVITY_TREE = "activity_tree"
+GEO_INDEX = "geo_index"
+BUILDING_CLUSTERS = "building_clusters"
+SUGGEST_INDEX = "suggest_index"
+
+activity_tree = register(ACTIVITY_TREE, _load_activity_tree)
+geo_index = register(GEO_INDEX, _load_geo_index)
+# Агрегаты кластеров пересчитываются по всем зданиям и организациям: после записи это делает
+# фоновый поток, а запросы до готовности получают прежние
+building_clusters = register(BUILDING_CLUSTERS, _load_building_clusters, refresh_in_background=True)
+suggest_index = register(
+    SUGGEST_INDEX, _load_suggest_index, refresh_in_background=True, updater=_update_suggest_index
+)
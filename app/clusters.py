@@ -0,0 +1,129 @@
+import math
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+MAX_MERCATOR_LAT = 85.05112878  # Широта, на которой обрезается проекция web-mercator
+
+
+def mercator_cell(lat: float, lon: float, grid_size: int) -> Tuple[int, int]:
+    """
+    Ячейка сетки grid_size x grid_size в проекции web-mercator (как у тайлов карты)
+    """
+    lat = max(-MAX_MERCATOR_LAT, min(MAX_MERCATOR_LAT, lat))
+    x = (lon + 180.0) / 360.0
+    y = (1.0 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2.0
+    return min(int(x * grid_size), grid_size - 1), min(int(y * grid_size), grid_size - 1)
+
+
+class Cluster:
+    """
+    Агрегат зданий одной ячейки
+    """
+    __slots__ = ("count", "organizations_count", "sum_lat", "sum_lon", "building_id", "activities")
+
+    def __init__(self):
+        self.count = 0
+        self.organizations_count = 0
+        self.sum_lat = 0.0
+        self.sum_lon = 0.0
+        self.building_id: Optional[int] = None
+        self.activities: Counter = Counter()
+
+    def add(self, building_id: int, lat: float, lon: float, organizations_count: int, activities: Counter):
+        self.count += 1
+        self.organizations_count += organizations_count
+        self.sum_lat += lat
+        self.sum_lon += lon
+        self.building_id = building_id if self.count == 1 else None
+        self.activities.update(activities)
+
+    @property
+    def latitude(self) -> float:
+        return self.sum_lat / self.count
+
+    @property
+    def longitude(self) -> float:
+        return self.sum_lon / self.count
+
+
+class ClusterIndex:
+    """
+    Кластеры зданий по уровням масштаба карты.
+    На уровне zoom мир делится на 2^zoom * cells_per_tile ячеек по каждой оси;
+    агрегаты уровня считаются при первом обращении и хранятся до сброса кэша
+    """
+
+    def __init__(
+            self,
+            buildings: List[Tuple[int, float, float]],
+            organizations_count: Dict[int, int],
+            activities: Dict[int, Counter],
+            cells_per_tile: int
+    ):
+        self.buildings = buildings
+        self.organizations_count = organizations_count
+        self.activities = activities
+        self.cells_per_tile = cells_per_tile
+        self._levels: Dict[int, Dict[Tuple[int, int], Cluster]] = {}
+
+    def grid_size(self, zoom: int) -> int:
+        return (2 ** zoom) * self.cells_per_tile
+
+    def level(self, zoom: int) -> Dict[Tuple[int, int], Cluster]:
+        cells = self._levels.get(zoom)
+        if cells is not None:
+            return cells
+
+        grid_size = self.grid_size(zoom)
+        cells = {}
+        empty = Counter()
+        for building_id, lat, lon in self.buildings:
+            key = mercator_cell(lat, lon, grid_size)
+            cluster = cells.get(key)
+            if cluster is None:
+                cluster = cells[key] = Cluster()
+            cluster.add(
+                building_id, lat, lon,
+                self.organizations_count.get(building_id, 0),
+                self.activities.get(building_id, empty)
+            )
+
+        # Одновременный расчет в двух потоках даст одинаковый результат, блокировка не нужна
+        self._levels[zoom] = cells
+        return cells
+
+    def in_bbox(
+            self,
+            zoom: int,
+            min_lat: float,
+            min_lon: float,
+            max_lat: float,
+            max_lon: float
+    ) -> List[Cluster]:
+        """
+        Кластеры, ячейки которых пересекают прямоугольник.
+        min_lon > max_lon - прямоугольник пересекает антимеридиан
+        """
+        cells = self.level(zoom)
+        grid_size = self.grid_size(zoom)
+
+        ranges = [(min_lon, max_lon)]
+        if min_lon > max_lon:
+            ranges = [(min_lon, 180.0), (-180.0, max_lon)]
+
+        result = []
+        for range_min_lon, range_max_lon in ranges:
+            # Ось y проекции направлена на юг
+            min_x, min_y = mercator_cell(max_lat, range_min_lon, grid_size)
+            max_x, max_y = mercator_cell(min_lat, range_max_lon, grid_size)
+
+            # Если прямоугольник накрывает больше ячеек, чем их заполнено, дешевле обойти заполненные
+            if (max_x - min_x + 1) * (max_y - min_y + 1) > len(cells):
+                result.extend(cluster for (x, y), cluster in cells.items()
+                              if min_x <= x <= max_x and min_y <= y <= max_y)
+            else:
+                result.extend(cells[(x, y)]
+                              for x in range(min_x, max_x + 1)
+                              for y in range(min_y, max_y + 1)
+                              if (x, y) in cells)
+        return result
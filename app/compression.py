@@ -0,0 +1,51 @@
+"""
+Сжатие ответов (Brotli или gzip) кроме файлов снимков.
+
+Файлы снимков, дельт и реплик (маршруты с response_class=FileResponse, application/vnd.sqlite3)
+и любые запросы с Range отдаются без сжатия: при сжатии ответ передается чанками без
+Content-Length, 206 со сжатым телом не соответствует запрошенному диапазону байт, а sha256
+из манифеста не совпал бы с телом. Остальные ответы сжимаются как раньше.
+"""
+import inspect
+
+from brotli_asgi import BrotliMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse
+from starlette.routing import Match, Router
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from app.config import Settings
+
+
+def _serves_file(route) -> bool:
+    response_class = getattr(route, "response_class", None)
+    return inspect.isclass(response_class) and issubclass(response_class, FileResponse)
+
+
+class CompressionMiddleware:
+    """
+    ASGI middleware: сжимает ответ, если запрос не к файлу и без Range
+    """
+
+    def __init__(self, app: ASGIApp, router: Router, app_settings: Settings):
+        self.app = app
+        self.router = router
+        # BrotliMiddleware отдает br клиентам с Accept-Encoding: br, остальным gzip
+        if app_settings.BROTLI_ENABLED:
+            self.compressed = BrotliMiddleware(app, minimum_size=app_settings.GZIP_MINIMUM_SIZE, gzip_fallback=True)
+        else:
+            self.compressed = GZipMiddleware(app, minimum_size=app_settings.GZIP_MINIMUM_SIZE)
+
+    def _is_file(self, scope: Scope) -> bool:
+        for route in self.router.routes:
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                return _serves_file(route)
+        return False
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or "range" in Headers(scope=scope) or self._is_file(scope):
+            await self.app(scope, receive, send)
+            return
+        await self.compressed(scope, receive, send)
@@ -1,3 +1,5 @@
+from typing import List, Optional
+
 from pydantic_settings import BaseSettings
 
 
@@ -12,9 +14,160 @@ class Settings(BaseSettings):
 
     MAX_ACTIVITY_LEVEL: int = 3
 
+    # Действия при старте воркера (выполняются в lifespan, а не при импорте)
+    DB_CREATE_ALL_ON_STARTUP: bool = True
+    SEED_ON_STARTUP: bool = True
+    WARMUP_POOL_CONNECTIONS: int = 0
+    WARMUP_CACHES: bool = True
+
+    # Размер ячейки сетки геоиндекса в градусах
+    GEO_INDEX_CELL_SIZE: float = 0.01
+
+    # Георегион здания - префикс geohash этой длины (3 - ячейки около 150 км).
+    # При смене длины регионы нужно пересчитать миграцией 0004_geo_region
+    GEO_REGION_PRECISION: int = 3
+    # Если прямоугольник запроса накрывает больше регионов, условие по регионам не добавляется
+    GEO_REGION_MAX_CELLS: int = 64
+    # Секционирование buildings по регионам на Postgres (миграция 0005_partition_buildings)
+    GEO_PARTITIONING: bool = False
+
+    # Код страны для нормализации телефонов без "+"
+    PHONE_DEFAULT_COUNTRY_CODE: str = "7"
+
+    # Мягкое удаление зданий и видов деятельности с последующей пакетной очисткой
+    SOFT_DELETE_ENABLED: bool = False
+    PURGE_BATCH_SIZE: int = 500
+
+    # Ключ админских эндпоинтов (/admin); без него они недоступны
+    ADMIN_API_KEY: Optional[str] = None
+
+    # Сэмплирующий профайлер: период сэмплирования, предел длительности,
+    # доля профилируемых запросов по маршрутам (0 - выключено)
+    PROFILE_SAMPLE_INTERVAL: float = 0.005
+    PROFILE_MAX_SECONDS: float = 60.0
+    PROFILE_ROUTE_SAMPLE_RATE: float = 0.0
+
+    # Фоновые задачи (app.jobs)
+    JOB_WORKER_IN_PROCESS: bool = True
+    JOB_POLL_INTERVAL: float = 1.0
+    JOB_MAX_ATTEMPTS: int = 3
+    JOB_RETRY_BASE_DELAY: float = 5.0
+    JOB_RETRY_MAX_DELAY: float = 600.0
+    # Выполняющаяся задача продлевает блокировку (locked_at) раз в JOB_HEARTBEAT_INTERVAL секунд;
+    # задача, у которой блокировка не продлевалась дольше JOB_LOCK_TIMEOUT, считается брошенной упавшим воркером
+    JOB_HEARTBEAT_INTERVAL: float = 30.0
+    JOB_LOCK_TIMEOUT: int = 600
+    # Массовые операции больше этого числа строк выполняются задачей
+    JOB_INLINE_MAX_IDS: int = 100
+
+    # Объединение одинаковых одновременных запросов чтения (app/singleflight.py).
+    # Окно (секунды) - сколько результат после завершения отдается новым запросам; 0 - только одновременным.
+    # Ожидающий запрос ждет первый не дольше SINGLE_FLIGHT_WAIT_TIMEOUT секунд и затем выполняется сам
+    SINGLE_FLIGHT_ENABLED: bool = True
+    SINGLE_FLIGHT_WINDOW: float = 0.0
+    SINGLE_FLIGHT_WAIT_TIMEOUT: float = 10.0
+
+    # Офлайн-снимки для мобильных клиентов (app/snapshots.py): каталог (общий для web и worker),
+    # сколько последних снимков и дельт хранить, длина geohash-ячеек зданий в снимке
+    SNAPSHOT_DIR: str = "snapshots"
+    SNAPSHOT_KEEP: int = 3
+    SNAPSHOT_DELTA_KEEP: int = 100
+    SNAPSHOT_GEO_CELL_PRECISION: int = 6
+
+    # Контроль нагрузки (app/admission.py): одновременно выполняемые запросы и длина очереди на маршрут
+    # ("МЕТОД /путь"). Дорогие маршруты ограничены сильнее, исключенные (долгие потоки) не ограничиваются.
+    # Дольше ADMISSION_QUEUE_TIMEOUT в очереди запрос не ждет: 503 и Retry-After
+    ADMISSION_CONTROL_ENABLED: bool = True
+    ADMISSION_CONCURRENCY: int = 32
+    ADMISSION_QUEUE_SIZE: int = 64
+    ADMISSION_EXPENSIVE_CONCURRENCY: int = 4
+    ADMISSION_EXPENSIVE_QUEUE_SIZE: int = 8
+    ADMISSION_EXPENSIVE_ROUTES: List[str] = [
+        "GET /api/v1/organizations/search",
+        "GET /api/v1/organizations/nearby",
+        "GET /api/v1/organizations/nearest",
+        "GET /api/v1/organizations/by-activity/{activity_id}",
+        "GET /api/v1/buildings/clusters",
+    ]
+    ADMISSION_EXEMPT_ROUTES: List[str] = [
+        "GET /api/v1/changes",
+        "GET /api/v1/changes/stream",
+        "GET /api/v1/snapshots/{version}",
+        "GET /api/v1/snapshots/deltas/{from_version}/{to_version}",
+        "GET /api/v1/snapshots/replica/{version}",
+    ]
+    ADMISSION_QUEUE_TIMEOUT: float = 2.0
+    ADMISSION_RETRY_AFTER: int = 1
+    # Дедлайн запроса (секунды) без заголовка X-Request-Timeout; 0 - без дедлайна.
+    # На Postgres оставшееся время становится statement_timeout транзакций запроса
+    REQUEST_TIMEOUT: float = 0.0
+    REQUEST_TIMEOUT_MAX: float = 60.0
+
+    # Реплика для чтения (app/replica.py): файл SQLite со всеми таблицами справочника строит основной
+    # экземпляр в SNAPSHOT_DIR. С READ_SNAPSHOT_MODE воркер не подключается к БД, отвечает на GET из локальной
+    # копии (READ_SNAPSHOT_LOCAL_DIR) и раз в READ_SNAPSHOT_REFRESH_INTERVAL секунд ищет новую версию
+    # в READ_SNAPSHOT_SOURCE - каталоге или URL API основного экземпляра (http://primary:8000/api/v1);
+    # пусто - SNAPSHOT_DIR. Реплика старше READ_SNAPSHOT_MAX_AGE секунд не обслуживается (0 - без ограничения)
+    READ_SNAPSHOT_MODE: bool = False
+    READ_SNAPSHOT_SOURCE: str = ""
+    READ_SNAPSHOT_SOURCE_API_KEY: Optional[str] = None
+    READ_SNAPSHOT_LOCAL_DIR: str = "replica"
+    READ_SNAPSHOT_REFRESH_INTERVAL: float = 60.0
+    READ_SNAPSHOT_FETCH_TIMEOUT: float = 60.0
+    READ_SNAPSHOT_MAX_AGE: float = 0.0
+    READ_SNAPSHOT_POOL_SIZE: int = 40
+
+    # Максимум id в одном multi-get запросе (?ids=)
+    MULTI_GET_MAX_IDS: int = 1000
+
+    # Поиск ближайших организаций
+    GEO_KNN_USE_GIST: bool = True
+    NEAREST_MAX_K: int = 100
+
+    # Подсказки по префиксу (/suggest)
+    SUGGEST_MAX_LIMIT: int = 50
+    # Сколько измененных названий индекс подсказок применяет поверх построенного, прежде чем строится заново;
+    # вместе с SUGGEST_MAX_LIMIT не больше 128 (лучших записей частого префикса, app/suggest.py)
+    SUGGEST_MAX_CHANGES: int = 64
+
+    # Кластеризация зданий для карты: ячеек на тайл по каждой оси и максимальный zoom
+    CLUSTER_CELLS_PER_TILE: int = 4
+    CLUSTER_MAX_ZOOM: int = 18
+
+    # Число воркеров gunicorn; выставляется в gunicorn_conf.py для всех воркеров
+    WEB_CONCURRENCY: int = 1
+
+    # Бюджет соединений к Postgres на все воркеры (должен быть меньше max_connections)
+    DB_MAX_CONNECTIONS: int = 90
+    # Явный размер пула на воркер; по умолчанию делится из DB_MAX_CONNECTIONS
+    DB_POOL_SIZE: Optional[int] = None
+    DB_MAX_OVERFLOW: int = 0
+    DB_POOL_TIMEOUT: float = 30.0
+    # Серверные подготовленные запросы (только драйвер psycopg 3): запрос готовится на соединении
+    # после DB_PREPARE_THRESHOLD выполнений. За pgbouncer в transaction mode их нужно выключить
+    DB_PREPARED_STATEMENTS: bool = True
+    DB_PREPARE_THRESHOLD: int = 5
+
+    # Межворкерная инвалидация кэшей через LISTEN/NOTIFY
+    CACHE_NOTIFY_ENABLED: bool = True
+    CACHE_NOTIFY_CHANNEL: str = "cache_invalidation"
+
+    # Журнал изменений: long-polling и SSE
+    CHANGES_POLL_INTERVAL: float = 1.0
+    CHANGES_MAX_WAIT: float = 30.0
+    CHANGES_HEARTBEAT_INTERVAL: float = 15.0
+    # Граница видимости журнала (crud.get_change_watermark): через сколько секунд пропуск в seq
+    # считается откатом, а не незафиксированной транзакцией, и сколько последних записей проверять
+    CHANGES_GAP_TIMEOUT: float = 5.0
+    CHANGES_GAP_SCAN: int = 1000
+
+    # Сжатие ответов
+    GZIP_MINIMUM_SIZE: int = 1024
+    BROTLI_ENABLED: bool = True
+
     class Config:
         env_file = ".env"
         case_sensitive = True
 
 
-settings = Settings()
\ No newline at end of file
+settings = Settings()
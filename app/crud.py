@@ -1,105 +1,419 @@
-from sqlalchemy.orm import Session
-from sqlalchemy import or_, and_, func
-from typing import List, Optional, Tuple
-import math
-from app import models, schemas
+from sqlalchemy.orm import Session, joinedload, load_only, noload, selectinload
+from sqlalchemy import Select, bindparam, delete, func, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm.attributes import set_committed_value
+from itertools import islice
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+import time
+from app import cache, models, schemas
+from app.loaders import activity_children, get_loader
+from app.phones import normalize_phone
+from app.statements import cached_statement
+from app.clusters import Cluster
 from app.config import settings
+from app.geo import bounding_box, geohash_cells, min_distance_beyond, order_by_distance
 
 
-def haversine_distance(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+def record_change(db: Session, entity_type: str, entity_ids: List[int], operation: str):
     """
-    Расчет расстояния между двумя точками (в метрах)
-    Использует формулу гаверсинусов
+    Добавляет записи в журнал изменений в текущей транзакции.
+    seq выдает последовательность без блокировок, поэтому записи параллельных транзакций могут
+    становиться видимыми не по порядку seq; читатели журнала не заходят дальше get_change_watermark
     """
-    R = 6371000  # Радиус Земли в метрах
+    db.add_all([
+        models.Change(entity_type=entity_type, entity_id=entity_id, operation=operation)
+        for entity_id in entity_ids
+    ])
 
-    phi1 = math.radians(lat1)
-    phi2 = math.radians(lat2)
-    delta_phi = math.radians(lat2 - lat1)
-    delta_lambda = math.radians(lon2 - lon1)
 
-    a = (math.sin(delta_phi / 2) ** 2 +
-         math.cos(phi1) * math.cos(phi2) *
-         math.sin(delta_lambda / 2) ** 2)
-    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+_LAST_SEQ = select(func.coalesce(func.max(models.Change.seq), 0))
 
-    return R * c
+# Последние CHANGES_GAP_SCAN записей с seq предыдущей записи
+_RECENT_CHANGES = select(
+    models.Change.seq,
+    models.Change.created_at,
+    func.lag(models.Change.seq).over(order_by=models.Change.seq).label("previous")
+).where(models.Change.seq > _LAST_SEQ.scalar_subquery() - bindparam("scan")).subquery()
 
+# Seq перед первым пропуском номеров, за которым есть недавняя запись: пропущенный номер может
+# принадлежать еще не зафиксированной транзакции. Без таких пропусков - последний seq
+_CHANGE_WATERMARK = select(func.coalesce(
+    select(_RECENT_CHANGES.c.previous).where(
+        _RECENT_CHANGES.c.created_at >= bindparam("cutoff"),
+        _RECENT_CHANGES.c.seq - _RECENT_CHANGES.c.previous > 1
+    ).order_by(_RECENT_CHANGES.c.seq).limit(1).scalar_subquery(),
+    _LAST_SEQ.scalar_subquery()
+))
 
-def get_organization(db: Session, organization_id: int) -> Optional[models.Organization]:
-    return db.query(models.Organization).filter(models.Organization.id == organization_id).first()
 
+def get_change_watermark(db: Session) -> int:
+    """
+    Граница видимости журнала: seq, до которого включительно новых записей уже не появится.
+    На Postgres номер, выданный транзакции, которая еще не зафиксирована, выглядит как пропуск.
+    Пропуск старше CHANGES_GAP_TIMEOUT считается откатом (транзакции crud фиксируются сразу
+    после record_change); пропуски дальше CHANGES_GAP_SCAN записей от конца не проверяются
+    """
+    if db.get_bind().dialect.name != "postgresql":
+        # SQLite выполняет пишущие транзакции по очереди: seq видны в порядке commit
+        return db.execute(_LAST_SEQ).scalar()
+    return db.execute(_CHANGE_WATERMARK, {
+        "scan": settings.CHANGES_GAP_SCAN,
+        "cutoff": int(time.time() - settings.CHANGES_GAP_TIMEOUT)
+    }).scalar()
 
-def get_organizations(db: Session, skip: int = 0, limit: int = 100) -> List[models.Organization]:
-    return db.query(models.Organization).offset(skip).limit(limit).all()
 
+def get_changes(db: Session, since: int = 0, limit: int = 100) -> List[models.Change]:
+    return db.query(models.Change).filter(
+        models.Change.seq > since,
+        models.Change.seq <= get_change_watermark(db)
+    ).order_by(models.Change.seq).limit(limit).all()
 
-def create_organization(db: Session, organization: schemas.OrganizationCreate) -> models.Organization:
+
+_CHANGE_VERSION = select(models.Change.seq, models.Change.created_at).where(
+    models.Change.entity_type == bindparam("entity_type"),
+    models.Change.seq <= bindparam("watermark")
+).order_by(models.Change.seq.desc()).limit(1)
+
+_ENTITY_CHANGE_VERSION = _CHANGE_VERSION.where(models.Change.entity_id == bindparam("entity_id"))
+
+
+def get_change_version(
+        db: Session,
+        entity_types: List[str],
+        entity_id: Optional[int] = None
+) -> Tuple[int, int]:
+    """
+    Версия данных по журналу изменений: (последний seq до границы видимости, его время).
+    Каждый тип запрашивается отдельно, чтобы max брался обратным проходом по индексу
+    """
+    statement = _CHANGE_VERSION if entity_id is None else _ENTITY_CHANGE_VERSION
+    watermark = get_change_watermark(db)
+    version = (0, 0)
+    for entity_type in entity_types:
+        latest = db.execute(
+            statement, {"entity_type": entity_type, "entity_id": entity_id, "watermark": watermark}
+        ).first()
+        if latest is not None and latest.seq > version[0]:
+            version = (latest.seq, latest.created_at)
+    return version
+
+
+def _organization_options(projection: schemas.OrganizationProjection, *extra_columns: str) -> list:
+    """
+    Опции загрузки только колонок и связей из проекции.
+    Незапрошенные связи не загружаются вовсе (noload), в т.ч. activities с lazy="selectin"
+    """
+    columns = set(projection.columns) | set(extra_columns)
+    options = [load_only(*[getattr(models.Organization, column) for column in sorted(columns)])]
+    for relation in schemas.ORGANIZATION_RELATIONS:
+        attribute = getattr(models.Organization, relation)
+        if relation not in projection.relations:
+            options.append(noload(attribute))
+        elif relation == "building":
+            options.append(joinedload(attribute))
+        elif relation == "activities":
+            options.append(activity_children(attribute))
+        else:
+            options.append(selectinload(attribute))
+    return options
+
+
+def query_organizations(db: Session, projection: Optional[schemas.OrganizationProjection] = None, *extra_columns: str):
+    """
+    Запрос организаций, загружающий только колонки и связи из проекции
+    """
+    query = db.query(models.Organization)
+    if projection is None:
+        return query
+    return query.options(*_organization_options(projection, *extra_columns))
+
+
+def select_organizations(
+        name: str,
+        projection: Optional[schemas.OrganizationProjection],
+        refine: Callable[[Select], Select]
+) -> Select:
+    """
+    Готовый select организаций для горячего запроса name: условия добавляет refine (значения - через bindparam),
+    опции загрузки - проекция. Строится один раз на пару (name, проекция)
+    """
+    projection_key = projection.key() if projection is not None else None
+
+    def build() -> Select:
+        statement = select(models.Organization)
+        if projection is not None:
+            statement = statement.options(*_organization_options(projection))
+        return refine(statement)
+
+    return cached_statement(("organizations", name, projection_key), build)
+
+
+def get_organization(
+        db: Session,
+        organization_id: int,
+        projection: Optional[schemas.OrganizationProjection] = None
+) -> Optional[models.Organization]:
+    if projection is None:
+        return get_loader(db, models.Organization).load(organization_id)
+
+    statement = select_organizations(
+        "by_id", projection, lambda statement: statement.where(models.Organization.id == bindparam("organization_id"))
+    )
+    return db.execute(statement, {"organization_id": organization_id}).scalars().first()
+
+
+def get_organizations_by_ids(
+        db: Session,
+        organization_ids: List[int],
+        projection: Optional[schemas.OrganizationProjection] = None
+) -> List[Optional[models.Organization]]:
+    """
+    Организации в порядке organization_ids (None для отсутствующих), одним запросом IN
+    """
+    if projection is None:
+        return get_loader(db, models.Organization).load_many(organization_ids)
+
+    found = {
+        organization.id: organization
+        for organization in query_organizations(db, projection).filter(
+            models.Organization.id.in_(set(organization_ids))
+        ).all()
+    }
+    return [found.get(organization_id) for organization_id in organization_ids]
+
+
+def get_organizations(
+        db: Session,
+        skip: int = 0,
+        limit: int = 100,
+        updated_since: Optional[int] = None,
+        projection: Optional[schemas.OrganizationProjection] = None
+) -> List[models.Organization]:
+    query = query_organizations(db, projection)
+    if updated_since is not None:
+        # Стабильный порядок для постраничной выгрузки дельты
+        query = query.filter(
+            models.Organization.updated_at >= updated_since
+        ).order_by(models.Organization.updated_at, models.Organization.id)
+    return query.offset(skip).limit(limit).all()
+
+
+def get_deleted_entities(db: Session, entity_type: str, deleted_since: int) -> List[models.Change]:
+    """
+    Записи журнала об удалении сущностей начиная с deleted_since
+    """
+    return db.query(models.Change).filter(
+        models.Change.entity_type == entity_type,
+        models.Change.operation == "delete",
+        models.Change.created_at >= deleted_since
+    ).order_by(models.Change.seq).all()
+
+
+def _buildings(db: Session, building_ids: Iterable[Optional[int]]) -> Dict[int, models.Building]:
+    """
+    Здания организаций по id: из них копируется geo_region и ими заполняется связь building
+    """
+    ids = list({building_id for building_id in building_ids if building_id is not None})
+    return {building.id: building for building in get_buildings_by_ids(db, ids) if building is not None}
+
+
+def _activities(db: Session, activity_ids: Iterable[int]) -> Dict[int, models.Activity]:
+    """
+    Не удаленные виды деятельности по id вместе с дочерними, которые попадут в ответ
+    """
+    ids = list(set(activity_ids))
+    if not ids:
+        return {}
+    activities = db.query(models.Activity).options(activity_children()).filter(
+        models.Activity.id.in_(ids),
+        models.Activity.deleted_at.is_(None)
+    ).all()
+    return {activity.id: activity for activity in activities}
+
+
+def _pick(entities: Dict[int, object], ids: Iterable[int]) -> list:
+    # Порядок запроса без повторов; отсутствующие id пропускаются
+    return [entities[entity_id] for entity_id in dict.fromkeys(ids) if entity_id in entities]
+
+
+def _set_building(db_organization: models.Organization, building_id: Optional[int], buildings: Dict[int, models.Building]):
+    """
+    Связь building заполняется уже загруженным зданием (building_id и geo_region синхронизирует flush),
+    чтобы ответ не загружал его повторно. Несуществующее или удаленное здание отклоняется здесь:
+    с geo_region = NULL составной внешний ключ секционированных buildings строку бы не проверил
+    """
+    building = buildings.get(building_id)
+    if building is None and building_id is not None:
+        raise ValueError(f"Building {building_id} not found")
+    db_organization.building = building
+
+
+def _region_filter(min_lat: float, max_lat: float, min_lon: float, max_lon: float):
+    """
+    Условие по георегионам прямоугольника; None, если регионов слишком много
+    """
+    cells = geohash_cells(
+        min_lat, max_lat, min_lon, max_lon, settings.GEO_REGION_PRECISION, settings.GEO_REGION_MAX_CELLS
+    )
+    if cells is None:
+        return None
+    return models.Organization.geo_region.in_(cells)
+
+
+def _new_organization(
+        db: Session,
+        organization: schemas.OrganizationCreate,
+        buildings: Dict[int, models.Building],
+        activities: Dict[int, models.Activity]
+) -> models.Organization:
+    # Коллекции задаются явно, даже пустые: у новой организации их не нужно загружать из БД
     db_organization = models.Organization(
         name=organization.name,
         description=organization.description,
-        building_id=organization.building_id
+        phones=[
+            models.Phone(number=phone_number, normalized=normalize_phone(phone_number))
+            for phone_number in organization.phone_numbers or []
+        ],
+        activities=_pick(activities, organization.activity_ids or [])
     )
+    _set_building(db_organization, organization.building_id, buildings)
 
-    # Добавляем телефоны
-    if organization.phone_numbers:
-        for phone_number in organization.phone_numbers:
-            db_phone = models.Phone(number=phone_number)
-            db_organization.phones.append(db_phone)
+    db.add(db_organization)
+    return db_organization
 
-    # Добавляем виды деятельности
-    if organization.activity_ids:
-        activities = db.query(models.Activity).filter(
-            models.Activity.id.in_(organization.activity_ids)
-        ).all()
-        db_organization.activities.extend(activities)
 
-    db.add(db_organization)
+def create_organization(db: Session, organization: schemas.OrganizationCreate) -> models.Organization:
+    db_organization = _new_organization(
+        db,
+        organization,
+        _buildings(db, [organization.building_id]),
+        _activities(db, organization.activity_ids or [])
+    )
+    db.flush()
+    record_change(db, "organization", [db_organization.id], "create")
+    cache.mark_stale(db, cache.BUILDING_CLUSTERS, cache.SUGGEST_INDEX)
     db.commit()
-    db.refresh(db_organization)
     return db_organization
 
 
+def import_organizations(
+        db: Session,
+        organizations: List[schemas.OrganizationCreate],
+        idempotency_key: Optional[str] = None
+) -> List[int]:
+    """
+    Создает организации одной транзакцией: при ошибке не остается частично импортированных данных.
+    С idempotency_key результат запоминается в той же транзакции, и повторный импорт с этим ключом
+    (повтор задачи, в т.ч. одновременный) возвращает уже созданные id вместо дубликатов
+    """
+    if idempotency_key is not None:
+        done = db.get(models.IdempotencyKey, idempotency_key)
+        if done is not None:
+            return done.result["ids"]
+
+    buildings = _buildings(db, [organization.building_id for organization in organizations])
+    activities = _activities(db, [
+        activity_id for organization in organizations for activity_id in organization.activity_ids or []
+    ])
+    db_organizations = [
+        _new_organization(db, organization, buildings, activities) for organization in organizations
+    ]
+    db.flush()
+    organization_ids = [db_organization.id for db_organization in db_organizations]
+    if idempotency_key is not None:
+        db.add(models.IdempotencyKey(key=idempotency_key, result={"ids": organization_ids}))
+    record_change(db, "organization", organization_ids, "create")
+    cache.mark_stale(db, cache.BUILDING_CLUSTERS, cache.SUGGEST_INDEX)
+    try:
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        # Ключ уже зафиксировал другой воркер, выполнявший тот же импорт
+        done = db.get(models.IdempotencyKey, idempotency_key) if idempotency_key is not None else None
+        if done is None:
+            raise
+        return done.result["ids"]
+    return organization_ids
+
+
+def _organization_for_update(
+        db: Session,
+        organization_id: int,
+        building: bool,
+        phones: bool,
+        activities: bool
+) -> Optional[models.Organization]:
+    """
+    Организация для обновления. Загружаются только связи, которые запрос не заменяет (они нужны ответу);
+    заменяемые заполняются новыми значениями без чтения прежних
+    """
+    def build() -> Select:
+        # noload: заменяемая связь считается пустой, и присваивание не читает прежнее значение (в т.ч. для обратной связи)
+        options = [
+            joinedload(models.Organization.building) if building else noload(models.Organization.building),
+            selectinload(models.Organization.phones) if phones else noload(models.Organization.phones),
+            activity_children(models.Organization.activities) if activities else noload(models.Organization.activities)
+        ]
+        return select(models.Organization).options(*options).where(
+            models.Organization.id == bindparam("organization_id")
+        )
+
+    statement = cached_statement(("organization_for_update", building, phones, activities), build)
+    return db.execute(statement, {"organization_id": organization_id}).unique().scalars().first()
+
+
 def update_organization(
         db: Session,
         organization_id: int,
         organization: schemas.OrganizationUpdate
 ) -> Optional[models.Organization]:
-    db_organization = get_organization(db, organization_id)
+    update_data = organization.model_dump(exclude_unset=True)
+    db_organization = _organization_for_update(
+        db,
+        organization_id,
+        building="building_id" not in update_data,
+        phones=organization.phone_numbers is None,
+        activities=organization.activity_ids is None
+    )
     if not db_organization:
         return None
 
     # Обновляем основные поля
-    update_data = organization.model_dump(exclude_unset=True)
     for field, value in update_data.items():
         if field not in ['phone_numbers', 'activity_ids']:
             setattr(db_organization, field, value)
+    if 'building_id' in update_data:
+        _set_building(
+            db_organization, db_organization.building_id, _buildings(db, [db_organization.building_id])
+        )
+
+    # onupdate не срабатывает, если менялись только телефоны или виды деятельности
+    db_organization.updated_at = int(time.time())
 
     # Обновляем телефоны
     if organization.phone_numbers is not None:
-        # Удаляем старые телефоны
+        # Старые телефоны удаляются одним запросом, а не по одному через delete-orphan;
+        # коллекция заменяется новыми без загрузки из БД
         db.query(models.Phone).filter(
             models.Phone.organization_id == organization_id
         ).delete()
+        set_committed_value(db_organization, "phones", [])
+        db_organization.phones.extend(
+            models.Phone(number=phone_number, normalized=normalize_phone(phone_number))
+            for phone_number in organization.phone_numbers
+        )
 
-        # Добавляем новые
-        for phone_number in organization.phone_numbers:
-            db_phone = models.Phone(number=phone_number, organization_id=organization_id)
-            db.add(db_phone)
-
-    # Обновляем виды деятельности
+    # Виды деятельности заменяются так же: прежние связи удаляются одним запросом без загрузки
     if organization.activity_ids is not None:
-        # Очищаем текущие связи
-        db_organization.activities.clear()
-
-        # Добавляем новые
-        activities = db.query(models.Activity).filter(
-            models.Activity.id.in_(organization.activity_ids)
-        ).all()
-        db_organization.activities.extend(activities)
-
+        db.execute(delete(models.organization_activity).where(
+            models.organization_activity.c.organization_id == organization_id
+        ))
+        set_committed_value(db_organization, "activities", [])
+        db_organization.activities = _pick(_activities(db, organization.activity_ids), organization.activity_ids)
+
+    record_change(db, "organization", [organization_id], "update")
+    cache.mark_stale(db, cache.BUILDING_CLUSTERS, cache.SUGGEST_INDEX)
     db.commit()
-    db.refresh(db_organization)
     return db_organization
 
 
@@ -109,71 +423,203 @@ def delete_organization(db: Session, organization_id: int) -> bool:
         return False
 
     db.delete(db_organization)
+    record_change(db, "organization", [organization_id], "delete")
+    cache.mark_stale(db, cache.BUILDING_CLUSTERS, cache.SUGGEST_INDEX)
     db.commit()
     return True
 
 
-def get_organizations_by_building(db: Session, building_id: int) -> List[models.Organization]:
-    return db.query(models.Organization).filter(
-        models.Organization.building_id == building_id
-    ).all()
+def get_organizations_by_building(
+        db: Session,
+        building_id: int,
+        projection: Optional[schemas.OrganizationProjection] = None
+) -> List[models.Organization]:
+    statement = select_organizations(
+        "by_building", projection, lambda statement: statement.where(
+            models.Organization.building_id == bindparam("building_id")
+        )
+    )
+    return db.execute(statement, {"building_id": building_id}).scalars().all()
 
 
-def get_organizations_by_activity(db: Session, activity_id: int) -> List[models.Organization]:
+def get_organizations_by_phone(
+        db: Session,
+        number: str,
+        projection: Optional[schemas.OrganizationProjection] = None
+) -> List[models.Organization]:
+    """
+    Организации, которым принадлежит номер (поиск по индексу нормализованных номеров)
+    """
+    normalized = normalize_phone(number)
+    if not normalized:
+        return []
+
+    statement = select_organizations(
+        "by_phone", projection, lambda statement: statement.where(models.Organization.id.in_(
+            select(models.Phone.organization_id).where(models.Phone.normalized == bindparam("normalized"))
+        ))
+    )
+    return db.execute(statement, {"normalized": normalized}).scalars().all()
+
+
+def _organizations_with_activities(
+        db: Session,
+        activity_ids: List[int],
+        projection: Optional[schemas.OrganizationProjection]
+) -> List[models.Organization]:
+    # activity_ids берутся из дерева, где уже нет удаленных видов, поэтому таблица activities не нужна
+    statement = select_organizations(
+        "by_activities", projection, lambda statement: statement.where(models.Organization.id.in_(
+            select(models.organization_activity.c.organization_id).where(
+                models.organization_activity.c.activity_id.in_(bindparam("activity_ids", expanding=True))
+            )
+        ))
+    )
+    return db.execute(statement, {"activity_ids": activity_ids}).scalars().all()
+
+
+def get_organizations_by_activity(
+        db: Session,
+        activity_id: int,
+        projection: Optional[schemas.OrganizationProjection] = None
+) -> List[models.Organization]:
     activity_ids = get_all_child_activity_ids(db, activity_id)
+    return _organizations_with_activities(db, activity_ids, projection)
 
-    return db.query(models.Organization).join(models.Organization.activities).filter(
-        models.Activity.id.in_(activity_ids)
-    ).distinct().all()
 
+def search_organizations_by_name(
+        db: Session,
+        name: str,
+        projection: Optional[schemas.OrganizationProjection] = None
+) -> List[models.Organization]:
+    statement = select_organizations(
+        "by_name", projection, lambda statement: statement.where(
+            models.Organization.name.ilike(bindparam("pattern"))
+        )
+    )
+    return db.execute(statement, {"pattern": f"%{name}%"}).scalars().all()
 
-def search_organizations_by_name(db: Session, name: str) -> List[models.Organization]:
-    return db.query(models.Organization).filter(
-        models.Organization.name.ilike(f"%{name}%")
-    ).all()
+
+_ACTIVITIES_BY_NAME = select(models.Activity.id).where(
+    models.Activity.name.ilike(bindparam("pattern")),
+    models.Activity.deleted_at.is_(None)
+)
 
 
-def search_organizations_by_activity_name(db: Session, activity_name: str) -> List[models.Organization]:
+def search_organizations_by_activity_name(
+        db: Session,
+        activity_name: str,
+        projection: Optional[schemas.OrganizationProjection] = None
+) -> List[models.Organization]:
     # Находим активности по имени
-    activities = db.query(models.Activity).filter(
-        models.Activity.name.ilike(f"%{activity_name}%")
-    ).all()
+    found_ids = db.execute(_ACTIVITIES_BY_NAME, {"pattern": f"%{activity_name}%"}).scalars().all()
 
-    if not activities:
+    if not found_ids:
         return []
 
     # Получаем все ID активностей (включая дочерние)
     activity_ids = []
-    for activity in activities:
-        activity_ids.extend(get_all_child_activity_ids(db, activity.id))
+    for found_id in found_ids:
+        activity_ids.extend(get_all_child_activity_ids(db, found_id))
 
     # Получаем организации
-    return db.query(models.Organization).join(models.Organization.activities).filter(
-        models.Activity.id.in_(activity_ids)
-    ).distinct().all()
+    return _organizations_with_activities(db, activity_ids, projection)
 
 
 def get_organizations_in_radius(
         db: Session,
         lat: float,
         lon: float,
-        radius: float = None
+        radius: float = None,
+        projection: Optional[schemas.OrganizationProjection] = None
 ) -> List[models.Organization]:
     if radius is None:
         radius = settings.DEFAULT_SEARCH_RADIUS
 
-    buildings = db.query(models.Building).all()
-
-    # Фильтруем здания по расстоянию
-    nearby_building_ids = []
-    for building in buildings:
-        distance = haversine_distance(lat, lon, building.latitude, building.longitude)
-        if distance <= radius:
-            nearby_building_ids.append(building.id)
+    # Кандидаты отбираются по сетке геоиндекса, а не перебором всех зданий
+    nearby_building_ids = cache.geo_index.get(db).in_radius(lat, lon, radius)
 
-    return db.query(models.Organization).filter(
+    query = query_organizations(db, projection).filter(
         models.Organization.building_id.in_(nearby_building_ids)
-    ).all()
+    )
+    region_filter = _region_filter(*bounding_box(lat, lon, radius))
+    if region_filter is not None:
+        query = query.filter(region_filter)
+    return query.all()
+
+
+def _iter_nearest_buildings_gist(db: Session, lat: float, lon: float, page_size: int = 64):
+    """
+    Здания в порядке удаления от точки через KNN-обход GiST-индекса (point <-> point).
+    Индекс упорядочивает по евклидову расстоянию в градусах, поэтому порции
+    пересортировываются по гаверсинусу с нижней границей для еще не прочитанных зданий
+    """
+    location = func.point(models.Building.longitude, models.Building.latitude)
+    degrees = location.op("<->")(func.point(lon, lat))
+
+    def pages():
+        offset = 0
+        size = page_size
+        while True:
+            rows = db.query(
+                models.Building.id, models.Building.latitude, models.Building.longitude, degrees
+            ).filter(
+                models.Building.deleted_at.is_(None)
+            ).order_by(degrees).offset(offset).limit(size).all()
+            if not rows:
+                return
+            # Все следующие здания не ближе rows[-1] в градусах: по широте или долготе
+            # они отстоят минимум на (расстояние / sqrt(2))
+            span = rows[-1][3] / 2 ** 0.5
+            yield [(row[0], row[1], row[2]) for row in rows], min_distance_beyond(lat, span, span)
+            if len(rows) < size:
+                return
+            offset += size
+            size *= 2
+
+    return order_by_distance(lat, lon, pages())
+
+
+def get_nearest_organizations(
+        db: Session,
+        lat: float,
+        lon: float,
+        k: int = 10,
+        activity_id: Optional[int] = None,
+        projection: Optional[schemas.OrganizationProjection] = None
+) -> List[Tuple[models.Organization, float]]:
+    """
+    k ближайших к точке организаций с расстоянием в метрах,
+    опционально только с видом деятельности activity_id и его потомками
+    """
+    if settings.GEO_KNN_USE_GIST and db.get_bind().dialect.name == "postgresql":
+        nearest_buildings = _iter_nearest_buildings_gist(db, lat, lon)
+    else:
+        nearest_buildings = cache.geo_index.get(db).iter_nearest(lat, lon)
+
+    activity_ids = get_all_child_activity_ids(db, activity_id) if activity_id is not None else None
+
+    result = []
+    batch_size = k
+    while len(result) < k:
+        # Здания идут по возрастанию расстояния, поэтому организации следующих порций всегда дальше
+        distances = dict(islice(nearest_buildings, batch_size))
+        if not distances:
+            break
+
+        query = query_organizations(db, projection, "building_id").filter(
+            models.Organization.building_id.in_(list(distances))
+        )
+        if activity_ids is not None:
+            query = query.join(models.Organization.activities).filter(
+                models.Activity.id.in_(activity_ids)
+            ).distinct()
+
+        organizations = sorted(query.all(), key=lambda org: (distances[org.building_id], org.id))
+        result.extend((org, distances[org.building_id]) for org in organizations)
+        batch_size *= 2
+
+    return result[:k]
 
 
 def get_organizations_in_rectangle(
@@ -181,39 +627,58 @@ def get_organizations_in_rectangle(
         min_lat: float,
         max_lat: float,
         min_lon: float,
-        max_lon: float
+        max_lon: float,
+        projection: Optional[schemas.OrganizationProjection] = None
 ) -> List[models.Organization]:
-    # Находим здания в прямоугольной области
-    buildings = db.query(models.Building).filter(
-        and_(
-            models.Building.latitude >= min_lat,
-            models.Building.latitude <= max_lat,
-            models.Building.longitude >= min_lon,
-            models.Building.longitude <= max_lon
-        )
-    ).all()
-
-    building_ids = [building.id for building in buildings]
+    # Здания в прямоугольнике берутся из геоиндекса: по latitude/longitude нет B-tree индекса,
+    # и фильтр в БД читал бы всю таблицу зданий
+    building_ids = [
+        building_id
+        for building_id, _, _ in cache.geo_index.get(db).in_rectangle(min_lat, max_lat, min_lon, max_lon)
+    ]
 
     # Получаем организации в этих зданиях
-    return db.query(models.Organization).filter(
+    query = query_organizations(db, projection).filter(
         models.Organization.building_id.in_(building_ids)
-    ).all()
+    )
+    region_filter = _region_filter(min_lat, max_lat, min_lon, max_lon)
+    if region_filter is not None:
+        query = query.filter(region_filter)
+    return query.all()
 
 
 def get_building(db: Session, building_id: int) -> Optional[models.Building]:
-    return db.query(models.Building).filter(models.Building.id == building_id).first()
+    return get_loader(db, models.Building).load(building_id)
 
 
-def get_buildings(db: Session, skip: int = 0, limit: int = 100) -> List[models.Building]:
-    return db.query(models.Building).offset(skip).limit(limit).all()
+def get_buildings_by_ids(db: Session, building_ids: List[int]) -> List[Optional[models.Building]]:
+    """
+    Здания в порядке building_ids (None для отсутствующих), одним запросом IN
+    """
+    return get_loader(db, models.Building).load_many(building_ids)
+
+
+def get_buildings(
+        db: Session,
+        skip: int = 0,
+        limit: int = 100,
+        updated_since: Optional[int] = None
+) -> List[models.Building]:
+    query = db.query(models.Building).filter(models.Building.deleted_at.is_(None))
+    if updated_since is not None:
+        query = query.filter(
+            models.Building.updated_at >= updated_since
+        ).order_by(models.Building.updated_at, models.Building.id)
+    return query.offset(skip).limit(limit).all()
 
 
 def create_building(db: Session, building: schemas.BuildingCreate) -> models.Building:
     db_building = models.Building(**building.model_dump())
     db.add(db_building)
+    db.flush()
+    record_change(db, "building", [db_building.id], "create")
+    cache.mark_stale(db, cache.GEO_INDEX, cache.BUILDING_CLUSTERS)
     db.commit()
-    db.refresh(db_building)
     return db_building
 
 
@@ -229,40 +694,120 @@ def update_building(
     for field, value in building.model_dump(exclude_unset=True).items():
         setattr(db_building, field, value)
 
+    region = models.building_region(db_building.latitude, db_building.longitude)
+    if region != db_building.geo_region:
+        db_building.geo_region = region
+        db.flush()
+        # При секционировании то же делает ON UPDATE CASCADE внешнего ключа
+        db.execute(
+            update(models.Organization).where(
+                models.Organization.building_id == building_id
+            ).values(geo_region=region)
+        )
+
+    record_change(db, "building", [building_id], "update")
+    cache.mark_stale(db, cache.GEO_INDEX, cache.BUILDING_CLUSTERS)
     db.commit()
-    db.refresh(db_building)
     return db_building
 
 
-def delete_building(db: Session, building_id: int) -> bool:
-    db_building = get_building(db, building_id)
-    if not db_building:
-        return False
+def get_building_clusters(
+        db: Session,
+        zoom: int,
+        min_lat: float,
+        min_lon: float,
+        max_lat: float,
+        max_lon: float
+) -> List[Cluster]:
+    """
+    Кластеры зданий в прямоугольнике на заданном уровне масштаба
+    """
+    return cache.building_clusters.get(db).in_bbox(zoom, min_lat, min_lon, max_lat, max_lon)
+
+
+def _detach_organizations_from_buildings(db: Session, building_ids: List[int]):
+    """
+    Отвязывает организации от удаляемых зданий и фиксирует их в журнале.
+    building_id и geo_region обнуляются вместе: составной внешний ключ секционированных
+    buildings объявлен MATCH FULL и не допускает строк, где задана только одна из колонок
+    """
+    organization_ids = db.execute(
+        update(models.Organization).where(
+            models.Organization.building_id.in_(building_ids)
+        ).values(
+            building_id=None, geo_region=None, updated_at=int(time.time())
+        ).returning(models.Organization.id)
+    ).scalars().all()
+    record_change(db, "organization", organization_ids, "update")
 
-    db.delete(db_building)
+
+def delete_buildings(db: Session, building_ids: List[int]) -> int:
+    """
+    Удаляет здания одним запросом без загрузки связанных объектов в сессию.
+    В режиме мягкого удаления здания только помечаются, очистку делает purge_deleted
+    """
+    building_ids = list(set(building_ids))
+    if not building_ids:
+        return 0
+
+    if settings.SOFT_DELETE_ENABLED:
+        deleted_ids = db.execute(
+            update(models.Building).where(
+                models.Building.id.in_(building_ids),
+                models.Building.deleted_at.is_(None)
+            ).values(deleted_at=int(time.time())).returning(models.Building.id)
+        ).scalars().all()
+    else:
+        _detach_organizations_from_buildings(db, building_ids)
+        deleted_ids = db.execute(
+            delete(models.Building).where(
+                models.Building.id.in_(building_ids),
+                models.Building.deleted_at.is_(None)
+            ).returning(models.Building.id)
+        ).scalars().all()
+
+    record_change(db, "building", deleted_ids, "delete")
+    cache.mark_stale(db, cache.GEO_INDEX, cache.BUILDING_CLUSTERS)
     db.commit()
-    return True
+    return len(deleted_ids)
 
 
-def get_activity(db: Session, activity_id: int) -> Optional[models.Activity]:
-    return db.query(models.Activity).filter(models.Activity.id == activity_id).first()
+def delete_building(db: Session, building_id: int) -> bool:
+    return delete_buildings(db, [building_id]) > 0
+
 
+def get_activity(db: Session, activity_id: int, with_children: bool = False) -> Optional[models.Activity]:
+    query = db.query(models.Activity)
+    if with_children:
+        query = query.options(activity_children())
+    return query.filter(
+        models.Activity.id == activity_id,
+        models.Activity.deleted_at.is_(None)
+    ).first()
 
-def get_activities(db: Session, skip: int = 0, limit: int = 100) -> List[models.Activity]:
-    return db.query(models.Activity).filter(models.Activity.parent_id.is_(None)).offset(skip).limit(limit).all()
+
+def get_activities(
+        db: Session,
+        skip: int = 0,
+        limit: int = 100,
+        updated_since: Optional[int] = None
+) -> List[models.Activity]:
+    query = db.query(models.Activity).filter(models.Activity.deleted_at.is_(None))
+    if updated_since is not None:
+        # Для инкрементальной синхронизации возвращаются измененные виды деятельности всех уровней
+        query = query.filter(
+            models.Activity.updated_at >= updated_since
+        ).order_by(models.Activity.updated_at, models.Activity.id)
+    else:
+        query = query.filter(models.Activity.parent_id.is_(None))
+    return query.offset(skip).limit(limit).all()
 
 
 def get_all_child_activity_ids(db: Session, parent_id: int) -> List[int]:
     """
-    Рекурсивно получает все ID дочерних активностей
+    Получает ID активности и всех её потомков по закэшированному дереву
     """
-    result = [parent_id]
-
-    children = db.query(models.Activity).filter(models.Activity.parent_id == parent_id).all()
-    for child in children:
-        result.extend(get_all_child_activity_ids(db, child.id))
-
-    return result
+    return cache.activity_tree.get(db).descendants(parent_id)
 
 
 def create_activity(db: Session, activity: schemas.ActivityCreate) -> models.Activity:
@@ -284,12 +829,15 @@ def create_activity(db: Session, activity: schemas.ActivityCreate) -> models.Act
         name=activity.name,
         description=activity.description,
         parent_id=activity.parent_id,
-        level=level
+        level=level,
+        children=[]
     )
 
     db.add(db_activity)
+    db.flush()
+    record_change(db, "activity", [db_activity.id], "create")
+    cache.mark_stale(db, cache.ACTIVITY_TREE, cache.BUILDING_CLUSTERS, cache.SUGGEST_INDEX)
     db.commit()
-    db.refresh(db_activity)
     return db_activity
 
 
@@ -298,12 +846,13 @@ def update_activity(
         activity_id: int,
         activity: schemas.ActivityUpdate
 ) -> Optional[models.Activity]:
-    db_activity = get_activity(db, activity_id)
+    db_activity = get_activity(db, activity_id, with_children=True)
     if not db_activity:
         return None
 
     # Если меняется parent_id, нужно проверить уровень вложенности
-    if activity.parent_id is not None and activity.parent_id != db_activity.parent_id:
+    moved = activity.parent_id is not None and activity.parent_id != db_activity.parent_id
+    if moved:
         if activity.parent_id == activity_id:
             raise ValueError("Activity cannot be its own parent")
 
@@ -316,7 +865,9 @@ def update_activity(
                 f"Cannot move activity to level {parent.level + 1}. Max level is {settings.MAX_ACTIVITY_LEVEL}")
 
         # Обновляем уровень и всех потомков
-        update_activity_level(db, activity_id, parent.level + 1)
+        changed_ids = update_activity_level(db, activity_id, parent.level + 1)
+    else:
+        changed_ids = [activity_id]
 
     for field, value in activity.model_dump(exclude_unset=True).items():
         if field != 'parent_id':
@@ -325,45 +876,207 @@ def update_activity(
     if activity.parent_id is not None:
         db_activity.parent_id = activity.parent_id
 
+    # При переносе меняется уровень всех потомков
+    record_change(db, "activity", changed_ids, "update")
+    cache.mark_stale(db, cache.ACTIVITY_TREE, cache.BUILDING_CLUSTERS, cache.SUGGEST_INDEX)
     db.commit()
-    db.refresh(db_activity)
     return db_activity
 
 
-def update_activity_level(db: Session, activity_id: int, new_level: int):
+def _activity_subtree(activity_id: int) -> Select:
     """
-    Рекурсивно обновляет уровень активности и всех её потомков
+    id вида деятельности и всех его потомков (рекурсивный CTE)
     """
-    if new_level >= settings.MAX_ACTIVITY_LEVEL:
-        raise ValueError(f"Cannot set level {new_level}. Max level is {settings.MAX_ACTIVITY_LEVEL}")
+    subtree = select(models.Activity.id).where(models.Activity.id == activity_id).cte("subtree", recursive=True)
+    subtree = subtree.union_all(select(models.Activity.id).where(models.Activity.parent_id == subtree.c.id))
+    return select(subtree.c.id)
 
-    db_activity = get_activity(db, activity_id)
-    if db_activity:
-        db_activity.level = new_level
 
-        # Обновляем всех детей
-        children = db.query(models.Activity).filter(models.Activity.parent_id == activity_id).all()
-        for child in children:
-            update_activity_level(db, child.id, new_level + 1)
+def update_activity_level(db: Session, activity_id: int, new_level: int) -> List[int]:
+    """
+    Переносит активность со всеми потомками на уровень new_level одним UPDATE:
+    уровни поддерева сдвигаются на одну величину. Возвращает id измененных
+    """
+    subtree = _activity_subtree(activity_id)
+    current, deepest = db.execute(
+        select(func.min(models.Activity.level), func.max(models.Activity.level)).where(models.Activity.id.in_(subtree))
+    ).one()
+    if current is None:
+        return []
+
+    shift = new_level - current
+    if deepest + shift >= settings.MAX_ACTIVITY_LEVEL:
+        raise ValueError(f"Cannot set level {deepest + shift}. Max level is {settings.MAX_ACTIVITY_LEVEL}")
+
+    return db.execute(
+        update(models.Activity).where(
+            models.Activity.id.in_(subtree)
+        ).values(level=models.Activity.level + shift).returning(models.Activity.id)
+    ).scalars().all()
+
+
+def _touch_organizations_of_activities(db: Session, activity_ids: List[int]):
+    """
+    Фиксирует в журнале организации, у которых БД удалит связи с видами деятельности
+    """
+    linked = select(models.organization_activity.c.organization_id).where(
+        models.organization_activity.c.activity_id.in_(activity_ids)
+    )
+    organization_ids = db.execute(
+        update(models.Organization).where(
+            models.Organization.id.in_(linked)
+        ).values(updated_at=int(time.time())).returning(models.Organization.id)
+    ).scalars().all()
+    record_change(db, "organization", organization_ids, "update")
 
 
 def delete_activity(db: Session, activity_id: int) -> bool:
-    db_activity = get_activity(db, activity_id)
-    if not db_activity:
+    """
+    Удаляет вид деятельности со всем поддеревом одним запросом;
+    связи с организациями удаляет БД (ON DELETE CASCADE)
+    """
+    if get_activity(db, activity_id) is None:
         return False
 
-    db.delete(db_activity)
+    activity_ids = get_all_child_activity_ids(db, activity_id)
+    if settings.SOFT_DELETE_ENABLED:
+        db.execute(
+            update(models.Activity).where(
+                models.Activity.id.in_(activity_ids)
+            ).values(deleted_at=int(time.time()))
+        )
+    else:
+        _touch_organizations_of_activities(db, activity_ids)
+        db.execute(delete(models.Activity).where(models.Activity.id.in_(activity_ids)))
+
+    record_change(db, "activity", activity_ids, "delete")
+    cache.mark_stale(db, cache.ACTIVITY_TREE, cache.BUILDING_CLUSTERS, cache.SUGGEST_INDEX)
     db.commit()
     return True
 
 
+def purge_deleted(db: Session, batch_size: int = None) -> int:
+    """
+    Физически удаляет мягко удаленные здания и виды деятельности пакетами,
+    фиксируя транзакцию после каждого пакета, чтобы не держать долгие блокировки
+    """
+    if batch_size is None:
+        batch_size = settings.PURGE_BATCH_SIZE
+
+    purged = 0
+    for model in (models.Building, models.Activity):
+        while True:
+            ids = db.execute(
+                select(model.id).where(model.deleted_at.is_not(None)).limit(batch_size)
+            ).scalars().all()
+            if not ids:
+                break
+
+            if model is models.Building:
+                _detach_organizations_from_buildings(db, ids)
+            else:
+                _touch_organizations_of_activities(db, ids)
+            db.execute(delete(model).where(model.id.in_(ids)))
+            db.commit()
+            purged += len(ids)
+    return purged
+
+
+def recompute_geo_regions(db: Session, batch_size: int = None) -> int:
+    """
+    Пересчитывает geo_region зданий по координатам и текущему GEO_REGION_PRECISION и копирует его
+    в организации этих зданий. Пакеты по id фиксируются по отдельности. Возвращает число исправленных зданий
+    """
+    if batch_size is None:
+        batch_size = settings.PURGE_BATCH_SIZE
+
+    fixed = 0
+    last_id = 0
+    while True:
+        rows = db.execute(
+            select(models.Building.id, models.Building.latitude, models.Building.longitude, models.Building.geo_region)
+            .where(models.Building.id > last_id)
+            .order_by(models.Building.id)
+            .limit(batch_size)
+        ).all()
+        if not rows:
+            break
+        last_id = rows[-1].id
+
+        changed = {}
+        for row in rows:
+            region = models.building_region(row.latitude, row.longitude)
+            if region != row.geo_region:
+                changed.setdefault(region, []).append(row.id)
+        if not changed:
+            continue
+
+        for region, building_ids in changed.items():
+            db.execute(
+                update(models.Building).where(
+                    models.Building.id.in_(building_ids)
+                ).values(geo_region=region, updated_at=int(time.time()))
+            )
+            # При секционировании то же делает ON UPDATE CASCADE внешнего ключа
+            db.execute(
+                update(models.Organization).where(
+                    models.Organization.building_id.in_(building_ids)
+                ).values(geo_region=region)
+            )
+        building_ids = [building_id for ids in changed.values() for building_id in ids]
+        record_change(db, "building", building_ids, "update")
+        cache.mark_stale(db, cache.GEO_INDEX, cache.BUILDING_CLUSTERS)
+        db.commit()
+        fixed += len(building_ids)
+    return fixed
+
+
+def recompute_activity_levels(db: Session) -> int:
+    """
+    Пересчитывает level всех видов деятельности по parent_id за один проход по дереву.
+    Возвращает число исправленных записей
+    """
+    rows = db.execute(select(models.Activity.id, models.Activity.parent_id, models.Activity.level)).all()
+
+    children = {}
+    for activity_id, parent_id, _ in rows:
+        children.setdefault(parent_id, []).append(activity_id)
+
+    expected = {}
+    queue = [(activity_id, 0) for activity_id in children.get(None, [])]
+    while queue:
+        activity_id, level = queue.pop()
+        expected[activity_id] = level
+        queue.extend((child_id, level + 1) for child_id in children.get(activity_id, []))
+
+    fixed = [(activity_id, expected[activity_id]) for activity_id, _, level in rows
+             if activity_id in expected and expected[activity_id] != level]
+    if not fixed:
+        return 0
+
+    for level in {level for _, level in fixed}:
+        db.execute(
+            update(models.Activity).where(
+                models.Activity.id.in_([activity_id for activity_id, value in fixed if value == level])
+            ).values(level=level, updated_at=int(time.time()))
+        )
+    record_change(db, "activity", [activity_id for activity_id, _ in fixed], "update")
+    db.commit()
+    return len(fixed)
+
+
 def get_activity_tree(db: Session, parent_id: Optional[int] = None) -> List[models.Activity]:
-    if parent_id:
-        activities = db.query(models.Activity).filter(models.Activity.parent_id == parent_id).all()
-    else:
-        activities = db.query(models.Activity).filter(models.Activity.parent_id.is_(None)).all()
+    """
+    Собирает дерево одним запросом вместо запроса на каждый узел
+    """
+    activities = db.query(models.Activity).filter(models.Activity.deleted_at.is_(None)).all()
+
+    children = {}
+    for activity in activities:
+        children.setdefault(activity.parent_id, []).append(activity)
 
+    # Заполняем children без отметки объектов как измененных
     for activity in activities:
-        activity.children = get_activity_tree(db, activity.id)
+        set_committed_value(activity, "children", children.get(activity.id, []))
 
-    return activities
+    return children.get(parent_id, [])
@@ -1,18 +1,133 @@
-from sqlalchemy import create_engine
+from typing import Tuple
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
-from app.config import settings
+from app.admission import DeadlineExceeded, current_deadline, remaining
+from app.config import Settings, settings
+
+
+def is_postgresql(url: str) -> bool:
+    return make_url(url).get_backend_name() == "postgresql"
+
+
+def pool_limits(app_settings: Settings) -> Tuple[int, int]:
+    """
+    Размер пула и overflow на один воркер.
+    Сумма по всем воркерам (вместе с соединением LISTEN) не превышает DB_MAX_CONNECTIONS
+    """
+    if app_settings.DB_POOL_SIZE is not None:
+        return app_settings.DB_POOL_SIZE, app_settings.DB_MAX_OVERFLOW
+
+    workers = max(1, app_settings.WEB_CONCURRENCY)
+    listener_connections = workers if app_settings.CACHE_NOTIFY_ENABLED else 0
+    per_worker = max(1, (app_settings.DB_MAX_CONNECTIONS - listener_connections) // workers)
+    max_overflow = min(app_settings.DB_MAX_OVERFLOW, per_worker - 1)
+    return per_worker - max_overflow, max_overflow
+
+
+def create_db_engine(app_settings: Settings):
+    """
+    Создает engine. Подключение к БД при этом не открывается
+    """
+    kwargs = {}
+    if is_postgresql(app_settings.DATABASE_URL):
+        pool_size, max_overflow = pool_limits(app_settings)
+        kwargs.update(
+            pool_size=pool_size,
+            max_overflow=max_overflow,
+            pool_timeout=app_settings.DB_POOL_TIMEOUT,
+        )
+        # psycopg 3 (postgresql+psycopg://) сам готовит на сервере запрос, выполненный на соединении
+        # DB_PREPARE_THRESHOLD раз (None - никогда); psycopg2 подготовленных запросов не поддерживает
+        if make_url(app_settings.DATABASE_URL).get_driver_name() == "psycopg":
+            threshold = app_settings.DB_PREPARE_THRESHOLD if app_settings.DB_PREPARED_STATEMENTS else None
+            kwargs["connect_args"] = {"prepare_threshold": threshold}
+
+    db_engine = create_engine(
+        app_settings.DATABASE_URL,
+        pool_pre_ping=True,
+        **kwargs
+    )
+
+    if db_engine.dialect.name == "sqlite":
+        # Каскады удаления выполняет БД, а SQLite проверяет внешние ключи только по запросу
+        @event.listens_for(db_engine, "connect")
+        def _enable_foreign_keys(dbapi_connection, connection_record):
+            dbapi_connection.execute("PRAGMA foreign_keys=ON")
+
+    return db_engine
+
 
-engine = create_engine(
-    settings.DATABASE_URL,
-    pool_pre_ping=True,
-)
+engine = create_db_engine(settings)
 
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Объекты после commit не сбрасываются: ответ на запись строится из уже известных данных
+# (все значения по умолчанию вычисляются в Python, id приходит через RETURNING), без повторных SELECT
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=engine)
 
 Base = declarative_base()
 
 
+# Дедлайн, под который настроен statement_timeout текущей транзакции сессии
+_DEADLINE = "request_deadline"
+
+
+def _set_statement_timeout(session, connection):
+    deadline = current_deadline()
+    applied = session.info.get(_DEADLINE)
+    session.info[_DEADLINE] = deadline
+    left = remaining()
+    if left is not None and left <= 0:
+        raise DeadlineExceeded()
+    if connection.dialect.name != "postgresql":
+        return
+    if left is not None:
+        connection.exec_driver_sql(f"SET LOCAL statement_timeout = {max(1, int(left * 1000))}")
+    elif applied is not None:
+        connection.exec_driver_sql("SET LOCAL statement_timeout TO DEFAULT")
+
+
+@event.listens_for(SessionLocal, "after_begin")
+def _apply_request_deadline(session, transaction, connection):
+    """
+    Транзакция в запросе с дедлайном ограничивается оставшимся временем: на Postgres через
+    statement_timeout (действует до конца транзакции), на остальных БД только проверкой при начале
+    """
+    session.info.pop(_DEADLINE, None)
+    _set_statement_timeout(session, connection)
+
+
+@event.listens_for(SessionLocal, "do_orm_execute")
+def _follow_request_deadline(orm_execute_state):
+    """
+    Дедлайн сменился внутри начатой транзакции (лидер single-flight выполняется без дедлайна
+    своего запроса): statement_timeout перенастраивается перед следующим запросом
+    """
+    session = orm_execute_state.session
+    if session.in_transaction() and session.info.get(_DEADLINE) != current_deadline():
+        _set_statement_timeout(session, session.connection())
+
+
+def replace_engine(db_engine):
+    """
+    Перепривязывает новые сессии к db_engine. Возвращает прежний engine; его закрывает вызывающий,
+    соединения уже начатых сессий при этом дорабатывают
+    """
+    global engine
+    previous, engine = engine, db_engine
+    SessionLocal.configure(bind=engine)
+    return previous
+
+
+def configure_engine(app_settings: Settings):
+    """
+    Пересоздает engine под переданные настройки и перепривязывает к нему сессии
+    """
+    replace_engine(create_db_engine(app_settings)).dispose()
+    return engine
+
+
 def get_db():
     db = SessionLocal()
     try:
@@ -1,4 +1,7 @@
-from fastapi import Header, HTTPException, status
+from typing import List, Optional, Tuple
+
+from fastapi import Header, HTTPException, Query, status
+from app import schemas
 from app.config import settings
 
 
@@ -11,4 +14,102 @@ async def get_api_key(x_api_key: str = Header(...)):
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Invalid API Key"
         )
-    return x_api_key
\ No newline at end of file
+    return x_api_key
+
+
+async def get_admin_api_key(x_admin_api_key: Optional[str] = Header(None)):
+    """
+    Проверка ключа админских эндпоинтов; если ADMIN_API_KEY не задан, они закрыты
+    """
+    if not settings.ADMIN_API_KEY or x_admin_api_key != settings.ADMIN_API_KEY:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Invalid admin API Key"
+        )
+    return x_admin_api_key
+
+
+def _split(value: Optional[str]) -> list:
+    return [name.strip() for name in value.split(",") if name.strip()] if value else []
+
+
+def get_organization_projection(
+        fields: Optional[str] = Query(
+            None, description="Поля через запятую, например id,name или id,name,phones"
+        ),
+        include: Optional[str] = Query(
+            None, description="Связи через запятую: building, phones, activities"
+        )
+) -> Optional[schemas.OrganizationProjection]:
+    """
+    Разбор fields=/include= в проекцию. Без параметров отдается организация целиком
+    """
+    if fields is None and include is None:
+        return None
+
+    requested_fields = _split(fields)
+    requested_relations = _split(include)
+
+    unknown = [name for name in requested_fields
+               if name not in schemas.ORGANIZATION_COLUMNS and name not in schemas.ORGANIZATION_RELATIONS]
+    unknown += [name for name in requested_relations if name not in schemas.ORGANIZATION_RELATIONS]
+    if unknown:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Unknown fields: {', '.join(unknown)}"
+        )
+
+    if fields is None:
+        columns = list(schemas.ORGANIZATION_COLUMNS)
+    else:
+        # id нужен всегда, чтобы клиент мог сопоставить запись
+        columns = [name for name in schemas.ORGANIZATION_COLUMNS if name == "id" or name in requested_fields]
+    relations = [name for name in schemas.ORGANIZATION_RELATIONS
+                 if name in requested_fields or name in requested_relations]
+
+    return schemas.OrganizationProjection(columns=columns, relations=relations)
+
+
+def get_ids(
+        ids: Optional[str] = Query(None, description="ID через запятую для выборки нескольких записей")
+) -> Optional[List[int]]:
+    if ids is None:
+        return None
+
+    try:
+        parsed = [int(value) for value in _split(ids)]
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="ids must be a comma-separated list of integers"
+        )
+
+    if len(parsed) > settings.MULTI_GET_MAX_IDS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Too many ids, max is {settings.MULTI_GET_MAX_IDS}"
+        )
+    return parsed
+
+
+def get_bbox(
+        bbox: str = Query(..., description="Прямоугольник карты: min_lon,min_lat,max_lon,max_lat")
+) -> Tuple[float, float, float, float]:
+    """
+    Разбор bbox в (min_lat, min_lon, max_lat, max_lon).
+    min_lon > max_lon допускается - прямоугольник пересекает антимеридиан
+    """
+    try:
+        min_lon, min_lat, max_lon, max_lat = [float(value) for value in _split(bbox)]
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="bbox must be min_lon,min_lat,max_lon,max_lat"
+        )
+
+    if not (-90 <= min_lat <= max_lat <= 90 and -180 <= min_lon <= 180 and -180 <= max_lon <= 180):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="bbox is out of range"
+        )
+    return min_lat, min_lon, max_lat, max_lon
@@ -0,0 +1,268 @@
+import heapq
+import math
+from collections import defaultdict
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+EARTH_RADIUS = 6371000  # Радиус Земли в метрах
+
+_GEOHASH_ALPHABET = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+
+def haversine_distance(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """
+    Расчет расстояния между двумя точками (в метрах)
+    Использует формулу гаверсинусов
+    """
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    delta_phi = math.radians(lat2 - lat1)
+    delta_lambda = math.radians(lon2 - lon1)
+
+    a = (math.sin(delta_phi / 2) ** 2 +
+         math.cos(phi1) * math.cos(phi2) *
+         math.sin(delta_lambda / 2) ** 2)
+    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+
+    return EARTH_RADIUS * c
+
+
+def bounding_box(lat: float, lon: float, radius: float) -> Tuple[float, float, float, float]:
+    """
+    Прямоугольник (min_lat, max_lat, min_lon, max_lon), гарантированно содержащий круг радиуса radius
+    """
+    delta_lat = math.degrees(radius / EARTH_RADIUS)
+    min_lat = max(-90.0, lat - delta_lat)
+    max_lat = min(90.0, lat + delta_lat)
+
+    # Вблизи полюса круг накрывает все долготы
+    max_abs_lat = max(abs(min_lat), abs(max_lat))
+    if max_abs_lat >= 89.999:
+        return min_lat, max_lat, -180.0, 180.0
+
+    delta_lon = math.degrees(radius / (EARTH_RADIUS * math.cos(math.radians(max_abs_lat))))
+    if delta_lon >= 180:
+        return min_lat, max_lat, -180.0, 180.0
+    return min_lat, max_lat, lon - delta_lon, lon + delta_lon
+
+
+def geohash(lat: float, lon: float, precision: int) -> str:
+    """
+    Geohash точки длиной precision символов
+    """
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    value = 0
+    even = True
+    while len(chars) < precision:
+        # Четные биты делят долготу, нечетные - широту
+        coordinate, interval = (lon, lon_range) if even else (lat, lat_range)
+        middle = (interval[0] + interval[1]) / 2
+        value <<= 1
+        if coordinate >= middle:
+            value |= 1
+            interval[0] = middle
+        else:
+            interval[1] = middle
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(_GEOHASH_ALPHABET[value])
+            bits = 0
+            value = 0
+    return "".join(chars)
+
+
+def geohash_cell_size(precision: int) -> Tuple[float, float]:
+    """
+    Размер ячейки geohash длины precision в градусах: (по широте, по долготе)
+    """
+    lon_bits = (5 * precision + 1) // 2
+    lat_bits = 5 * precision // 2
+    return 180.0 / 2 ** lat_bits, 360.0 / 2 ** lon_bits
+
+
+def geohash_cells(
+        min_lat: float,
+        max_lat: float,
+        min_lon: float,
+        max_lon: float,
+        precision: int,
+        max_cells: int
+) -> Optional[List[str]]:
+    """
+    Geohash-ячейки длины precision, пересекающие прямоугольник.
+    Долготы за пределами [-180, 180] переносятся через антимеридиан.
+    None, если ячеек больше max_cells: условие по ним уже ничего не отсекает
+    """
+    cell_lat, cell_lon = geohash_cell_size(precision)
+
+    ranges = [(min_lon, max_lon)]
+    if max_lon - min_lon >= 360:
+        ranges = [(-180.0, 180.0)]
+    elif min_lon < -180:
+        ranges = [(-180.0, max_lon), (min_lon + 360, 180.0)]
+    elif max_lon > 180:
+        ranges = [(min_lon, 180.0), (-180.0, max_lon - 360)]
+
+    min_row = int((max(min_lat, -90.0) + 90) // cell_lat)
+    max_row = min(int((min(max_lat, 90.0) + 90) // cell_lat), int(180 / cell_lat) - 1)
+    columns = set()
+    for range_min_lon, range_max_lon in ranges:
+        min_col = int((max(range_min_lon, -180.0) + 180) // cell_lon)
+        max_col = min(int((min(range_max_lon, 180.0) + 180) // cell_lon), int(360 / cell_lon) - 1)
+        columns.update(range(min_col, max_col + 1))
+
+    if (max_row - min_row + 1) * len(columns) > max_cells:
+        return None
+
+    # Ячейка однозначно задается любой своей внутренней точкой, берется центр
+    return sorted(
+        geohash(-90 + (row + 0.5) * cell_lat, -180 + (col + 0.5) * cell_lon, precision)
+        for row in range(min_row, max_row + 1)
+        for col in sorted(columns)
+    )
+
+
+def min_distance_beyond(lat: float, delta_lat: float, delta_lon: float) -> float:
+    """
+    Нижняя граница расстояния (в метрах) от точки до любой точки,
+    отстоящей от нее не меньше чем на delta_lat по широте или на delta_lon по долготе
+    """
+    by_lat = EARTH_RADIUS * math.radians(delta_lat)
+    # hav(d) >= cos(phi1) * cos(phi2) * hav(delta_lambda) >= cos^2(phi_max) * hav(delta_lambda)
+    max_lat = min(90.0, abs(lat) + delta_lat)
+    by_lon = 2 * EARTH_RADIUS * math.asin(min(
+        1.0, math.cos(math.radians(max_lat)) * math.sin(math.radians(min(delta_lon, 180.0)) / 2)
+    ))
+    return min(by_lat, by_lon)
+
+
+def order_by_distance(
+        lat: float,
+        lon: float,
+        candidates: Iterable[Tuple[Iterable[Tuple[int, float, float]], float]]
+) -> Iterator[Tuple[int, float]]:
+    """
+    Превращает поток кандидатов в поток (id, расстояние) строго по возрастанию расстояния.
+    candidates - порции точек вместе с нижней границей расстояния для всех последующих порций
+    """
+    heap = []
+    for points, bound in candidates:
+        for point_id, p_lat, p_lon in points:
+            heapq.heappush(heap, (haversine_distance(lat, lon, p_lat, p_lon), point_id))
+        while heap and heap[0][0] <= bound:
+            distance, point_id = heapq.heappop(heap)
+            yield point_id, distance
+
+    while heap:
+        distance, point_id = heapq.heappop(heap)
+        yield point_id, distance
+
+
+class GeoIndex:
+    """
+    Сеточный индекс зданий в памяти: ячейка (cell_size градусов) -> [(id, lat, lon)]
+    """
+
+    def __init__(self, points: List[Tuple[int, float, float]], cell_size: float):
+        self.cell_size = cell_size
+        self.cells: Dict[Tuple[int, int], List[Tuple[int, float, float]]] = defaultdict(list)
+        for building_id, lat, lon in points:
+            self.cells[self._cell(lat, lon)].append((building_id, lat, lon))
+        self.size = len(points)
+
+    def _cell(self, lat: float, lon: float) -> Tuple[int, int]:
+        return int(math.floor(lat / self.cell_size)), int(math.floor(lon / self.cell_size))
+
+    def in_rectangle(self, min_lat: float, max_lat: float, min_lon: float, max_lon: float) -> List[Tuple[int, float, float]]:
+        min_row, min_col = self._cell(min_lat, min_lon)
+        max_row, max_col = self._cell(max_lat, max_lon)
+
+        # Если прямоугольник накрывает больше ячеек, чем их заполнено, дешевле обойти заполненные
+        if (max_row - min_row + 1) * (max_col - min_col + 1) > len(self.cells):
+            keys = [key for key in self.cells
+                    if min_row <= key[0] <= max_row and min_col <= key[1] <= max_col]
+        else:
+            keys = [(row, col)
+                    for row in range(min_row, max_row + 1)
+                    for col in range(min_col, max_col + 1)
+                    if (row, col) in self.cells]
+
+        return [
+            point
+            for key in keys
+            for point in self.cells[key]
+            if min_lat <= point[1] <= max_lat and min_lon <= point[2] <= max_lon
+        ]
+
+    def _rings(self, lat: float, lon: float):
+        """
+        Кольца ячеек вокруг точки: (точки кольца, нижняя граница расстояния до следующих колец)
+        """
+        center_row, center_col = self._cell(lat, lon)
+
+        def ring_of(key):
+            return max(abs(key[0] - center_row), abs(key[1] - center_col))
+
+        ring = 0
+        visited = 0
+        grouped = None
+        while visited < len(self.cells):
+            if grouped is None and 8 * ring + 1 > len(self.cells):
+                # Разреженные данные: дешевле один раз разложить заполненные ячейки по кольцам
+                grouped = defaultdict(list)
+                for key in self.cells:
+                    if ring_of(key) >= ring:
+                        grouped[ring_of(key)].append(key)
+
+            if grouped is not None:
+                ring = min(grouped)
+                keys = grouped.pop(ring)
+            elif ring == 0:
+                keys = [(center_row, center_col)] if (center_row, center_col) in self.cells else []
+            else:
+                keys = [key for key in self._ring_keys(center_row, center_col, ring) if key in self.cells]
+
+            visited += len(keys)
+            points = [point for key in keys for point in self.cells[key]]
+            # Следующие кольца отстоят от точки минимум на ring ячеек
+            span = ring * self.cell_size
+            yield points, min_distance_beyond(lat, span, span)
+            ring += 1
+
+    @staticmethod
+    def _ring_keys(center_row: int, center_col: int, ring: int):
+        for col in range(center_col - ring, center_col + ring + 1):
+            yield center_row - ring, col
+            yield center_row + ring, col
+        for row in range(center_row - ring + 1, center_row + ring):
+            yield row, center_col - ring
+            yield row, center_col + ring
+
+    def iter_nearest(self, lat: float, lon: float) -> Iterator[Tuple[int, float]]:
+        """
+        ID зданий с расстоянием в порядке удаления от точки (поиск расширяющимися кольцами)
+        """
+        return order_by_distance(lat, lon, self._rings(lat, lon))
+
+    def in_radius(self, lat: float, lon: float, radius: float) -> List[int]:
+        """
+        ID зданий на расстоянии не больше radius метров от точки
+        """
+        min_lat, max_lat, min_lon, max_lon = bounding_box(lat, lon, radius)
+
+        # Круг может пересекать антимеридиан
+        ranges = [(min_lon, max_lon)]
+        if min_lon < -180:
+            ranges = [(-180.0, max_lon), (min_lon + 360, 180.0)]
+        elif max_lon > 180:
+            ranges = [(min_lon, 180.0), (-180.0, max_lon - 360)]
+
+        result = []
+        for range_min_lon, range_max_lon in ranges:
+            for building_id, b_lat, b_lon in self.in_rectangle(min_lat, max_lat, range_min_lon, range_max_lon):
+                if haversine_distance(lat, lon, b_lat, b_lon) <= radius:
+                    result.append(building_id)
+        return result
@@ -0,0 +1,64 @@
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Optional
+
+from fastapi import Request, Response, status
+
+
+def make_etag(*parts) -> str:
+    # Слабый ETag: тело может отличаться сжатием, но данные те же
+    return 'W/"' + "-".join(str(part) for part in parts) + '"'
+
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag[2:] if etag.startswith("W/") else etag
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == opaque:
+            return True
+    return False
+
+
+def _not_modified_since(if_modified_since: str, last_modified: int) -> bool:
+    try:
+        return last_modified <= int(parsedate_to_datetime(if_modified_since).timestamp())
+    except (TypeError, ValueError):
+        return False
+
+
+def conditional_response(
+        request: Request,
+        response: Response,
+        etag: str,
+        last_modified: int
+) -> Optional[Response]:
+    """
+    Выставляет ETag/Last-Modified и возвращает 304, если версия у клиента актуальна.
+    Вызывается до загрузки и сериализации данных
+    """
+    headers = {
+        "ETag": etag,
+        "Cache-Control": "private, no-cache",
+    }
+    if last_modified:
+        headers["Last-Modified"] = formatdate(last_modified, usegmt=True)
+
+    if_none_match = request.headers.get("if-none-match")
+    if_modified_since = request.headers.get("if-modified-since")
+
+    # If-None-Match имеет приоритет над If-Modified-Since
+    if if_none_match is not None:
+        not_modified = _etag_matches(if_none_match, etag)
+    elif if_modified_since is not None and last_modified:
+        not_modified = _not_modified_since(if_modified_since, last_modified)
+    else:
+        not_modified = False
+
+    if not_modified:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    response.headers.update(headers)
+    return None
@@ -0,0 +1,418 @@
+"""
+Фоновые задачи на таблице jobs в той же БД, без внешнего брокера.
+
+API ставит задачу (enqueue) и сразу отвечает 202 с id задачи, воркер забирает задачи из очереди,
+выполняет обработчик и при ошибке повторяет с экспоненциальной задержкой.
+Воркер запускается отдельным процессом:
+
+    python -m app.jobs
+
+или потоком внутри веб-воркера (JOB_WORKER_IN_PROCESS). На Postgres несколько воркеров
+разбирают очередь параллельно: строки захватываются через FOR UPDATE SKIP LOCKED.
+"""
+import argparse
+import logging
+import os
+import signal
+import socket
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from sqlalchemy import and_, or_, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from app import crud, models, replica, schemas, snapshots
+from app.config import settings
+from app.database import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+PURGE_DELETED = "purge_deleted"
+DELETE_BUILDINGS = "delete_buildings"
+IMPORT_ORGANIZATIONS = "import_organizations"
+RECOMPUTE_ACTIVITY_LEVELS = "recompute_activity_levels"
+RECOMPUTE_GEO_REGIONS = "recompute_geo_regions"
+BUILD_SNAPSHOT = "build_snapshot"
+BUILD_REPLICA = "build_replica"
+
+Handler = Callable[[Session, Dict[str, Any]], Optional[Dict[str, Any]]]
+
+_handlers: Dict[str, Handler] = {}
+
+
+def handler(kind: str):
+    """
+    Регистрирует обработчик задачи: handler(db, payload) -> результат (dict) или None
+    """
+    def decorator(func: Handler) -> Handler:
+        _handlers[kind] = func
+        return func
+    return decorator
+
+
+def is_registered(kind: str) -> bool:
+    return kind in _handlers
+
+
+def enqueue(db: Session, kind: str, payload: Optional[dict] = None, unique: bool = False) -> models.Job:
+    """
+    Ставит задачу в очередь и фиксирует транзакцию.
+    unique - не ставить новую, если такая задача уже ждет выполнения
+    """
+    if kind not in _handlers:
+        raise ValueError(f"Unknown job kind: {kind}")
+
+    if unique:
+        return _enqueue_unique(db, kind, payload or {})
+
+    job = models.Job(kind=kind, payload=payload or {}, status=QUEUED, max_attempts=settings.JOB_MAX_ATTEMPTS)
+    db.add(job)
+    db.commit()
+    return job
+
+
+def _enqueue_unique(db: Session, kind: str, payload: dict) -> models.Job:
+    """
+    INSERT ... ON CONFLICT DO NOTHING по частичному уникальному индексу ux_jobs_unique_key_queued:
+    параллельные вызовы не поставят двух ожидающих задач, лишние получат уже поставленную
+    """
+    insert = postgresql.insert if db.get_bind().dialect.name == "postgresql" else sqlite.insert
+    statement = insert(models.Job).values(
+        kind=kind, payload=payload, status=QUEUED, max_attempts=settings.JOB_MAX_ATTEMPTS, unique_key=kind
+    ).on_conflict_do_nothing(
+        index_elements=[models.Job.unique_key], index_where=models.Job.status == QUEUED
+    ).returning(models.Job)
+
+    while True:
+        job = db.scalars(statement).first()
+        if job is None:
+            job = db.scalars(
+                select(models.Job).where(models.Job.unique_key == kind, models.Job.status == QUEUED)
+            ).first()
+        db.commit()
+        # Ожидавшую задачу могли забрать между вставкой и чтением - тогда ставим заново
+        if job is not None:
+            return job
+
+
+def get_job(db: Session, job_id: int) -> Optional[models.Job]:
+    return db.query(models.Job).filter(models.Job.id == job_id).first()
+
+
+def get_jobs(
+        db: Session,
+        status: Optional[str] = None,
+        kind: Optional[str] = None,
+        skip: int = 0,
+        limit: int = 100
+) -> List[models.Job]:
+    query = db.query(models.Job)
+    if status is not None:
+        query = query.filter(models.Job.status == status)
+    if kind is not None:
+        query = query.filter(models.Job.kind == kind)
+    return query.order_by(models.Job.id.desc()).offset(skip).limit(limit).all()
+
+
+def retry_delay(attempts: int) -> float:
+    """
+    Задержка перед повтором после attempts неудачных попыток
+    """
+    return min(settings.JOB_RETRY_BASE_DELAY * 2 ** (attempts - 1), settings.JOB_RETRY_MAX_DELAY)
+
+
+def claim(db: Session, worker_id: str) -> Optional[models.Job]:
+    """
+    Захватывает следующую готовую задачу.
+    Пока задача выполняется, воркер продлевает locked_at (_Heartbeat); задачи, у которых он не продлевался
+    дольше JOB_LOCK_TIMEOUT (упавший воркер), забираются повторно
+    """
+    now = int(time.time())
+    query = db.query(models.Job).filter(or_(
+        and_(models.Job.status == QUEUED, models.Job.run_at <= now),
+        and_(models.Job.status == RUNNING, models.Job.locked_at < now - settings.JOB_LOCK_TIMEOUT)
+    )).order_by(models.Job.run_at, models.Job.id)
+
+    # SQLite сериализует запись сам и не поддерживает FOR UPDATE
+    if db.get_bind().dialect.name == "postgresql":
+        query = query.with_for_update(skip_locked=True)
+
+    while True:
+        job = query.first()
+        if job is None:
+            db.rollback()
+            return None
+        if job.status == QUEUED or job.attempts < job.max_attempts:
+            break
+        # Брошенная задача исчерпала попытки: больше не выполняется
+        logger.warning("Job %s lock expired after %s attempts, marking failed", job.id, job.attempts)
+        job.status = FAILED
+        job.last_error = f"Lock expired: worker {job.locked_by} stopped after attempt {job.attempts}"
+        job.locked_by = None
+        job.finished_at = now
+        db.commit()
+
+    job.status = RUNNING
+    job.attempts += 1
+    job.locked_by = worker_id
+    job.locked_at = now
+    db.commit()
+    return job
+
+
+def _update_locked(db: Session, job_id: int, worker_id: str, **values) -> bool:
+    """
+    Обновляет задачу, только если она все еще захвачена этим воркером.
+    Воркер, у которого задачу забрали повторно, не перезаписывает ее статус
+    """
+    updated = db.execute(
+        update(models.Job).where(
+            models.Job.id == job_id,
+            models.Job.status == RUNNING,
+            models.Job.locked_by == worker_id
+        ).values(**values)
+    ).rowcount
+    db.commit()
+    if not updated:
+        logger.warning("Job %s is no longer locked by %s, status not updated", job_id, worker_id)
+    return bool(updated)
+
+
+def _finish(db: Session, job_id: int, worker_id: str, result: Optional[dict]) -> bool:
+    return _update_locked(
+        db, job_id, worker_id,
+        status=SUCCEEDED, result=result, last_error=None, locked_by=None, finished_at=int(time.time())
+    )
+
+
+def _fail(db: Session, job_id: int, worker_id: str, attempts: int, max_attempts: int, error: str) -> bool:
+    failed = {"status": FAILED, "finished_at": int(time.time())}
+    if attempts >= max_attempts:
+        return _update_locked(db, job_id, worker_id, last_error=error, locked_by=None, **failed)
+
+    retry = {"status": QUEUED, "run_at": int(time.time() + retry_delay(attempts))}
+    try:
+        return _update_locked(db, job_id, worker_id, last_error=error, locked_by=None, **retry)
+    except IntegrityError:
+        # Такая же задача enqueue(unique=True) уже ждет в очереди: она и выполнит повтор
+        db.rollback()
+        return _update_locked(db, job_id, worker_id, last_error=error, locked_by=None, **failed)
+
+
+class _Heartbeat(threading.Thread):
+    """
+    Продлевает locked_at задачи раз в JOB_HEARTBEAT_INTERVAL, пока выполняется обработчик,
+    чтобы долгую задачу не забрал повторно другой воркер
+    """
+
+    def __init__(self, job_id: int, worker_id: str):
+        super().__init__(name=f"job-heartbeat-{job_id}", daemon=True)
+        self.job_id = job_id
+        self.worker_id = worker_id
+        self._stopped = threading.Event()
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+    def run(self):
+        while not self._stopped.wait(settings.JOB_HEARTBEAT_INTERVAL):
+            db = SessionLocal()
+            try:
+                renewed = db.execute(
+                    update(models.Job).where(
+                        models.Job.id == self.job_id,
+                        models.Job.status == RUNNING,
+                        models.Job.locked_by == self.worker_id
+                    ).values(locked_at=int(time.time()))
+                ).rowcount
+                db.commit()
+            except Exception:
+                logger.exception("Job %s heartbeat failed", self.job_id)
+                continue
+            finally:
+                db.close()
+
+            if not renewed:
+                logger.warning("Job %s lock lost by %s", self.job_id, self.worker_id)
+                return
+
+
+def run_job(job_id: int, worker_id: str):
+    """
+    Выполняет захваченную задачу. Обработчик работает в своей сессии, чтобы его откат
+    не затрагивал запись статуса; сессия статуса закрыта, пока обработчик выполняется
+    """
+    db = SessionLocal()
+    try:
+        job = get_job(db, job_id)
+        if job is None:
+            return
+        kind, payload, attempts, max_attempts = job.kind, dict(job.payload or {}), job.attempts, job.max_attempts
+        db.commit()
+
+        func = _handlers.get(kind)
+        if func is None:
+            _fail(db, job_id, worker_id, max_attempts, max_attempts, f"Unknown job kind: {kind}")
+            return
+    finally:
+        db.close()
+
+    heartbeat = _Heartbeat(job_id, worker_id)
+    heartbeat.start()
+    work_db = SessionLocal()
+    try:
+        result = func(work_db, payload)
+        error = None
+    except Exception as exception:
+        work_db.rollback()
+        logger.exception("Job %s (%s) failed, attempt %s", job_id, kind, attempts)
+        result, error = None, f"{type(exception).__name__}: {exception}"
+    finally:
+        work_db.close()
+        heartbeat.stop()
+
+    db = SessionLocal()
+    try:
+        if error is None:
+            _finish(db, job_id, worker_id, result)
+        else:
+            _fail(db, job_id, worker_id, attempts, max_attempts, error)
+    finally:
+        db.close()
+
+
+def run_pending(worker_id: str, stop: Optional[threading.Event] = None) -> int:
+    """
+    Выполняет готовые задачи, пока очередь не опустеет. Возвращает число выполненных
+    """
+    done = 0
+    while stop is None or not stop.is_set():
+        db = SessionLocal()
+        try:
+            job = claim(db, worker_id)
+            job_id = job.id if job is not None else None
+        finally:
+            db.close()
+
+        if job_id is None:
+            break
+        run_job(job_id, worker_id)
+        done += 1
+    return done
+
+
+def default_worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"
+
+
+def run_worker(stop: threading.Event, worker_id: Optional[str] = None):
+    """
+    Цикл воркера: выполняет задачи и опрашивает очередь раз в JOB_POLL_INTERVAL
+    """
+    worker_id = worker_id or default_worker_id()
+    while not stop.is_set():
+        try:
+            run_pending(worker_id, stop)
+        except Exception:
+            logger.exception("Job worker iteration failed")
+        stop.wait(settings.JOB_POLL_INTERVAL)
+
+
+class WorkerThread(threading.Thread):
+    """
+    Воркер очереди внутри веб-процесса
+    """
+
+    def __init__(self):
+        super().__init__(name="job-worker", daemon=True)
+        self._stopped = threading.Event()
+
+    def stop(self):
+        self._stopped.set()
+
+    def run(self):
+        run_worker(self._stopped)
+
+
+def start_worker_thread() -> Optional[WorkerThread]:
+    if not settings.JOB_WORKER_IN_PROCESS:
+        return None
+
+    worker = WorkerThread()
+    worker.start()
+    return worker
+
+
+@handler(PURGE_DELETED)
+def _purge_deleted(db: Session, payload: dict) -> dict:
+    return {"purged": crud.purge_deleted(db, batch_size=payload.get("batch_size"))}
+
+
+@handler(DELETE_BUILDINGS)
+def _delete_buildings(db: Session, payload: dict) -> dict:
+    # Удаляем пакетами, чтобы не держать долгую транзакцию на большом списке
+    building_ids = payload["ids"]
+    deleted = 0
+    for start in range(0, len(building_ids), settings.JOB_INLINE_MAX_IDS):
+        deleted += crud.delete_buildings(db, building_ids[start:start + settings.JOB_INLINE_MAX_IDS])
+    result = {"deleted": deleted}
+    if settings.SOFT_DELETE_ENABLED and deleted:
+        result["purged"] = crud.purge_deleted(db)
+    return result
+
+
+@handler(IMPORT_ORGANIZATIONS)
+def _import_organizations(db: Session, payload: dict) -> dict:
+    organizations = [schemas.OrganizationCreate.model_validate(item) for item in payload["organizations"]]
+    return {"ids": crud.import_organizations(db, organizations, idempotency_key=payload.get("idempotency_key"))}
+
+
+@handler(RECOMPUTE_ACTIVITY_LEVELS)
+def _recompute_activity_levels(db: Session, payload: dict) -> dict:
+    return {"fixed": crud.recompute_activity_levels(db)}
+
+
+@handler(RECOMPUTE_GEO_REGIONS)
+def _recompute_geo_regions(db: Session, payload: dict) -> dict:
+    return {"fixed": crud.recompute_geo_regions(db, batch_size=payload.get("batch_size"))}
+
+
+@handler(BUILD_SNAPSHOT)
+def _build_snapshot(db: Session, payload: dict) -> dict:
+    return snapshots.build_snapshot(db)
+
+
+@handler(BUILD_REPLICA)
+def _build_replica(db: Session, payload: dict) -> dict:
+    return replica.build_replica(db)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Воркер фоновых задач")
+    parser.add_argument("--burst", action="store_true", help="Выполнить готовые задачи и выйти")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    if args.burst:
+        logger.info("Done %s jobs", run_pending(default_worker_id()))
+        return
+
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+    logger.info("Job worker started")
+    run_worker(stop)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+from typing import Dict, List, Optional
+
+from sqlalchemy import Select, bindparam, event, select
+from sqlalchemy.orm import Session, joinedload, selectinload
+
+from app import models
+from app.config import settings
+from app.statements import cached_statement
+
+_LOADERS = "loaders"
+
+
+def activity_children(via=None):
+    """
+    Опция загрузки дочерних видов деятельности всех уровней (schemas.Activity сериализует children
+    рекурсивно): по одному запросу на уровень вместо запроса на каждый вид деятельности.
+    via - связь, через которую загружаются сами виды деятельности
+    """
+    children = models.Activity.children
+    if via is None:
+        return selectinload(children, recursion_depth=settings.MAX_ACTIVITY_LEVEL)
+    return selectinload(via).selectinload(children, recursion_depth=settings.MAX_ACTIVITY_LEVEL)
+
+
+def _loader_options(model) -> list:
+    # Связи, которые сериализуются вместе с сущностью, грузятся тем же пакетом, а не по одной
+    if model is models.Organization:
+        return [
+            joinedload(models.Organization.building),
+            selectinload(models.Organization.phones),
+            activity_children(models.Organization.activities)
+        ]
+    return []
+
+
+def _load_statement(model) -> Select:
+    def build() -> Select:
+        statement = select(model).options(*_loader_options(model)).where(
+            model.id.in_(bindparam("ids", expanding=True))
+        )
+        if hasattr(model, "deleted_at"):
+            statement = statement.where(model.deleted_at.is_(None))
+        return statement
+
+    return cached_statement(("loader", model), build)
+
+
+class BatchLoader:
+    """
+    Загрузчик сущностей по id в пределах одной сессии (одного запроса).
+    Все еще не загруженные id из load_many выбираются одним запросом IN; результат (в т.ч. отсутствие)
+    кэшируется до конца транзакции. Отдельные вызовы load не объединяются: каждый - свой запрос
+    """
+
+    def __init__(self, db: Session, model):
+        self.db = db
+        self.model = model
+        self._cache: Dict[int, Optional[object]] = {}
+
+    def load_many(self, ids: List[int]) -> List[Optional[object]]:
+        """
+        Сущности в порядке ids, None для отсутствующих
+        """
+        missing = list({entity_id for entity_id in ids if entity_id not in self._cache})
+        if missing:
+            entities = self.db.execute(_load_statement(self.model), {"ids": missing}).scalars().all()
+            found = {entity.id: entity for entity in entities}
+            for entity_id in missing:
+                self._cache[entity_id] = found.get(entity_id)
+        return [self._cache.get(entity_id) for entity_id in ids]
+
+    def load(self, entity_id: int) -> Optional[object]:
+        return self.load_many([entity_id])[0]
+
+
+@event.listens_for(Session, "after_commit")
+@event.listens_for(Session, "after_rollback")
+def _reset_loaders(db: Session):
+    # После commit или отката закэшированные сущности и промахи могут быть неактуальны
+    db.info.pop(_LOADERS, None)
+
+
+def get_loader(db: Session, model) -> BatchLoader:
+    """
+    Загрузчик для модели, общий для всех вызовов crud в рамках сессии
+    """
+    loaders = db.info.setdefault(_LOADERS, {})
+    loader = loaders.get(model)
+    if loader is None:
+        loader = loaders[model] = BatchLoader(db, model)
+    return loader
@@ -1,34 +1,134 @@
-from fastapi import FastAPI
+import logging
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI, Request
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from app.routers import organizations, buildings, activities
-from app.database import engine, Base
-from app.seed_data import seed_data
+from app.routers import (
+    organizations, buildings, activities, changes, suggest, snapshots, admin, jobs as jobs_router
+)
+from sqlalchemy.exc import OperationalError
 
-Base.metadata.create_all(bind=engine)
-seed_data()
+from app import admission, cache, compression, database, jobs, replica
+from app.config import Settings, settings
 
+logger = logging.getLogger(__name__)
 
-app = FastAPI(
-    docs_url="/docs",
-    redoc_url="/redoc"
-)
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+def initialize_database(app_settings: Settings):
+    """
+    Создание таблиц и заполнение тестовыми данными
+    """
+    if app_settings.DB_CREATE_ALL_ON_STARTUP:
+        database.Base.metadata.create_all(bind=database.engine)
+
+    if app_settings.SEED_ON_STARTUP:
+        from app.seed_data import seed_data
+        seed_data()
+
+
+def warmup(app_settings: Settings):
+    """
+    Открывает соединения пула и заполняет кэши до приема запросов
+    """
+    connections = [database.engine.connect() for _ in range(app_settings.WARMUP_POOL_CONNECTIONS)]
+    for connection in connections:
+        connection.close()
+
+    if app_settings.WARMUP_CACHES:
+        db = database.SessionLocal()
+        try:
+            cache.prime(db)
+        finally:
+            db.close()
+
+
+def startup(app_settings: Settings):
+    # Недоступная БД не должна мешать воркеру подняться
+    try:
+        initialize_database(app_settings)
+        warmup(app_settings)
+    except Exception:
+        logger.exception("Startup database work failed")
+
+
+def create_app(app_settings: Settings = settings) -> FastAPI:
+    if app_settings is not settings:
+        database.configure_engine(app_settings)
+
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        if app.state.replica is not None:
+            # Воркер реплики не обращается к БД: ни создания таблиц, ни очереди задач, ни LISTEN
+            await run_in_threadpool(app.state.replica.refresh)
+            refresher = replica.ReplicaRefresher(app.state.replica)
+            refresher.start()
+            yield
+            refresher.stop()
+        else:
+            listener = cache.start_listener()
+            await run_in_threadpool(startup, app_settings)
+            worker = jobs.start_worker_thread()
+            yield
+            if worker is not None:
+                worker.stop()
+            if listener is not None:
+                listener.stop()
+        cache.invalidate_all()
+        database.engine.dispose()
+
+    app = FastAPI(
+        docs_url="/docs",
+        redoc_url="/redoc",
+        lifespan=lifespan
+    )
+    app.state.replica = replica.Replica(app_settings) if app_settings.READ_SNAPSHOT_MODE else None
+
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=["*"],
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+
+    # Файлы снимков и запросы с Range не сжимаются (app/compression.py)
+    app.add_middleware(compression.CompressionMiddleware, router=app.router, app_settings=app_settings)
+
+    # Добавлены последними, поэтому выполняются первыми: отклоненный запрос не доходит до сжатия и CORS
+    app.state.admission = admission.AdmissionControl(app_settings)
+    app.add_middleware(admission.AdmissionControlMiddleware, router=app.router, control=app.state.admission)
+    if app.state.replica is not None:
+        app.add_middleware(replica.ReadSnapshotMiddleware, replica=app.state.replica)
+
+    @app.exception_handler(admission.DeadlineExceeded)
+    async def deadline_exceeded(request: Request, error: admission.DeadlineExceeded):
+        return admission.overloaded_response(app_settings.ADMISSION_RETRY_AFTER, "Request deadline exceeded")
+
+    @app.exception_handler(OperationalError)
+    async def statement_timeout(request: Request, error: OperationalError):
+        # Остальные ошибки БД обрабатываются как раньше (500)
+        if not admission.is_statement_timeout(error):
+            raise error
+        return admission.overloaded_response(app_settings.ADMISSION_RETRY_AFTER, "Request deadline exceeded")
+
+    app.include_router(organizations.router, prefix="/api/v1")
+    app.include_router(buildings.router, prefix="/api/v1")
+    app.include_router(activities.router, prefix="/api/v1")
+    app.include_router(changes.router, prefix="/api/v1")
+    app.include_router(suggest.router, prefix="/api/v1")
+    app.include_router(snapshots.router, prefix="/api/v1")
+    app.include_router(jobs_router.router, prefix="/api/v1")
+    app.include_router(admin.router, prefix="/api/v1")
+
+    @app.get("/")
+    async def root():
+        return {
+            "docs": "/docs",
+            "redoc": "/redoc"
+        }
 
-app.include_router(organizations.router, prefix="/api/v1")
-app.include_router(buildings.router, prefix="/api/v1")
-app.include_router(activities.router, prefix="/api/v1")
+    return app
 
 
-@app.get("/")
-async def root():
-    return {
-        "docs": "/docs",
-        "redoc": "/redoc"
-    }
+app = create_app()
@@ -1,34 +1,78 @@
 import time
-from sqlalchemy import Column, Integer, String, Float, ForeignKey, Table, Text, CheckConstraint
-from sqlalchemy.orm import relationship
+from sqlalchemy import (
+    BigInteger, Column, DDL, Integer, JSON, String, Float, ForeignKey, Index, Table, Text, CheckConstraint, and_,
+    event, func, text
+)
+from sqlalchemy.orm import foreign, relationship, remote
+from app.config import settings
 from app.database import Base
+from app.geo import geohash
+
+# Триграммные индексы для поиска ilike '%...%' по названиям (только Postgres)
+event.listen(
+    Base.metadata,
+    "before_create",
+    DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm").execute_if(dialect="postgresql")
+)
 
 organization_activity = Table(
     'organization_activity',
     Base.metadata,
-    Column('organization_id', Integer, ForeignKey('organizations.id', ondelete="CASCADE")),
-    Column('activity_id', Integer, ForeignKey('activities.id', ondelete="CASCADE"))
+    Column('organization_id', Integer, ForeignKey('organizations.id', ondelete="CASCADE"), index=True),
+    Column('activity_id', Integer, ForeignKey('activities.id', ondelete="CASCADE"), index=True)
 )
 
 
+def building_region(latitude: float, longitude: float) -> str:
+    """
+    Георегион точки: ключ секционирования зданий
+    """
+    return geohash(latitude, longitude, settings.GEO_REGION_PRECISION)
+
+
+def _default_building_region(context) -> str:
+    parameters = context.get_current_parameters()
+    return building_region(parameters["latitude"], parameters["longitude"])
+
+
 class Organization(Base):
     __tablename__ = "organizations"
 
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String(255), nullable=False, index=True)
     description = Column(Text, nullable=True)
-    building_id = Column(Integer, ForeignKey("buildings.id", ondelete="SET NULL"), nullable=True)
+    building_id = Column(Integer, ForeignKey("buildings.id", ondelete="SET NULL"), nullable=True, index=True)
+    # Копия geo_region здания: организации одного региона лежат рядом в индексе и в таблице
+    geo_region = Column(String(12), nullable=True)
     created_at = Column(Integer, default=lambda: int(time.time()))
-    updated_at = Column(Integer, default=lambda: int(time.time()), onupdate=lambda: int(time.time()))
+    updated_at = Column(Integer, default=lambda: int(time.time()), onupdate=lambda: int(time.time()), index=True)
+
+    __table_args__ = (
+        Index(
+            'ix_organizations_name_trgm',
+            'name',
+            postgresql_using='gin',
+            postgresql_ops={'name': 'gin_trgm_ops'}
+        ).ddl_if(dialect='postgresql'),
+        Index('ix_organizations_geo_region_building_id', 'geo_region', 'building_id'),
+    )
 
-    building = relationship("Building", back_populates="organizations")
+    # Соединение и по региону: при секционированных buildings Postgres читает одну секцию, а не все.
+    # Мягко удаленные здания и виды деятельности в связи не попадают, хотя строки еще есть до очистки
+    building = relationship(
+        "Building",
+        primaryjoin=lambda: _building_join(),
+        back_populates="organizations"
+    )
     activities = relationship(
         "Activity",
         secondary=organization_activity,
+        secondaryjoin=lambda: _activity_join(),
         back_populates="organizations",
-        lazy="selectin"
+        lazy="selectin",
+        passive_deletes=True
     )
-    phones = relationship("Phone", back_populates="organization", cascade="all, delete-orphan")
+    phones = relationship("Phone", back_populates="organization", cascade="all, delete-orphan", passive_deletes=True)
 
 
 class Phone(Base):
@@ -36,10 +80,13 @@ class Phone(Base):
 
     id = Column(Integer, primary_key=True, index=True)
     number = Column(String(50), nullable=False)
+    # Канонический вид номера для поиска (app.phones.normalize_phone)
+    normalized = Column(String(50), nullable=True, index=True)
     organization_id = Column(
         Integer,
         ForeignKey("organizations.id", ondelete="CASCADE"),
-        nullable=False
+        nullable=False,
+        index=True
     )
 
     organization = relationship("Organization", back_populates="phones")
@@ -53,13 +100,31 @@ class Building(Base):
     latitude = Column(Float, nullable=False)
     longitude = Column(Float, nullable=False)
     description = Column(Text, nullable=True)
+    # Префикс geohash координат (building_region); при изменении координат пересчитывается в crud
+    geo_region = Column(String(12), nullable=False, default=_default_building_region, index=True)
+    created_at = Column(Integer, default=lambda: int(time.time()))
+    updated_at = Column(Integer, default=lambda: int(time.time()), onupdate=lambda: int(time.time()), index=True)
+    # Мягкое удаление: строка скрыта из выдачи и физически удаляется пакетной очисткой
+    deleted_at = Column(Integer, nullable=True, index=True)
 
     __table_args__ = (
         CheckConstraint('latitude >= -90 AND latitude <= 90', name='check_latitude'),
         CheckConstraint('longitude >= -180 AND longitude <= 180', name='check_longitude'),
+        # GiST-индекс по точке для KNN-сортировки оператором <-> (только Postgres)
+        Index(
+            'ix_buildings_location_gist',
+            func.point(longitude, latitude),
+            postgresql_using='gist'
+        ).ddl_if(dialect='postgresql'),
     )
 
-    organizations = relationship("Organization", back_populates="building", cascade="all, delete-orphan")
+    # При удалении здания БД сама обнуляет building_id у организаций (ON DELETE SET NULL)
+    organizations = relationship(
+        "Organization",
+        primaryjoin=lambda: _building_join(),
+        back_populates="building",
+        passive_deletes=True
+    )
 
 
 class Activity(Base):
@@ -70,15 +135,113 @@ class Activity(Base):
     description = Column(Text, nullable=True)
     parent_id = Column(Integer, ForeignKey("activities.id", ondelete="CASCADE"), nullable=True)
     level = Column(Integer, default=0, nullable=False)
+    created_at = Column(Integer, default=lambda: int(time.time()))
+    updated_at = Column(Integer, default=lambda: int(time.time()), onupdate=lambda: int(time.time()), index=True)
+    deleted_at = Column(Integer, nullable=True, index=True)
 
     __table_args__ = (
         CheckConstraint('level >= 0 AND level < 4', name='check_activity_level'),
+        Index(
+            'ix_activities_name_trgm',
+            'name',
+            postgresql_using='gin',
+            postgresql_ops={'name': 'gin_trgm_ops'}
+        ).ddl_if(dialect='postgresql'),
     )
 
     parent = relationship("Activity", remote_side=[id], back_populates="children")
-    children = relationship("Activity", back_populates="parent", cascade="all, delete-orphan")
+    # Поддерево и связи с организациями удаляет БД (ON DELETE CASCADE)
+    children = relationship(
+        "Activity",
+        primaryjoin=lambda: and_(
+            foreign(remote(Activity.parent_id)) == Activity.id,
+            remote(Activity.deleted_at).is_(None)
+        ),
+        back_populates="parent",
+        cascade="all, delete-orphan",
+        passive_deletes=True
+    )
     organizations = relationship(
         "Organization",
         secondary=organization_activity,
-        back_populates="activities"
+        primaryjoin=lambda: _activity_join(),
+        back_populates="activities",
+        passive_deletes=True
+    )
+
+
+def _building_join():
+    return and_(
+        foreign(Organization.building_id) == Building.id,
+        foreign(Organization.geo_region) == Building.geo_region,
+        Building.deleted_at.is_(None)
+    )
+
+
+def _activity_join():
+    return and_(organization_activity.c.activity_id == Activity.id, Activity.deleted_at.is_(None))
+
+
+class Change(Base):
+    """
+    Журнал изменений справочника (outbox), пишется в той же транзакции, что и сами изменения
+    """
+    __tablename__ = "changes"
+
+    seq = Column(BigInteger().with_variant(Integer, "sqlite"), primary_key=True, autoincrement=True)
+    entity_type = Column(String(50), nullable=False)
+    entity_id = Column(Integer, nullable=False)
+    operation = Column(String(10), nullable=False)
+    created_at = Column(Integer, default=lambda: int(time.time()), nullable=False)
+
+    __table_args__ = (
+        Index("ix_changes_entity", "entity_type", "entity_id", "seq"),
+        Index("ix_changes_type_seq", "entity_type", "seq"),
+        Index("ix_changes_operation_created", "entity_type", "operation", "created_at"),
     )
+
+
+class Job(Base):
+    """
+    Очередь фоновых задач (app.jobs): ставится API, выполняется воркером
+    """
+    __tablename__ = "jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    kind = Column(String(100), nullable=False)
+    payload = Column(JSON, nullable=True)
+    status = Column(String(20), nullable=False, default="queued")
+    attempts = Column(Integer, nullable=False, default=0)
+    max_attempts = Column(Integer, nullable=False, default=3)
+    # Не раньше какого времени брать задачу (отложенный повтор)
+    run_at = Column(Integer, nullable=False, default=lambda: int(time.time()))
+    locked_by = Column(String(255), nullable=True)
+    locked_at = Column(Integer, nullable=True)
+    last_error = Column(Text, nullable=True)
+    result = Column(JSON, nullable=True)
+    created_at = Column(Integer, default=lambda: int(time.time()), nullable=False)
+    updated_at = Column(Integer, default=lambda: int(time.time()), onupdate=lambda: int(time.time()), nullable=False)
+    finished_at = Column(Integer, nullable=True)
+    # Для enqueue(unique=True): в очереди не больше одной ожидающей задачи с этим ключом
+    unique_key = Column(String(100), nullable=True)
+
+    __table_args__ = (
+        Index("ix_jobs_status_run_at", "status", "run_at"),
+        Index(
+            "ux_jobs_unique_key_queued", "unique_key",
+            unique=True,
+            postgresql_where=text("status = 'queued'"),
+            sqlite_where=text("status = 'queued'")
+        ),
+    )
+
+
+class IdempotencyKey(Base):
+    """
+    Результаты выполненных импортов по ключу идемпотентности: повтор с тем же ключом не создает дубликатов
+    """
+    __tablename__ = "idempotency_keys"
+
+    key = Column(String(255), primary_key=True)
+    result = Column(JSON, nullable=False)
+    created_at = Column(Integer, default=lambda: int(time.time()), nullable=False)
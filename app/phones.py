@@ -0,0 +1,28 @@
+import re
+
+from app.config import settings
+
+
+def normalize_phone(number: str, country_code: str = None) -> str:
+    """
+    Приводит номер к каноническому виду, близкому к E.164: +<код страны><номер>.
+    Короткие местные номера без кода города остаются просто цифрами
+    """
+    if country_code is None:
+        country_code = settings.PHONE_DEFAULT_COUNTRY_CODE
+
+    digits = re.sub(r"\D", "", number)
+    if not digits:
+        return ""
+
+    if number.strip().startswith("+"):
+        return "+" + digits
+
+    # 8-XXX-XXX-XX-XX - внутрироссийский формат записи +7
+    if country_code == "7" and len(digits) == 11 and digits.startswith("8"):
+        return "+7" + digits[1:]
+    if len(digits) == 11 and digits.startswith(country_code):
+        return "+" + digits
+    if len(digits) == 10:
+        return "+" + country_code + digits
+    return digits
@@ -0,0 +1,171 @@
+"""
+Сэмплирующий профайлер для живого воркера.
+
+Отдельный поток раз в interval секунд снимает стеки потоков (sys._current_frames) и считает
+одинаковые стеки. Результат - collapsed stacks ("кадр;кадр;кадр число" построчно), формат
+flamegraph.pl, speedscope и inferno. Код приложения не инструментируется, поэтому накладные
+расходы определяются только частотой сэмплирования.
+"""
+import functools
+import inspect
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from typing import Callable, Dict, Iterable, Optional
+
+from fastapi.routing import APIRoute
+
+from app.config import settings
+
+# Модули, в которых простаивают потоки пула, event loop и фоновые потоки
+_IDLE_MODULES = ("threading.py", "queue.py", "selectors.py")
+
+
+@functools.lru_cache(maxsize=4096)
+def _short_path(filename: str) -> str:
+    # Путь относительно sys.path: app/crud.py, sqlalchemy/orm/query.py
+    for prefix in sorted(sys.path, key=len, reverse=True):
+        if prefix and filename.startswith(prefix + os.sep):
+            return filename[len(prefix) + 1:]
+    return filename
+
+
+def collapse(frame) -> str:
+    """
+    Стек кадра в виде "корень;...;лист"
+    """
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({_short_path(code.co_filename)})")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+def _is_idle(frame) -> bool:
+    return frame.f_code.co_filename.endswith(_IDLE_MODULES)
+
+
+def format_collapsed(stacks: Counter, prefix: Optional[str] = None) -> str:
+    lines = []
+    for stack, count in stacks.most_common():
+        lines.append(f"{prefix};{stack} {count}" if prefix else f"{stack} {count}")
+    return "\n".join(lines)
+
+
+def profile(seconds: float, interval: float, include_idle: bool = False) -> Counter:
+    """
+    Сэмплирует все потоки процесса seconds секунд, кроме вызывающего
+    """
+    own_thread = threading.get_ident()
+    stacks = Counter()
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_thread or (not include_idle and _is_idle(frame)):
+                continue
+            stacks[collapse(frame)] += 1
+        time.sleep(interval)
+    return stacks
+
+
+class RouteProfiler:
+    """
+    Профилирование случайной доли запросов по маршрутам.
+    Поток запроса регистрируется на время выполнения обработчика,
+    сэмплер снимает стеки только зарегистрированных потоков и копит их по маршрутам.
+    Поток сэмплера запускается первым профилируемым запросом и ждет на _active, пока зарегистрированных нет
+    """
+
+    def __init__(self, rate: float, interval: float):
+        self.rate = rate
+        self.interval = interval
+        self.stacks: Dict[str, Counter] = defaultdict(Counter)
+        self.requests: Counter = Counter()
+        self._threads: Dict[int, str] = {}
+        self._lock = threading.Lock()
+        self._sampler: Optional[threading.Thread] = None
+        # Установлено, пока есть зарегистрированные потоки; меняется под _lock вместе с _threads
+        self._active = threading.Event()
+
+    def should_sample(self) -> bool:
+        return self.rate > 0 and random.random() < self.rate
+
+    def _ensure_sampler(self):
+        if self._sampler is not None:
+            return
+        with self._lock:
+            if self._sampler is None:
+                self._sampler = threading.Thread(target=self._run, name="route-profiler", daemon=True)
+                self._sampler.start()
+
+    def _run(self):
+        while True:
+            self._active.wait()
+            frames = sys._current_frames()
+            with self._lock:
+                for thread_id, route in self._threads.items():
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        self.stacks[route][collapse(frame)] += 1
+            time.sleep(self.interval)
+
+    def begin(self, route: str):
+        self._ensure_sampler()
+        with self._lock:
+            self.requests[route] += 1
+            self._threads[threading.get_ident()] = route
+            self._active.set()
+
+    def end(self):
+        with self._lock:
+            self._threads.pop(threading.get_ident(), None)
+            if not self._threads:
+                self._active.clear()
+
+    def snapshot(self) -> Dict[str, Counter]:
+        with self._lock:
+            return {route: Counter(stacks) for route, stacks in self.stacks.items()}
+
+    def reset(self):
+        with self._lock:
+            self.stacks.clear()
+            self.requests.clear()
+
+
+route_profiler = RouteProfiler(settings.PROFILE_ROUTE_SAMPLE_RATE, settings.PROFILE_SAMPLE_INTERVAL)
+
+
+def _profiled(endpoint: Callable, route: str) -> Callable:
+    endpoint = getattr(endpoint, "__wrapped__", endpoint) if getattr(endpoint, "__profiled__", False) else endpoint
+
+    @functools.wraps(endpoint)
+    def wrapper(*args, **kwargs):
+        if not route_profiler.should_sample():
+            return endpoint(*args, **kwargs)
+
+        route_profiler.begin(route)
+        try:
+            return endpoint(*args, **kwargs)
+        finally:
+            route_profiler.end()
+
+    wrapper.__profiled__ = True
+    return wrapper
+
+
+class ProfiledRoute(APIRoute):
+    """
+    Маршрут, доля запросов которого (PROFILE_ROUTE_SAMPLE_RATE) профилируется.
+    Оборачиваются только синхронные обработчики: они выполняются в своем потоке пула,
+    и стек этого потока целиком относится к запросу (crud, загрузка ORM, проекции)
+    """
+
+    def __init__(self, path: str, endpoint: Callable, **kwargs):
+        if not inspect.iscoroutinefunction(inspect.unwrap(endpoint)):
+            methods: Iterable[str] = kwargs.get("methods") or ["GET"]
+            endpoint = _profiled(endpoint, f"{','.join(sorted(methods))} {path}")
+        super().__init__(path, endpoint, **kwargs)
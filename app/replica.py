@@ -0,0 +1,390 @@
+"""
+Реплика справочника для чтения без Postgres.
+
+Основной экземпляр строит файл SQLite со схемой моделей (app.models) и данными справочника:
+здания, организации, телефоны, виды деятельности и их связи, а также журнал изменений,
+сжатый до последней записи по каждой сущности (этого достаточно для ETag, /changes?since
+и списков удаленных). Версия реплики - последний seq журнала, прочитанный в той же транзакции.
+
+В режиме READ_SNAPSHOT_MODE воркер не подключается к Postgres: он копирует последнюю реплику
+в локальный каталог, сверяет sha256 и переключает сессии на engine только для чтения поверх
+этого файла, поэтому GET-маршруты работают через тот же crud. Поток ReplicaRefresher
+периодически подхватывает новые версии, записи отклоняет ReadSnapshotMiddleware.
+
+    python -m app.replica
+"""
+import argparse
+import json
+import logging
+import os
+import re
+import shutil
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from typing import List, Optional, Tuple
+
+from sqlalchemy import Column, MetaData, String, Table, create_engine, func, select
+from sqlalchemy.orm import Session
+from starlette.datastructures import MutableHeaders
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from app import cache, database, models, snapshots
+from app.config import Settings, settings
+
+logger = logging.getLogger(__name__)
+
+SCHEMA_VERSION = 1
+SAFE_METHODS = {"GET", "HEAD", "OPTIONS"}
+# Доступен и до загрузки реплики, чтобы было видно, почему воркер не отвечает
+STATUS_PATH = "/api/v1/snapshots/replica/status"
+
+_REPLICA_FILE = re.compile(r"^replica-(\d+)\.sqlite$")
+
+# Очередь задач и ключи импорта к справочнику не относятся: в реплике эти таблицы пустые
+_SKIPPED_TABLES = {models.Job.__tablename__, models.IdempotencyKey.__tablename__}
+
+replica_meta = Table(
+    "replica_meta",
+    MetaData(),
+    Column("key", String, primary_key=True),
+    Column("value", String, nullable=False),
+)
+
+
+def replica_path(version: int, directory: Optional[str] = None) -> str:
+    return os.path.join(directory or settings.SNAPSHOT_DIR, f"replica-{version}.sqlite")
+
+
+def list_replicas(directory: Optional[str] = None) -> List[int]:
+    """
+    Версии реплик в каталоге по возрастанию
+    """
+    directory = directory or settings.SNAPSHOT_DIR
+    if not os.path.isdir(directory):
+        return []
+    return sorted(int(match.group(1)) for match in map(_REPLICA_FILE.match, os.listdir(directory)) if match)
+
+
+def _table_query(table: Table, version: int):
+    if table.name == models.Change.__tablename__:
+        # Для каждой сущности нужна только последняя запись журнала до версии реплики: записи
+        # за границей видимости попадут в следующую версию вместе с пропущенными перед ними
+        latest = select(func.max(models.Change.seq)).where(models.Change.seq <= version).group_by(
+            models.Change.entity_type, models.Change.entity_id
+        )
+        return select(table).where(table.c.seq.in_(latest)).order_by(table.c.seq)
+    return select(table)
+
+
+def _write_replica(db: Session, version: int, path: str):
+    temporary = path + ".tmp"
+    if os.path.exists(temporary):
+        os.remove(temporary)
+
+    target = create_engine(f"sqlite:///{temporary}")
+    try:
+        database.Base.metadata.create_all(target)
+        replica_meta.create(target)
+        with target.begin() as connection:
+            connection.execute(replica_meta.insert(), [
+                {"key": "version", "value": str(version)},
+                {"key": "built_at", "value": str(int(time.time()))},
+                {"key": "schema_version", "value": str(SCHEMA_VERSION)},
+            ])
+            for table in database.Base.metadata.sorted_tables:
+                if table.name in _SKIPPED_TABLES:
+                    continue
+                result = db.execute(_table_query(table, version), execution_options={"yield_per": snapshots.BATCH_SIZE})
+                for rows in result.partitions():
+                    connection.execute(table.insert(), [row._asdict() for row in rows])
+        with target.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+            connection.exec_driver_sql("VACUUM")
+    except BaseException:
+        target.dispose()
+        os.remove(temporary)
+        raise
+    target.dispose()
+
+    snapshots.write_digest(temporary)
+    os.replace(temporary + ".sha256", path + ".sha256")
+    os.replace(temporary, path)
+
+
+def _prune():
+    for version in list_replicas()[:-settings.SNAPSHOT_KEEP]:
+        for path in (replica_path(version), replica_path(version) + ".sha256"):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def build_replica(db: Session) -> dict:
+    """
+    Строит реплику текущей версии в SNAPSHOT_DIR; если она уже есть, ничего не делает
+    """
+    if db.get_bind().dialect.name == "postgresql":
+        # Все таблицы и версия читаются из одного снимка данных БД
+        db.connection(execution_options={"isolation_level": "REPEATABLE READ"})
+
+    version = snapshots.current_version(db)
+    path = replica_path(version)
+    if os.path.exists(path):
+        db.rollback()
+        return {"version": version, "built": False}
+
+    os.makedirs(settings.SNAPSHOT_DIR, exist_ok=True)
+    started = time.monotonic()
+    try:
+        _write_replica(db, version, path)
+    finally:
+        db.rollback()
+    _prune()
+
+    result = {"version": version, "built": True, "size": os.path.getsize(path)}
+    logger.info("Replica %s built in %.1fs: %s", version, time.monotonic() - started, result)
+    return result
+
+
+class Replica:
+    """
+    Реплика, из которой отвечает воркер в режиме READ_SNAPSHOT_MODE.
+    Источник - каталог с репликами (общий том) или URL API основного экземпляра
+    """
+
+    def __init__(self, app_settings: Settings):
+        self.settings = app_settings
+        self.source = app_settings.READ_SNAPSHOT_SOURCE or app_settings.SNAPSHOT_DIR
+        self.version: Optional[int] = None
+        self.built_at: Optional[int] = None
+        self.loaded_at: Optional[float] = None
+        self.checked_at: Optional[float] = None
+        self.error: Optional[str] = None
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self) -> bool:
+        return self.version is not None
+
+    def age(self) -> Optional[float]:
+        """
+        Секунды с построения загруженной реплики
+        """
+        return None if self.built_at is None else max(0.0, time.time() - self.built_at)
+
+    def stale(self) -> bool:
+        max_age = self.settings.READ_SNAPSHOT_MAX_AGE
+        return max_age > 0 and self.loaded and self.age() > max_age
+
+    def _remote(self) -> bool:
+        return self.source.startswith(("http://", "https://"))
+
+    def _open_url(self, url: str):
+        request = urllib.request.Request(url, headers={
+            "X-API-Key": self.settings.READ_SNAPSHOT_SOURCE_API_KEY or self.settings.API_KEY
+        })
+        return urllib.request.urlopen(request, timeout=self.settings.READ_SNAPSHOT_FETCH_TIMEOUT)
+
+    def _latest(self) -> Optional[Tuple[int, str, str]]:
+        """
+        Последняя реплика источника: версия, sha256 и откуда ее копировать
+        """
+        if not self._remote():
+            versions = list_replicas(self.source)
+            if not versions:
+                return None
+            path = replica_path(versions[-1], self.source)
+            return versions[-1], snapshots.file_digest(path), path
+
+        try:
+            with self._open_url(self.source.rstrip("/") + "/snapshots/replica/latest") as response:
+                manifest = json.load(response)
+        except urllib.error.HTTPError as error:
+            if error.code == 404:
+                return None
+            raise
+        file = manifest["snapshot"]
+        return manifest["version"], file["sha256"], urllib.parse.urljoin(self.source, file["url"])
+
+    def _copy(self, location: str, destination: str):
+        if not self._remote():
+            shutil.copyfile(location, destination)
+            return
+        with self._open_url(location) as response, open(destination, "wb") as target:
+            shutil.copyfileobj(response, target, 1 << 20)
+
+    def _activate(self, path: str) -> int:
+        """
+        Переключает сессии на файл реплики; возвращает время ее построения
+        """
+        # Файл реплики не меняется: immutable отключает блокировки и проверки изменений SQLite
+        engine = create_engine(
+            f"sqlite:///file:{os.path.abspath(path)}?mode=ro&immutable=1&uri=true",
+            pool_size=self.settings.READ_SNAPSHOT_POOL_SIZE,
+            max_overflow=0
+        )
+        try:
+            with engine.connect() as connection:
+                meta = dict(connection.execute(select(replica_meta.c.key, replica_meta.c.value)).all())
+        except Exception:
+            engine.dispose()
+            raise
+
+        database.replace_engine(engine).dispose()
+        cache.invalidate_all()
+        return int(meta["built_at"])
+
+    def _prune_local(self):
+        """
+        Каталог общий для воркеров одного хоста, и воркер, еще не перешедший на новую версию,
+        открывает новые соединения к своему файлу. Поэтому файл удаляется, только когда следующая
+        версия появилась больше двух интервалов обновления назад и все воркеры успели на нее перейти
+        """
+        directory = self.settings.READ_SNAPSHOT_LOCAL_DIR
+        grace = 2 * self.settings.READ_SNAPSHOT_REFRESH_INTERVAL
+        versions = list_replicas(directory)
+        for version, following in zip(versions, versions[1:]):
+            if version != self.version and time.time() - os.path.getmtime(replica_path(following, directory)) > grace:
+                os.remove(replica_path(version, directory))
+
+    def refresh(self) -> bool:
+        """
+        Загружает более новую реплику источника, если она есть. Ошибка сохраняется в error,
+        а воркер продолжает отвечать из уже загруженной реплики
+        """
+        with self._lock:
+            self.checked_at = time.time()
+            try:
+                latest = self._latest()
+                if latest is None:
+                    self.error = None if self.loaded else "No replica available"
+                    return False
+                if self.loaded and latest[0] <= self.version:
+                    self.error = None
+                    return False
+
+                version, digest, location = latest
+                directory = self.settings.READ_SNAPSHOT_LOCAL_DIR
+                os.makedirs(directory, exist_ok=True)
+                path = replica_path(version, directory)
+                # Под этим именем лежат только проверенные файлы: возможно, его уже скачал другой воркер
+                if not os.path.exists(path):
+                    temporary = f"{path}.{os.getpid()}.tmp"
+                    self._copy(location, temporary)
+                    if snapshots.sha256_file(temporary) != digest:
+                        os.remove(temporary)
+                        raise ValueError(f"Replica {version} checksum mismatch")
+                    os.replace(temporary, path)
+
+                self.built_at = self._activate(path)
+                self.version = version
+                self.loaded_at = time.time()
+                self.error = None
+                self._prune_local()
+            except Exception as error:
+                logger.exception("Replica refresh from %s failed", self.source)
+                self.error = f"{type(error).__name__}: {error}"
+                return False
+
+        logger.info("Replica %s loaded from %s", version, self.source)
+        if self.settings.WARMUP_CACHES:
+            db = database.SessionLocal()
+            try:
+                cache.prime(db)
+            finally:
+                db.close()
+        return True
+
+    def status(self) -> dict:
+        return {
+            "mode": True,
+            "source": self.source,
+            "version": self.version,
+            "built_at": self.built_at,
+            "loaded_at": self.loaded_at,
+            "checked_at": self.checked_at,
+            "age": self.age(),
+            "stale": self.stale(),
+            "error": self.error,
+        }
+
+
+class ReplicaRefresher(threading.Thread):
+    """
+    Поток воркера, который раз в READ_SNAPSHOT_REFRESH_INTERVAL проверяет новую реплику
+    """
+
+    def __init__(self, replica: Replica):
+        super().__init__(name="replica-refresher", daemon=True)
+        self.replica = replica
+        self._stopped = threading.Event()
+
+    def stop(self):
+        self._stopped.set()
+
+    def run(self):
+        while not self._stopped.wait(self.replica.settings.READ_SNAPSHOT_REFRESH_INTERVAL):
+            self.replica.refresh()
+
+
+def _error(status_code: int, detail: str, headers: dict) -> JSONResponse:
+    return JSONResponse(status_code=status_code, content={"detail": detail}, headers=headers)
+
+
+class ReadSnapshotMiddleware:
+    """
+    ASGI middleware режима READ_SNAPSHOT_MODE: только чтение, ответы с версией и возрастом реплики
+    """
+
+    def __init__(self, app: ASGIApp, replica: Replica):
+        self.app = app
+        self.replica = replica
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        if scope["method"] not in SAFE_METHODS:
+            response = _error(405, "Read-only snapshot replica", {"Allow": ", ".join(sorted(SAFE_METHODS))})
+            await response(scope, receive, send)
+            return
+
+        replica = self.replica
+        if scope["path"].startswith("/api/") and scope["path"] != STATUS_PATH:
+            retry_after = {"Retry-After": str(int(replica.settings.READ_SNAPSHOT_REFRESH_INTERVAL))}
+            if not replica.loaded:
+                await _error(503, "Snapshot is not loaded yet", retry_after)(scope, receive, send)
+                return
+            if replica.stale():
+                await _error(503, "Snapshot is stale", retry_after)(scope, receive, send)
+                return
+
+        version, age = replica.version, replica.age()
+
+        async def send_with_version(message):
+            if message["type"] == "http.response.start" and version is not None:
+                headers = MutableHeaders(scope=message)
+                headers["X-Snapshot-Version"] = str(version)
+                headers["X-Snapshot-Age"] = str(int(age))
+            await send(message)
+
+        await self.app(scope, receive, send_with_version)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Построение реплики справочника для чтения")
+    parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    db = database.SessionLocal()
+    try:
+        print(build_replica(db))
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,36 +1,53 @@
-from fastapi import APIRouter, Depends, HTTPException, Query, status
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, status
 from typing import List, Optional
 from sqlalchemy.orm import Session
-from app import crud, schemas, dependencies
+from app import crud, jobs, schemas, dependencies
+from app.config import settings
+from app.http_cache import conditional_response, make_etag
 from app.database import get_db
+from app.profiler import ProfiledRoute
+from app.singleflight import single_flight
 
-router = APIRouter()
+router = APIRouter(route_class=ProfiledRoute)
 
 
 @router.get("/activities", response_model=List[schemas.Activity])
 def read_activities(
     skip: int = Query(0, ge=0),
     limit: int = Query(100, ge=1, le=1000),
+    updated_since: Optional[int] = Query(None, description="Только измененные начиная с Unix-времени (все уровни)"),
     db: Session = Depends(get_db),
     api_key: str = Depends(dependencies.get_api_key)
 ):
     """
-    Получить список всех видов деятельности (только корневые) с пагинацией
+    Получить список всех видов деятельности (только корневые) с пагинацией.
+    С updated_since возвращаются измененные виды деятельности всех уровней
     """
-    activities = crud.get_activities(db, skip=skip, limit=limit)
+    activities = crud.get_activities(db, skip=skip, limit=limit, updated_since=updated_since)
     return activities
 
 
 @router.get("/activities/tree", response_model=List[schemas.Activity])
 def read_activity_tree(
+    request: Request,
+    response: Response,
     db: Session = Depends(get_db),
     api_key: str = Depends(dependencies.get_api_key)
 ):
     """
     Получить полное дерево видов деятельности
     """
-    activities = crud.get_activity_tree(db)
-    return activities
+    seq, changed_at = crud.get_change_version(db, ["activity"])
+    not_modified = conditional_response(request, response, make_etag("activity-tree", seq), changed_at)
+    if not_modified is not None:
+        return not_modified
+
+    # Общий результат - pydantic-модели: ORM-объекты привязаны к сессии выполнившего запроса
+    return single_flight.do(
+        "activity_tree",
+        seq,
+        lambda: [schemas.Activity.model_validate(activity) for activity in crud.get_activity_tree(db)]
+    )
 
 
 @router.get("/activities/{activity_id}", response_model=schemas.Activity)
@@ -108,4 +125,6 @@ def delete_activity(
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Activity not found"
-        )
\ No newline at end of file
+        )
+    if settings.SOFT_DELETE_ENABLED:
+        jobs.enqueue(db, jobs.PURGE_DELETED, unique=True)
\ No newline at end of file
@@ -0,0 +1,105 @@
+from fastapi import APIRouter, Depends, Query, Request, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import PlainTextResponse
+
+from app import schemas, dependencies
+from app.config import settings
+from app.profiler import format_collapsed, profile, route_profiler
+from app.singleflight import single_flight
+
+router = APIRouter(dependencies=[Depends(dependencies.get_admin_api_key)])
+
+
+@router.get("/admin/profile", response_class=PlainTextResponse)
+async def profile_worker(
+        seconds: float = Query(5, gt=0, le=settings.PROFILE_MAX_SECONDS),
+        interval: float = Query(settings.PROFILE_SAMPLE_INTERVAL, ge=0.001, le=1),
+        idle: bool = Query(False, description="Учитывать простаивающие потоки"),
+):
+    """
+    Профиль текущего воркера за seconds секунд в формате collapsed stacks
+    (flamegraph.pl, speedscope). Профилируется только воркер, принявший запрос
+    """
+    stacks = await run_in_threadpool(profile, seconds, interval, idle)
+    return PlainTextResponse(
+        format_collapsed(stacks),
+        headers={"X-Profile-Samples": str(sum(stacks.values()))}
+    )
+
+
+@router.get("/admin/profile/routes", response_class=PlainTextResponse)
+def profile_routes():
+    """
+    Накопленный профиль сэмплированных запросов; корневой кадр каждого стека - маршрут
+    """
+    return "\n".join(
+        format_collapsed(stacks, prefix=route)
+        for route, stacks in sorted(route_profiler.snapshot().items())
+    )
+
+
+@router.get("/admin/profile/routes/stats", response_model=schemas.RouteProfileStats)
+def profile_routes_stats():
+    """
+    Сколько запросов каждого маршрута профилировано и сколько снято сэмплов
+    """
+    snapshot = route_profiler.snapshot()
+    return schemas.RouteProfileStats(
+        rate=route_profiler.rate,
+        requests=dict(route_profiler.requests),
+        samples={route: sum(stacks.values()) for route, stacks in snapshot.items()}
+    )
+
+
+@router.put("/admin/profile/routes", response_model=schemas.RouteProfileStats)
+def configure_profile_routes(profile_settings: schemas.RouteProfileSettings):
+    """
+    Включить (rate > 0) или выключить профилирование доли запросов на этом воркере
+    """
+    route_profiler.rate = profile_settings.rate
+    return profile_routes_stats()
+
+
+@router.delete("/admin/profile/routes", status_code=status.HTTP_204_NO_CONTENT)
+def reset_profile_routes():
+    """
+    Сбросить накопленный профиль маршрутов
+    """
+    route_profiler.reset()
+
+
+@router.get("/admin/metrics/single-flight", response_model=schemas.SingleFlightMetrics)
+def single_flight_metrics():
+    """
+    Выполненные и объединенные запросы чтения на этом воркере
+    """
+    return schemas.SingleFlightMetrics(
+        enabled=single_flight.enabled,
+        window=single_flight.window,
+        queries=single_flight.stats()
+    )
+
+
+@router.delete("/admin/metrics/single-flight", status_code=status.HTTP_204_NO_CONTENT)
+def reset_single_flight_metrics():
+    """
+    Обнулить счетчики объединения запросов
+    """
+    single_flight.reset()
+
+
+@router.get("/admin/metrics/admission", response_model=schemas.AdmissionMetrics)
+def admission_metrics(request: Request):
+    """
+    Очереди и отклоненные запросы по маршрутам на этом воркере
+    """
+    control = request.app.state.admission
+    return schemas.AdmissionMetrics(enabled=control.enabled, routes=control.stats())
+
+
+@router.delete("/admin/metrics/admission", status_code=status.HTTP_204_NO_CONTENT)
+def reset_admission_metrics(request: Request):
+    """
+    Обнулить счетчики принятых и отклоненных запросов
+    """
+    request.app.state.admission.reset()
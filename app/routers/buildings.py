@@ -1,41 +1,106 @@
-from fastapi import APIRouter, Depends, HTTPException, Query, status
-from typing import List, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, status
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from typing import List, Optional, Tuple
 from sqlalchemy.orm import Session
-from app import crud, schemas, dependencies
+from app import cache, crud, jobs, schemas, dependencies
+from app.config import settings
+from app.http_cache import conditional_response, make_etag
 from app.database import get_db
+from app.profiler import ProfiledRoute
+from app.singleflight import single_flight
 
-router = APIRouter()
+router = APIRouter(route_class=ProfiledRoute)
 
 
-@router.get("/buildings", response_model=List[schemas.Building])
+@router.get("/buildings", response_model=List[Optional[schemas.Building]])
 def read_buildings(
         skip: int = Query(0, ge=0),
         limit: int = Query(100, ge=1, le=1000),
+        updated_since: Optional[int] = Query(None, description="Только измененные начиная с Unix-времени"),
+        ids: Optional[List[int]] = Depends(dependencies.get_ids),
         db: Session = Depends(get_db),
         api_key: str = Depends(dependencies.get_api_key)
 ):
     """
-    Получить список всех зданий с пагинацией
+    Получить список всех зданий с пагинацией.
+    С ids - здания в порядке запроса, null для несуществующих
     """
-    buildings = crud.get_buildings(db, skip=skip, limit=limit)
+    if ids is not None:
+        return crud.get_buildings_by_ids(db, building_ids=ids)
+
+    buildings = crud.get_buildings(db, skip=skip, limit=limit, updated_since=updated_since)
     return buildings
 
 
+@router.get("/buildings/clusters", response_model=schemas.BuildingClusters, response_model_exclude_unset=True)
+def read_building_clusters(
+        request: Request,
+        response: Response,
+        zoom: int = Query(..., ge=0, le=settings.CLUSTER_MAX_ZOOM, description="Уровень масштаба карты"),
+        bbox: Tuple[float, float, float, float] = Depends(dependencies.get_bbox),
+        activities: bool = Query(False, description="Добавить число организаций по видам деятельности верхнего уровня"),
+        db: Session = Depends(get_db),
+        api_key: str = Depends(dependencies.get_api_key)
+):
+    """
+    Кластеры зданий в видимой области карты: число зданий и организаций, центр масс.
+    Кластер из одного здания содержит его building_id
+    """
+    entity_types = ["building", "organization", "activity"]
+    seq, changed_at = crud.get_change_version(db, entity_types)
+    # Пока агрегаты пересчитываются в фоне, ответ строится из прежних и не должен получить ETag новой версии
+    if cache.building_clusters.stale:
+        response.headers["Cache-Control"] = "no-store"
+    else:
+        not_modified = conditional_response(request, response, make_etag("clusters", seq), changed_at)
+        if not_modified is not None:
+            return not_modified
+
+    def load():
+        clusters = []
+        for cluster in crud.get_building_clusters(db, zoom, *bbox):
+            item = schemas.BuildingCluster(
+                latitude=cluster.latitude,
+                longitude=cluster.longitude,
+                count=cluster.count,
+                organizations_count=cluster.organizations_count
+            )
+            if cluster.building_id is not None:
+                item.building_id = cluster.building_id
+            if activities:
+                item.activities = dict(cluster.activities)
+            clusters.append(item)
+        return schemas.BuildingClusters(zoom=zoom, clusters=clusters)
+
+    return single_flight.do("building_clusters", (zoom, bbox, activities, seq), load)
+
+
 @router.get("/buildings/{building_id}", response_model=schemas.Building)
 def read_building(
         building_id: int,
+        request: Request,
+        response: Response,
         db: Session = Depends(get_db),
         api_key: str = Depends(dependencies.get_api_key)
 ):
     """
     Получить информацию о здании по его ID
     """
+    # Сначала здание: для несуществующего или удаленного id - 404, а не 304 по нулевой версии
     building = crud.get_building(db, building_id=building_id)
     if building is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Building not found"
         )
+
+    # updated_at в ETag: у зданий без записей в журнале (начальные данные) версия тоже меняется
+    seq, changed_at = crud.get_change_version(db, ["building"], entity_id=building_id)
+    etag = make_etag("building", building_id, seq, building.updated_at)
+    not_modified = conditional_response(request, response, etag, max(changed_at, building.updated_at or 0))
+    if not_modified is not None:
+        return not_modified
     return building
 
 
@@ -70,6 +135,41 @@ def update_building(
     return db_building
 
 
+@router.delete(
+    "/buildings",
+    response_model=schemas.BulkDeleteResult,
+    responses={status.HTTP_202_ACCEPTED: {"model": schemas.Job}}
+)
+def delete_buildings(
+        ids: Optional[List[int]] = Depends(dependencies.get_ids),
+        db: Session = Depends(get_db),
+        api_key: str = Depends(dependencies.get_api_key)
+):
+    """
+    Удалить несколько зданий (ids через запятую).
+    Организации зданий остаются, у них обнуляется building_id.
+    Больше JOB_INLINE_MAX_IDS зданий удаляются фоновой задачей: ответ 202 с задачей
+    """
+    if not ids:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Укажите ids"
+        )
+
+    if len(ids) > settings.JOB_INLINE_MAX_IDS:
+        job = jobs.enqueue(db, jobs.DELETE_BUILDINGS, {"ids": ids})
+        return JSONResponse(
+            status_code=status.HTTP_202_ACCEPTED,
+            content=jsonable_encoder(schemas.Job.model_validate(job)),
+            headers={"Location": f"/api/v1/jobs/{job.id}"}
+        )
+
+    deleted = crud.delete_buildings(db, building_ids=ids)
+    if settings.SOFT_DELETE_ENABLED and deleted:
+        jobs.enqueue(db, jobs.PURGE_DELETED, unique=True)
+    return schemas.BulkDeleteResult(deleted=deleted)
+
+
 @router.delete("/buildings/{building_id}", status_code=status.HTTP_204_NO_CONTENT)
 def delete_building(
         building_id: int,
@@ -77,7 +177,7 @@ def delete_building(
         api_key: str = Depends(dependencies.get_api_key)
 ):
     """
-    Удалить здание
+    Удалить здание. Организации здания остаются, у них обнуляется building_id
     """
     success = crud.delete_building(db, building_id=building_id)
     if not success:
@@ -85,3 +185,5 @@ def delete_building(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Building not found"
         )
+    if settings.SOFT_DELETE_ENABLED:
+        jobs.enqueue(db, jobs.PURGE_DELETED, unique=True)
@@ -0,0 +1,76 @@
+import asyncio
+import time
+from typing import List, Optional
+
+from fastapi import APIRouter, Depends, Header, Query
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+
+from app import crud, schemas, dependencies
+from app.config import settings
+from app.database import SessionLocal
+
+router = APIRouter()
+
+
+def fetch_changes(since: int, limit: int) -> List[schemas.Change]:
+    # Отдельная короткая сессия на каждую выборку: между опросами соединение возвращается в пул
+    db = SessionLocal()
+    try:
+        return [schemas.Change.model_validate(change) for change in crud.get_changes(db, since=since, limit=limit)]
+    finally:
+        db.close()
+
+
+@router.get("/changes", response_model=schemas.ChangeFeed)
+async def get_changes(
+        since: int = Query(0, ge=0, description="Последний полученный seq"),
+        limit: int = Query(100, ge=1, le=1000),
+        wait: float = Query(0, ge=0, description="Сколько секунд ждать новых изменений (long-polling)"),
+        api_key: str = Depends(dependencies.get_api_key)
+):
+    """Изменения справочника после указанного seq"""
+    deadline = time.monotonic() + min(wait, settings.CHANGES_MAX_WAIT)
+
+    changes = await run_in_threadpool(fetch_changes, since, limit)
+    while not changes and time.monotonic() < deadline:
+        await asyncio.sleep(settings.CHANGES_POLL_INTERVAL)
+        changes = await run_in_threadpool(fetch_changes, since, limit)
+
+    return schemas.ChangeFeed(
+        changes=changes,
+        last_seq=changes[-1].seq if changes else since
+    )
+
+
+@router.get("/changes/stream")
+async def stream_changes(
+        since: int = Query(0, ge=0, description="Последний полученный seq"),
+        last_event_id: Optional[int] = Header(None),
+        api_key: str = Depends(dependencies.get_api_key)
+):
+    """Поток изменений справочника (Server-Sent Events)"""
+    # При переподключении EventSource передает Last-Event-ID
+    cursor = last_event_id if last_event_id is not None else since
+
+    async def events():
+        nonlocal cursor
+        last_sent = time.monotonic()
+        while True:
+            changes = await run_in_threadpool(fetch_changes, cursor, 1000)
+            for change in changes:
+                yield f"id: {change.seq}\nevent: change\ndata: {change.model_dump_json()}\n\n"
+                cursor = change.seq
+                last_sent = time.monotonic()
+
+            if not changes:
+                if time.monotonic() - last_sent >= settings.CHANGES_HEARTBEAT_INTERVAL:
+                    yield ": heartbeat\n\n"
+                    last_sent = time.monotonic()
+                await asyncio.sleep(settings.CHANGES_POLL_INTERVAL)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
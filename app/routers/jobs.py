@@ -0,0 +1,61 @@
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, status
+from typing import List, Optional
+from sqlalchemy.orm import Session
+from app import jobs, schemas, dependencies
+from app.database import get_db
+
+router = APIRouter()
+
+
+@router.get("/jobs", response_model=List[schemas.Job])
+def read_jobs(
+        status_filter: Optional[str] = Query(None, alias="status", description="queued, running, succeeded, failed"),
+        kind: Optional[str] = Query(None),
+        skip: int = Query(0, ge=0),
+        limit: int = Query(100, ge=1, le=1000),
+        db: Session = Depends(get_db),
+        api_key: str = Depends(dependencies.get_api_key)
+):
+    """
+    Список фоновых задач, новые первыми
+    """
+    return jobs.get_jobs(db, status=status_filter, kind=kind, skip=skip, limit=limit)
+
+
+@router.get("/jobs/{job_id}", response_model=schemas.Job)
+def read_job(
+        job_id: int,
+        db: Session = Depends(get_db),
+        api_key: str = Depends(dependencies.get_api_key)
+):
+    """
+    Статус и результат фоновой задачи
+    """
+    job = jobs.get_job(db, job_id)
+    if job is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Job not found"
+        )
+    return job
+
+
+@router.post("/jobs", response_model=schemas.Job, status_code=status.HTTP_202_ACCEPTED)
+def create_job(
+        job: schemas.JobCreate,
+        response: Response,
+        db: Session = Depends(get_db),
+        api_key: str = Depends(dependencies.get_api_key)
+):
+    """
+    Поставить задачу обслуживания в очередь (например, purge_deleted или recompute_activity_levels)
+    """
+    if not jobs.is_registered(job.kind):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Unknown job kind: {job.kind}"
+        )
+
+    db_job = jobs.enqueue(db, job.kind, job.payload)
+    response.headers["Location"] = f"/api/v1/jobs/{db_job.id}"
+    return db_job
@@ -1,75 +1,217 @@
-from fastapi import APIRouter, Depends, HTTPException, Query, status
+import uuid
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request, Response, status
 from typing import List, Optional
 from sqlalchemy.orm import Session
 
-from app import crud, schemas, dependencies
+from app import crud, jobs, schemas, dependencies
+from app.config import settings
+from app.http_cache import conditional_response, make_etag
 from app.database import get_db
+from app.profiler import ProfiledRoute
+from app.singleflight import single_flight
 
-router = APIRouter()
+router = APIRouter(route_class=ProfiledRoute)
 
 
-@router.get("/organizations", response_model=List[schemas.Organization])
+@router.get(
+    "/organizations",
+    response_model=List[Optional[schemas.OrganizationPartial]],
+    response_model_exclude_unset=True
+)
 def get_organizations(
         skip: int = 0,
         limit: int = 100,
+        updated_since: Optional[int] = Query(None, description="Только измененные начиная с Unix-времени"),
+        ids: Optional[List[int]] = Depends(dependencies.get_ids),
+        projection: Optional[schemas.OrganizationProjection] = Depends(dependencies.get_organization_projection),
         db: Session = Depends(get_db),
         api_key: str = Depends(dependencies.get_api_key)
 ):
-    """Получить список организаций"""
-    organizations = crud.get_organizations(db, skip=skip, limit=limit)
-    return organizations
+    """
+    Получить список организаций.
+    С ids - организации в порядке запроса, null для несуществующих
+    """
+    if ids is not None:
+        organizations = crud.get_organizations_by_ids(db, organization_ids=ids, projection=projection)
+        return [
+            schemas.project_organization(organization, projection) if organization is not None else None
+            for organization in organizations
+        ]
+
+    organizations = crud.get_organizations(
+        db, skip=skip, limit=limit, updated_since=updated_since, projection=projection
+    )
+    return [schemas.project_organization(organization, projection) for organization in organizations]
+
+
+@router.get("/organizations/deleted", response_model=List[schemas.Tombstone])
+def get_deleted_organizations(
+        deleted_since: int = Query(..., description="Unix-время, начиная с которого нужны удаления"),
+        db: Session = Depends(get_db),
+        api_key: str = Depends(dependencies.get_api_key)
+):
+    """Удаленные организации (tombstones) для инкрементальной синхронизации"""
+    changes = crud.get_deleted_entities(db, entity_type="organization", deleted_since=deleted_since)
+    return [schemas.Tombstone(id=change.entity_id, deleted_at=change.created_at) for change in changes]
 
 
-@router.get("/organizations/by-building/{building_id}", response_model=List[schemas.Organization])
+@router.get(
+    "/organizations/by-building/{building_id}",
+    response_model=List[schemas.OrganizationPartial],
+    response_model_exclude_unset=True
+)
 def get_organizations_by_building(
         building_id: int,
+        request: Request,
+        response: Response,
+        projection: Optional[schemas.OrganizationProjection] = Depends(dependencies.get_organization_projection),
         db: Session = Depends(get_db),
         api_key: str = Depends(dependencies.get_api_key)
 ):
     """Список организаций в конкретном здании"""
-    organizations = crud.get_organizations_by_building(db, building_id=building_id)
-    return organizations
+    # В ответ встроены здание и виды деятельности, поэтому учитываются и их изменения
+    entity_types = ["organization", "activity", "building"]
+    seq, changed_at = crud.get_change_version(db, entity_types)
+    not_modified = conditional_response(request, response, make_etag("by-building", building_id, seq), changed_at)
+    if not_modified is not None:
+        return not_modified
+
+    def load():
+        organizations = crud.get_organizations_by_building(db, building_id=building_id, projection=projection)
+        return [schemas.project_organization(organization, projection) for organization in organizations]
+
+    # Версия в ключе: запрос, пришедший после записи, не получит результат, прочитанный до нее
+    key = (building_id, projection.key() if projection else None, seq)
+    return single_flight.do("organizations_by_building", key, load)
+
+
+@router.get(
+    "/organizations/by-phone/{number}",
+    response_model=List[schemas.OrganizationPartial],
+    response_model_exclude_unset=True
+)
+def get_organizations_by_phone(
+        number: str,
+        projection: Optional[schemas.OrganizationProjection] = Depends(dependencies.get_organization_projection),
+        db: Session = Depends(get_db),
+        api_key: str = Depends(dependencies.get_api_key)
+):
+    """Организации, которым принадлежит номер телефона (в любом формате записи)"""
+    organizations = crud.get_organizations_by_phone(db, number=number, projection=projection)
+    return [schemas.project_organization(organization, projection) for organization in organizations]
 
 
-@router.get("/organizations/by-activity/{activity_id}", response_model=List[schemas.Organization])
+@router.get(
+    "/organizations/by-activity/{activity_id}",
+    response_model=List[schemas.OrganizationPartial],
+    response_model_exclude_unset=True
+)
 def get_organizations_by_activity(
         activity_id: int,
+        projection: Optional[schemas.OrganizationProjection] = Depends(dependencies.get_organization_projection),
         db: Session = Depends(get_db),
         api_key: str = Depends(dependencies.get_api_key)
 ):
     """Список организаций по виду деятельности"""
-    organizations = crud.get_organizations_by_activity(db, activity_id=activity_id)
-    return organizations
+    def load():
+        organizations = crud.get_organizations_by_activity(db, activity_id=activity_id, projection=projection)
+        return [schemas.project_organization(organization, projection) for organization in organizations]
 
+    key = (activity_id, projection.key() if projection else None)
+    return single_flight.do("organizations_by_activity", key, load)
 
-@router.get("/organizations/nearby", response_model=List[schemas.Organization])
+
+@router.get("/organizations/nearby", response_model=List[schemas.OrganizationPartial], response_model_exclude_unset=True)
 def get_organizations_nearby(
         lat: float = Query(..., description="Широта центра"),
         lon: float = Query(..., description="Долгота центра"),
         radius: float = Query(1000, description="Радиус в метрах"),
+        projection: Optional[schemas.OrganizationProjection] = Depends(dependencies.get_organization_projection),
         db: Session = Depends(get_db),
         api_key: str = Depends(dependencies.get_api_key)
 ):
     """Организации в заданном радиусе от точки"""
-    organizations = crud.get_organizations_in_radius(db, lat=lat, lon=lon, radius=radius)
-    return organizations
+    def load():
+        organizations = crud.get_organizations_in_radius(db, lat=lat, lon=lon, radius=radius, projection=projection)
+        return [schemas.project_organization(organization, projection) for organization in organizations]
+
+    key = (lat, lon, radius, projection.key() if projection else None)
+    return single_flight.do("organizations_nearby", key, load)
+
+
+@router.get(
+    "/organizations/nearest",
+    response_model=List[schemas.OrganizationWithDistance],
+    response_model_exclude_unset=True
+)
+def get_nearest_organizations(
+        lat: float = Query(..., ge=-90, le=90, description="Широта точки"),
+        lon: float = Query(..., ge=-180, le=180, description="Долгота точки"),
+        k: int = Query(10, ge=1, le=settings.NEAREST_MAX_K, description="Сколько организаций вернуть"),
+        activity_id: Optional[int] = Query(None, description="Вид деятельности (включая дочерние)"),
+        projection: Optional[schemas.OrganizationProjection] = Depends(dependencies.get_organization_projection),
+        db: Session = Depends(get_db),
+        api_key: str = Depends(dependencies.get_api_key)
+):
+    """k ближайших организаций к точке, по возрастанию расстояния (в метрах)"""
+    def load():
+        nearest = crud.get_nearest_organizations(
+            db, lat=lat, lon=lon, k=k, activity_id=activity_id, projection=projection
+        )
+        return [
+            {**schemas.project_organization(organization, projection), "distance": distance}
+            for organization, distance in nearest
+        ]
+
+    key = (lat, lon, k, activity_id, projection.key() if projection else None)
+    return single_flight.do("organizations_nearest", key, load)
 
 
-@router.get("/organizations/search", response_model=List[schemas.Organization])
+@router.get("/organizations/search", response_model=List[schemas.OrganizationPartial], response_model_exclude_unset=True)
 def search_organizations(
         name: Optional[str] = None,
         activity_name: Optional[str] = None,
+        projection: Optional[schemas.OrganizationProjection] = Depends(dependencies.get_organization_projection),
         db: Session = Depends(get_db),
         api_key: str = Depends(dependencies.get_api_key)
 ):
     """Поиск организаций по названию или виду деятельности"""
-    if name:
-        return crud.search_organizations_by_name(db, name=name)
-    elif activity_name:
-        return crud.search_organizations_by_activity_name(db, activity_name=activity_name)
-    else:
+    if not name and not activity_name:
         raise HTTPException(status_code=400, detail="Укажите параметр поиска")
 
+    def load():
+        if name:
+            organizations = crud.search_organizations_by_name(db, name=name, projection=projection)
+        else:
+            organizations = crud.search_organizations_by_activity_name(
+                db, activity_name=activity_name, projection=projection
+            )
+        return [schemas.project_organization(organization, projection) for organization in organizations]
+
+    key = (name or None, None if name else activity_name, projection.key() if projection else None)
+    return single_flight.do("organizations_search", key, load)
+
+
+@router.get(
+    "/organizations/{organization_id}",
+    response_model=schemas.OrganizationPartial,
+    response_model_exclude_unset=True
+)
+def get_organization(
+        organization_id: int,
+        projection: Optional[schemas.OrganizationProjection] = Depends(dependencies.get_organization_projection),
+        db: Session = Depends(get_db),
+        api_key: str = Depends(dependencies.get_api_key)
+):
+    """Получить организацию по ID"""
+    organization = crud.get_organization(db, organization_id=organization_id, projection=projection)
+    if organization is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Organization not found"
+        )
+    return schemas.project_organization(organization, projection)
+
 
 @router.post("/organizations", response_model=schemas.Organization, status_code=status.HTTP_201_CREATED)
 def create_organization(
@@ -80,7 +222,35 @@ def create_organization(
     """
     Создать новую организацию
     """
-    return crud.create_organization(db=db, organization=organization)
+    try:
+        return crud.create_organization(db=db, organization=organization)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+
+
+@router.post("/organizations/import", response_model=schemas.Job, status_code=status.HTTP_202_ACCEPTED)
+def import_organizations(
+        organizations: List[schemas.OrganizationCreate],
+        response: Response,
+        idempotency_key: Optional[str] = Header(
+            None, max_length=255, description="Повторный импорт с тем же ключом не создает организации заново"
+        ),
+        db: Session = Depends(get_db),
+        api_key: str = Depends(dependencies.get_api_key)
+):
+    """
+    Массовый импорт организаций фоновой задачей. Статус и id созданных - в GET /jobs/{id}.
+    Без Idempotency-Key ключ выдается задаче, чтобы ее повтор после сбоя воркера не создал дубликаты
+    """
+    job = jobs.enqueue(db, jobs.IMPORT_ORGANIZATIONS, {
+        "organizations": [organization.model_dump() for organization in organizations],
+        "idempotency_key": idempotency_key or uuid.uuid4().hex
+    })
+    response.headers["Location"] = f"/api/v1/jobs/{job.id}"
+    return job
 
 
 @router.put("/organizations/{organization_id}", response_model=schemas.Organization)
@@ -93,7 +263,13 @@ def update_organization(
     """
     Обновить информацию об организации
     """
-    db_organization = crud.update_organization(db, organization_id=organization_id, organization=organization)
+    try:
+        db_organization = crud.update_organization(db, organization_id=organization_id, organization=organization)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
     if db_organization is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
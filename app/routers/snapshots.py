@@ -0,0 +1,108 @@
+import os
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, status
+from fastapi.responses import FileResponse
+
+from app import schemas, dependencies, replica, snapshots
+
+router = APIRouter()
+
+# Файл версии не меняется, клиенты и прокси могут кэшировать его бессрочно
+_IMMUTABLE = {"Cache-Control": "public, max-age=31536000, immutable"}
+
+
+def _file(path: str, url: str) -> dict:
+    return {"url": url, "size": os.path.getsize(path), "sha256": snapshots.file_digest(path)}
+
+
+def _send(path: str, filename: str) -> FileResponse:
+    if not os.path.exists(path):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Snapshot not found")
+    # FileResponse отвечает на Range (206), поэтому прерванную загрузку можно докачать
+    return FileResponse(path, media_type=snapshots.MEDIA_TYPE, filename=filename, headers=_IMMUTABLE)
+
+
+@router.get("/snapshots/latest", response_model=schemas.SnapshotManifest, response_model_exclude_none=True)
+def read_latest_snapshot(
+        since: Optional[int] = Query(None, description="Версия снимка у клиента: вернуть цепочку дельт от нее"),
+        api_key: str = Depends(dependencies.get_api_key)
+):
+    """
+    Последний офлайн-снимок справочника (SQLite) и, с since, дельты для обновления до него
+    """
+    versions = snapshots.list_snapshots()
+    if not versions:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No snapshots built yet")
+
+    version = versions[-1]
+    manifest = schemas.SnapshotManifest(
+        version=version,
+        snapshot=_file(snapshots.snapshot_path(version), f"/api/v1/snapshots/{version}")
+    )
+    if since is not None:
+        chain = snapshots.delta_chain(since, version)
+        if chain is not None:
+            manifest.deltas = [
+                schemas.SnapshotDelta(
+                    from_version=from_version,
+                    to_version=to_version,
+                    **_file(
+                        snapshots.delta_path(from_version, to_version),
+                        f"/api/v1/snapshots/deltas/{from_version}/{to_version}"
+                    )
+                )
+                for from_version, to_version in chain
+            ]
+    return manifest
+
+
+@router.get("/snapshots/replica/latest", response_model=schemas.SnapshotManifest, response_model_exclude_none=True)
+def read_latest_replica(api_key: str = Depends(dependencies.get_api_key)):
+    """
+    Последняя реплика для чтения (app/replica.py), которую забирают воркеры в READ_SNAPSHOT_MODE
+    """
+    versions = replica.list_replicas()
+    if not versions:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No replicas built yet")
+
+    version = versions[-1]
+    return schemas.SnapshotManifest(
+        version=version,
+        snapshot=_file(replica.replica_path(version), f"/api/v1/snapshots/replica/{version}")
+    )
+
+
+@router.get("/snapshots/replica/status", response_model=schemas.ReplicaStatus)
+def read_replica_status(request: Request, api_key: str = Depends(dependencies.get_api_key)):
+    """
+    Версия и возраст реплики, из которой отвечает этот воркер
+    """
+    loaded = request.app.state.replica
+    if loaded is None:
+        return schemas.ReplicaStatus(mode=False)
+    return loaded.status()
+
+
+@router.get("/snapshots/replica/{version}", response_class=FileResponse)
+def download_replica(version: int, api_key: str = Depends(dependencies.get_api_key)):
+    """
+    Файл реплики версии version; поддерживает Range
+    """
+    return _send(replica.replica_path(version), f"replica-{version}.sqlite")
+
+
+@router.get("/snapshots/{version}", response_class=FileResponse)
+def download_snapshot(version: int, api_key: str = Depends(dependencies.get_api_key)):
+    """
+    Файл снимка версии version; поддерживает Range
+    """
+    return _send(snapshots.snapshot_path(version), f"snapshot-{version}.sqlite")
+
+
+@router.get("/snapshots/deltas/{from_version}/{to_version}", response_class=FileResponse)
+def download_delta(from_version: int, to_version: int, api_key: str = Depends(dependencies.get_api_key)):
+    """
+    Дельта между соседними снимками; поддерживает Range
+    """
+    return _send(snapshots.delta_path(from_version, to_version), f"delta-{from_version}-{to_version}.sqlite")
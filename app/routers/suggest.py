@@ -0,0 +1,29 @@
+from fastapi import APIRouter, Depends, Query
+from typing import List, Optional
+from sqlalchemy.orm import Session
+from app import cache, schemas, dependencies
+from app.config import settings
+from app.database import get_db
+
+router = APIRouter()
+
+SUGGEST_KINDS = ("organization", "activity")
+
+
+@router.get("/suggest", response_model=List[schemas.Suggestion])
+def suggest(
+        q: str = Query(..., min_length=1, max_length=255, description="Начало названия"),
+        limit: int = Query(10, ge=1, le=settings.SUGGEST_MAX_LIMIT),
+        kind: Optional[List[str]] = Query(None, description="organization и/или activity"),
+        db: Session = Depends(get_db),
+        api_key: str = Depends(dependencies.get_api_key)
+):
+    """
+    Подсказки для строки поиска: названия организаций и видов деятельности,
+    слова которых начинаются со слов запроса (без учета регистра, ё = е)
+    """
+    kinds = [value for value in kind if value in SUGGEST_KINDS] if kind else None
+    return [
+        schemas.Suggestion(kind=entry_kind, id=entity_id, name=name)
+        for entry_kind, entity_id, name in cache.suggest_index.get(db).search(q, limit=limit, kinds=kinds)
+    ]
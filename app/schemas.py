@@ -1,5 +1,5 @@
 from pydantic import BaseModel, ConfigDict, Field, validator
-from typing import List, Optional
+from typing import Any, Dict, List, Optional
 
 class ActivityBase(BaseModel):
     name: str = Field(..., min_length=1, max_length=255)
@@ -20,6 +20,8 @@ class Activity(ActivityBase):
 
     id: int
     level: int
+    created_at: Optional[int] = None
+    updated_at: Optional[int] = None
     children: List['Activity'] = []
     organizations_count: Optional[int] = None
 
@@ -43,9 +45,25 @@ class Building(BuildingBase):
     model_config = ConfigDict(from_attributes=True)
 
     id: int
+    created_at: Optional[int] = None
+    updated_at: Optional[int] = None
     organizations_count: Optional[int] = None
 
 
+class BuildingCluster(BaseModel):
+    latitude: float
+    longitude: float
+    count: int
+    organizations_count: int
+    building_id: Optional[int] = None
+    activities: Optional[Dict[int, int]] = None
+
+
+class BuildingClusters(BaseModel):
+    zoom: int
+    clusters: List[BuildingCluster]
+
+
 class PhoneBase(BaseModel):
     number: str = Field(..., min_length=1, max_length=50)
 
@@ -59,6 +77,7 @@ class Phone(PhoneBase):
 
     id: int
     organization_id: int
+    normalized: Optional[str] = None
 
 
 class OrganizationBase(BaseModel):
@@ -88,6 +107,62 @@ class Organization(OrganizationBase):
     phones: List[Phone] = []
 
 
+ORGANIZATION_COLUMNS = ["id", "name", "description", "building_id", "created_at", "updated_at"]
+ORGANIZATION_RELATIONS = ["building", "phones", "activities"]
+
+
+class OrganizationProjection(BaseModel):
+    """
+    Какие колонки и связи организации загружать и отдавать клиенту
+    """
+    columns: List[str] = ORGANIZATION_COLUMNS
+    relations: List[str] = ORGANIZATION_RELATIONS
+
+    def key(self) -> tuple:
+        """
+        Проекция в виде ключа кэша: порядок полей в запросе не важен
+        """
+        return tuple(sorted(self.columns)), tuple(sorted(self.relations))
+
+
+class OrganizationPartial(BaseModel):
+    """
+    Организация с произвольным набором полей (fields=/include=).
+    Отдается с response_model_exclude_unset, поэтому незапрошенные поля в ответ не попадают
+    """
+    id: Optional[int] = None
+    name: Optional[str] = None
+    description: Optional[str] = None
+    building_id: Optional[int] = None
+    created_at: Optional[int] = None
+    updated_at: Optional[int] = None
+    building: Optional[Building] = None
+    activities: Optional[List[Activity]] = None
+    phones: Optional[List[Phone]] = None
+
+
+class OrganizationWithDistance(OrganizationPartial):
+    distance: float
+
+
+def project_organization(organization, projection: Optional[OrganizationProjection] = None) -> dict:
+    """
+    Словарь только с запрошенными полями; незапрошенные атрибуты ORM-объекта не читаются
+    """
+    projection = projection or OrganizationProjection()
+    data = {column: getattr(organization, column) for column in projection.columns}
+
+    # Вложенные объекты сразу выгружаются целиком, чтобы exclude_unset не отрезал их поля
+    if "building" in projection.relations:
+        building = organization.building
+        data["building"] = Building.model_validate(building).model_dump() if building is not None else None
+    if "activities" in projection.relations:
+        data["activities"] = [Activity.model_validate(activity).model_dump() for activity in organization.activities]
+    if "phones" in projection.relations:
+        data["phones"] = [Phone.model_validate(phone).model_dump() for phone in organization.phones]
+    return data
+
+
 class OrganizationSearch(BaseModel):
     name: Optional[str] = None
     activity_name: Optional[str] = None
@@ -119,4 +194,122 @@ class RectangleSearch(BaseModel):
         return v
 
 
+class Change(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    seq: int
+    entity_type: str
+    entity_id: int
+    operation: str
+    created_at: int
+
+
+class Tombstone(BaseModel):
+    id: int
+    deleted_at: int
+
+
+class BulkDeleteResult(BaseModel):
+    deleted: int
+
+
+class ChangeFeed(BaseModel):
+    changes: List[Change] = []
+    last_seq: int
+
+
+class Suggestion(BaseModel):
+    kind: str
+    id: int
+    name: str
+
+
+class JobCreate(BaseModel):
+    kind: str = Field(..., min_length=1, max_length=100)
+    payload: Dict[str, Any] = {}
+
+
+class Job(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    id: int
+    kind: str
+    status: str
+    payload: Optional[Dict[str, Any]] = None
+    attempts: int
+    max_attempts: int
+    run_at: int
+    last_error: Optional[str] = None
+    result: Optional[Dict[str, Any]] = None
+    created_at: int
+    updated_at: int
+    finished_at: Optional[int] = None
+
+
+class RouteProfileSettings(BaseModel):
+    rate: float = Field(..., ge=0, le=1, description="Доля профилируемых запросов")
+
+
+class RouteProfileStats(BaseModel):
+    rate: float
+    requests: Dict[str, int]
+    samples: Dict[str, int]
+
+
+class SnapshotFile(BaseModel):
+    url: str
+    size: int
+    sha256: str
+
+
+class SnapshotDelta(SnapshotFile):
+    from_version: int
+    to_version: int
+
+
+class SnapshotManifest(BaseModel):
+    version: int
+    snapshot: SnapshotFile
+    # Дельты от версии since до version по порядку; None - цепочки нет, нужен полный снимок
+    deltas: Optional[List[SnapshotDelta]] = None
+
+
+class ReplicaStatus(BaseModel):
+    mode: bool = Field(..., description="Воркер отвечает из реплики (READ_SNAPSHOT_MODE)")
+    source: Optional[str] = None
+    version: Optional[int] = None
+    built_at: Optional[int] = None
+    loaded_at: Optional[float] = None
+    checked_at: Optional[float] = None
+    age: Optional[float] = Field(None, description="Секунды с построения загруженной реплики")
+    stale: bool = False
+    error: Optional[str] = None
+
+
+class SingleFlightStats(BaseModel):
+    executions: int = Field(..., description="Сколько раз запрос выполнен")
+    coalesced: int = Field(..., description="Сколько запросов получили чужой результат без обращения к БД")
+
+
+class SingleFlightMetrics(BaseModel):
+    enabled: bool
+    window: float
+    queries: Dict[str, SingleFlightStats]
+
+
+class AdmissionRouteStats(BaseModel):
+    concurrency: int
+    queue_size: int
+    active: int = Field(..., description="Выполняется сейчас")
+    waiting: int = Field(..., description="Ждет в очереди")
+    admitted: int
+    rejected: int = Field(..., description="Отклонено: очередь заполнена")
+    timed_out: int = Field(..., description="Отклонено: не дождался места в очереди")
+
+
+class AdmissionMetrics(BaseModel):
+    enabled: bool
+    routes: Dict[str, AdmissionRouteStats]
+
+
 Activity.model_rebuild()
\ No newline at end of file
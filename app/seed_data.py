@@ -1,10 +1,15 @@
 from app.database import SessionLocal
-from app import crud, schemas
+from app import crud, models, schemas
 
 
 def seed_data():
     db = SessionLocal()
     try:
+        # Повторный старт воркера не должен дублировать данные
+        if db.query(models.Activity.id).first() is not None:
+            print("Seed data already exists, skipping")
+            return
+
         print("Creating activities...")
 
         food = crud.create_activity(db, schemas.ActivityCreate(
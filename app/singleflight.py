@@ -0,0 +1,126 @@
+"""
+Объединение одинаковых одновременных запросов чтения (single-flight).
+
+Первый запрос с данным ключом выполняет функцию, остальные с тем же ключом ждут и получают
+ее результат (или исключение), не обращаясь к БД и не занимая соединение пула.
+Результат - уже сериализуемые данные (словари, pydantic-модели), а не ORM-объекты:
+они привязаны к сессии выполнившего запроса.
+
+С окном SINGLE_FLIGHT_WINDOW результат отдается и запросам, пришедшим в течение окна после
+завершения; данные при этом могут отставать от записей не больше чем на окно.
+Первый запрос выполняет функцию без своего дедлайна (app/admission.py): иначе короткий дедлайн
+одного клиента обрывал бы результат для всех ожидающих. Ожидающий запрос ждет не дольше
+SINGLE_FLIGHT_WAIT_TIMEOUT и своего дедлайна, затем выполняет функцию сам (по истечении
+дедлайна - DeadlineExceeded), чтобы зависший первый запрос не держал остальных.
+Объединение и счетчики - в пределах одного воркера.
+"""
+import threading
+import time
+from collections import Counter
+from typing import Callable, Dict, Hashable, Optional, TypeVar
+
+from app.admission import DeadlineExceeded, remaining, without_deadline
+from app.config import settings
+
+T = TypeVar("T")
+
+# При таком числе ключей завершенные записи с истекшим окном вычищаются
+_PURGE_THRESHOLD = 1024
+
+
+class _Call:
+    __slots__ = ("done", "result", "error", "finished_at")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error: Optional[BaseException] = None
+        self.finished_at: Optional[float] = None
+
+
+class SingleFlight:
+    def __init__(self, enabled: bool, window: float, wait_timeout: float):
+        self.enabled = enabled
+        self.window = window
+        self.wait_timeout = wait_timeout
+        self.executions: Counter = Counter()
+        self.coalesced: Counter = Counter()
+        self._calls: Dict[Hashable, _Call] = {}
+        self._lock = threading.Lock()
+
+    def _expired(self, call: _Call, now: float) -> bool:
+        return call.finished_at is not None and now - call.finished_at > self.window
+
+    def _purge(self, now: float):
+        for key in [key for key, call in self._calls.items() if self._expired(call, now)]:
+            del self._calls[key]
+
+    def do(self, name: str, key: Hashable, function: Callable[[], T]) -> T:
+        """
+        Результат function для запроса name с нормализованными параметрами key
+        """
+        if not self.enabled:
+            return function()
+
+        full_key = (name, key)
+        with self._lock:
+            now = time.monotonic()
+            call = self._calls.get(full_key)
+            if call is not None and self._expired(call, now):
+                call = None
+            leader = call is None
+            if leader:
+                if len(self._calls) >= _PURGE_THRESHOLD:
+                    self._purge(now)
+                call = self._calls[full_key] = _Call()
+                self.executions[name] += 1
+            else:
+                self.coalesced[name] += 1
+
+        if not leader:
+            timeout = self.wait_timeout
+            left = remaining()
+            if left is not None:
+                timeout = max(0.0, min(timeout, left))
+            if not call.done.wait(timeout):
+                if left is not None and remaining() <= 0:
+                    raise DeadlineExceeded()
+                with self._lock:
+                    self.coalesced[name] -= 1
+                    self.executions[name] += 1
+                return function()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            with without_deadline():
+                call.result = function()
+            return call.result
+        except BaseException as error:
+            call.error = error
+            raise
+        finally:
+            with self._lock:
+                call.finished_at = time.monotonic()
+                # Ошибки и результаты без окна не переиспользуются следующими запросами
+                if (call.error is not None or self.window <= 0) and self._calls.get(full_key) is call:
+                    del self._calls[full_key]
+            call.done.set()
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        with self._lock:
+            return {
+                name: {"executions": self.executions[name], "coalesced": self.coalesced[name]}
+                for name in sorted(set(self.executions) | set(self.coalesced))
+            }
+
+    def reset(self):
+        with self._lock:
+            self.executions.clear()
+            self.coalesced.clear()
+
+
+single_flight = SingleFlight(
+    settings.SINGLE_FLIGHT_ENABLED, settings.SINGLE_FLIGHT_WINDOW, settings.SINGLE_FLIGHT_WAIT_TIMEOUT
+)
@@ -0,0 +1,379 @@
+"""
+Офлайн-снимки справочника для мобильных клиентов.
+
+Снимок - файл SQLite со зданиями, организациями, телефонами, деревом видов деятельности
+и geohash-ячейками зданий для поиска рядом без сети. Версия снимка - последний seq журнала
+изменений, прочитанный в той же транзакции, что и данные.
+
+Для соседних версий строится дельта - тоже файл SQLite: в таблицах с именами таблиц снимка
+добавленные и измененные строки, в таблицах <таблица>_deleted - ключи удаленных строк.
+Дельта считается сравнением двух файлов снимков, поэтому точно переводит один в другой
+независимо от того, что записано в журнале (apply_delta - эталонное применение).
+
+    python -m app.snapshots
+"""
+import argparse
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import time
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from app import crud, models
+from app.config import settings
+from app.database import SessionLocal
+from app.geo import geohash
+
+logger = logging.getLogger(__name__)
+
+SCHEMA_VERSION = 1
+MEDIA_TYPE = "application/vnd.sqlite3"
+BATCH_SIZE = 5000
+
+_SNAPSHOT_FILE = re.compile(r"^snapshot-(\d+)\.sqlite$")
+_DELTA_FILE = re.compile(r"^delta-(\d+)-(\d+)\.sqlite$")
+
+# Таблицы снимка: имя -> (DDL колонок, ключ)
+TABLES: Dict[str, Tuple[str, List[str]]] = {
+    "activities": (
+        "id INTEGER PRIMARY KEY, parent_id INTEGER, name TEXT NOT NULL, description TEXT, level INTEGER NOT NULL",
+        ["id"],
+    ),
+    "buildings": (
+        "id INTEGER PRIMARY KEY, address TEXT NOT NULL, latitude REAL NOT NULL, longitude REAL NOT NULL, "
+        "description TEXT",
+        ["id"],
+    ),
+    "organizations": (
+        "id INTEGER PRIMARY KEY, name TEXT NOT NULL, description TEXT, building_id INTEGER",
+        ["id"],
+    ),
+    "phones": (
+        "id INTEGER PRIMARY KEY, organization_id INTEGER NOT NULL, number TEXT NOT NULL, normalized TEXT",
+        ["id"],
+    ),
+    "organization_activity": (
+        "organization_id INTEGER NOT NULL, activity_id INTEGER NOT NULL, "
+        "PRIMARY KEY (organization_id, activity_id)",
+        ["organization_id", "activity_id"],
+    ),
+    "geo_cells": (
+        "cell TEXT NOT NULL, building_id INTEGER NOT NULL, PRIMARY KEY (cell, building_id)",
+        ["cell", "building_id"],
+    ),
+}
+
+INDEXES = [
+    "CREATE INDEX ix_activities_parent_id ON activities (parent_id)",
+    "CREATE INDEX ix_organizations_building_id ON organizations (building_id)",
+    "CREATE INDEX ix_organizations_name ON organizations (name)",
+    "CREATE INDEX ix_phones_organization_id ON phones (organization_id)",
+    "CREATE INDEX ix_phones_normalized ON phones (normalized)",
+    "CREATE INDEX ix_organization_activity_activity_id ON organization_activity (activity_id)",
+]
+
+
+def _without_rowid(table: str) -> str:
+    # Таблицам со составным ключом rowid не нужен: строки хранятся прямо в индексе ключа
+    return " WITHOUT ROWID" if len(TABLES[table][1]) > 1 else ""
+
+
+def _queries():
+    organization = models.Organization
+    activity = models.Activity
+    building = models.Building
+    return {
+        "activities": select(
+            activity.id, activity.parent_id, activity.name, activity.description, activity.level
+        ).where(activity.deleted_at.is_(None)).order_by(activity.id),
+        "buildings": select(
+            building.id, building.address, building.latitude, building.longitude, building.description
+        ).where(building.deleted_at.is_(None)).order_by(building.id),
+        "organizations": select(
+            organization.id, organization.name, organization.description, organization.building_id
+        ).order_by(organization.id),
+        "phones": select(
+            models.Phone.id, models.Phone.organization_id, models.Phone.number, models.Phone.normalized
+        ).order_by(models.Phone.id),
+        "organization_activity": select(
+            models.organization_activity.c.organization_id, models.organization_activity.c.activity_id
+        ).join(activity, activity.id == models.organization_activity.c.activity_id).where(
+            activity.deleted_at.is_(None)
+        ),
+    }
+
+
+def snapshot_path(version: int) -> str:
+    return os.path.join(settings.SNAPSHOT_DIR, f"snapshot-{version}.sqlite")
+
+
+def delta_path(from_version: int, to_version: int) -> str:
+    return os.path.join(settings.SNAPSHOT_DIR, f"delta-{from_version}-{to_version}.sqlite")
+
+
+def list_snapshots() -> List[int]:
+    """
+    Версии снимков на диске по возрастанию
+    """
+    if not os.path.isdir(settings.SNAPSHOT_DIR):
+        return []
+    return sorted(
+        int(match.group(1))
+        for match in map(_SNAPSHOT_FILE.match, os.listdir(settings.SNAPSHOT_DIR))
+        if match
+    )
+
+
+def list_deltas() -> List[Tuple[int, int]]:
+    """
+    Дельты на диске (from_version, to_version) по возрастанию
+    """
+    if not os.path.isdir(settings.SNAPSHOT_DIR):
+        return []
+    return sorted(
+        (int(match.group(1)), int(match.group(2)))
+        for match in map(_DELTA_FILE.match, os.listdir(settings.SNAPSHOT_DIR))
+        if match
+    )
+
+
+def delta_chain(since: int, version: int) -> Optional[List[Tuple[int, int]]]:
+    """
+    Дельты, переводящие снимок since в version; None, если цепочки нет и нужен полный снимок
+    """
+    following = dict(list_deltas())
+    chain = []
+    current = since
+    while current != version:
+        if current not in following:
+            return None
+        chain.append((current, following[current]))
+        current = following[current]
+    return chain
+
+
+def file_digest(path: str) -> str:
+    """
+    sha256 файла; считается при построении и хранится рядом (<файл>.sha256)
+    """
+    with open(path + ".sha256") as digest_file:
+        return digest_file.read().strip()
+
+
+def sha256_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as data:
+        for chunk in iter(lambda: data.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def write_digest(path: str):
+    """
+    Записывает sha256 файла рядом с ним
+    """
+    with open(path + ".sha256", "w") as digest_file:
+        digest_file.write(sha256_file(path))
+
+
+def _create_schema(connection: sqlite3.Connection, meta: Dict[str, object], indexes: bool):
+    connection.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT) WITHOUT ROWID")
+    connection.executemany("INSERT INTO meta VALUES (?, ?)", [(key, str(value)) for key, value in meta.items()])
+    for table, (columns, _) in TABLES.items():
+        connection.execute(f"CREATE TABLE {table} ({columns}){_without_rowid(table)}")
+    if indexes:
+        for statement in INDEXES:
+            connection.execute(statement)
+
+
+def _open_for_build(path: str) -> sqlite3.Connection:
+    if os.path.exists(path):
+        os.remove(path)
+    connection = sqlite3.connect(path)
+    # Файл пишется во временное место и только потом публикуется, журнал не нужен
+    connection.execute("PRAGMA journal_mode=OFF")
+    connection.execute("PRAGMA synchronous=OFF")
+    return connection
+
+
+def _publish(connection: sqlite3.Connection, temporary: str, path: str):
+    connection.commit()
+    connection.execute("VACUUM")
+    connection.close()
+    write_digest(temporary)
+    os.replace(temporary + ".sha256", path + ".sha256")
+    os.replace(temporary, path)
+
+
+def _insert(connection: sqlite3.Connection, table: str, rows):
+    placeholders = ", ".join("?" * len(rows[0]))
+    connection.executemany(f"INSERT INTO {table} VALUES ({placeholders})", rows)
+
+
+def current_version(db: Session) -> int:
+    # Не дальше границы видимости журнала: записи параллельных транзакций с меньшими seq
+    # войдут в следующую версию, а не потеряются между версиями
+    return crud.get_change_watermark(db)
+
+
+def _write_snapshot(db: Session, version: int, path: str):
+    temporary = path + ".tmp"
+    connection = _open_for_build(temporary)
+    try:
+        _create_schema(connection, {
+            "version": version,
+            "created_at": int(time.time()),
+            "schema_version": SCHEMA_VERSION,
+            "geo_cell_precision": settings.SNAPSHOT_GEO_CELL_PRECISION,
+        }, indexes=True)
+
+        for table, query in _queries().items():
+            result = db.execute(query, execution_options={"yield_per": BATCH_SIZE})
+            for rows in result.partitions():
+                rows = [tuple(row) for row in rows]
+                _insert(connection, table, rows)
+                if table == "buildings":
+                    _insert(connection, "geo_cells", [
+                        (geohash(latitude, longitude, settings.SNAPSHOT_GEO_CELL_PRECISION), building_id)
+                        for building_id, _, latitude, longitude, _ in rows
+                    ])
+    except BaseException:
+        connection.close()
+        os.remove(temporary)
+        raise
+    _publish(connection, temporary, path)
+
+
+def build_delta(from_version: int, to_version: int) -> str:
+    """
+    Дельта между двумя снимками на диске
+    """
+    path = delta_path(from_version, to_version)
+    temporary = path + ".tmp"
+    connection = _open_for_build(temporary)
+    try:
+        _create_schema(connection, {
+            "from_version": from_version,
+            "to_version": to_version,
+            "schema_version": SCHEMA_VERSION,
+        }, indexes=False)
+        connection.execute("ATTACH DATABASE ? AS old", (snapshot_path(from_version),))
+        connection.execute("ATTACH DATABASE ? AS new", (snapshot_path(to_version),))
+
+        for table, (_, key) in TABLES.items():
+            key_columns = ", ".join(key)
+            connection.execute(
+                f"INSERT INTO main.{table} SELECT * FROM new.{table} EXCEPT SELECT * FROM old.{table}"
+            )
+            connection.execute(f"CREATE TABLE {table}_deleted AS SELECT {key_columns} FROM old.{table} LIMIT 0")
+            connection.execute(
+                f"INSERT INTO {table}_deleted "
+                f"SELECT {key_columns} FROM old.{table} EXCEPT SELECT {key_columns} FROM new.{table}"
+            )
+        connection.commit()
+        connection.execute("DETACH DATABASE old")
+        connection.execute("DETACH DATABASE new")
+    except BaseException:
+        connection.close()
+        os.remove(temporary)
+        raise
+    _publish(connection, temporary, path)
+    return path
+
+
+def apply_delta(snapshot: str, delta: str):
+    """
+    Применяет дельту к файлу снимка так же, как это должен делать клиент:
+    сначала удаления, затем вставка с заменой по ключу
+    """
+    connection = sqlite3.connect(snapshot)
+    try:
+        connection.execute("ATTACH DATABASE ? AS delta", (delta,))
+        from_version, to_version = [
+            int(value) for (value,) in connection.execute(
+                "SELECT value FROM delta.meta WHERE key IN ('from_version', 'to_version') ORDER BY key"
+            )
+        ]
+        version = int(connection.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()[0])
+        if version != from_version:
+            raise ValueError(f"Delta {from_version}->{to_version} does not apply to snapshot {version}")
+
+        with connection:
+            for table, (_, key) in TABLES.items():
+                key_columns = ", ".join(key)
+                connection.execute(
+                    f"DELETE FROM {table} WHERE ({key_columns}) IN (SELECT {key_columns} FROM delta.{table}_deleted)"
+                )
+                connection.execute(f"INSERT OR REPLACE INTO {table} SELECT * FROM delta.{table}")
+            connection.execute("UPDATE meta SET value = ? WHERE key = 'version'", (str(to_version),))
+        connection.execute("DETACH DATABASE delta")
+    finally:
+        connection.close()
+
+
+def _prune():
+    versions = list_snapshots()
+    for version in versions[:-settings.SNAPSHOT_KEEP]:
+        for path in (snapshot_path(version), snapshot_path(version) + ".sha256"):
+            if os.path.exists(path):
+                os.remove(path)
+
+    deltas = list_deltas()
+    for from_version, to_version in deltas[:-settings.SNAPSHOT_DELTA_KEEP]:
+        for path in (delta_path(from_version, to_version), delta_path(from_version, to_version) + ".sha256"):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def build_snapshot(db: Session) -> dict:
+    """
+    Строит снимок текущей версии и дельту от предыдущего снимка.
+    Если снимок этой версии уже есть, ничего не делает
+    """
+    if db.get_bind().dialect.name == "postgresql":
+        # Все таблицы и версия читаются из одного снимка данных БД
+        db.connection(execution_options={"isolation_level": "REPEATABLE READ"})
+
+    version = current_version(db)
+    path = snapshot_path(version)
+    if os.path.exists(path):
+        db.rollback()
+        return {"version": version, "built": False}
+
+    os.makedirs(settings.SNAPSHOT_DIR, exist_ok=True)
+    started = time.monotonic()
+    try:
+        _write_snapshot(db, version, path)
+    finally:
+        db.rollback()
+
+    result = {"version": version, "built": True, "size": os.path.getsize(path)}
+    previous = [existing for existing in list_snapshots() if existing < version]
+    if previous:
+        result["delta_from"] = previous[-1]
+        result["delta_size"] = os.path.getsize(build_delta(previous[-1], version))
+    _prune()
+
+    logger.info("Snapshot %s built in %.1fs: %s", version, time.monotonic() - started, result)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Построение офлайн-снимка справочника")
+    parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    db = SessionLocal()
+    try:
+        print(build_snapshot(db))
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
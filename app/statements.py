@@ -0,0 +1,29 @@
+"""
+Готовые select() горячих запросов чтения.
+
+Запрос строится один раз, значения передаются через bindparam. Повторное выполнение того же
+объекта не пересобирает запрос и не пересчитывает его ключ кэша (он запоминается в объекте),
+а SQL берется из кэша компиляции engine. Legacy db.query(...) на каждый вызов создает новый
+Query, опции загрузки и заново обходит все выражение для ключа кэша.
+"""
+import threading
+from typing import Callable, Dict, Hashable
+
+from sqlalchemy import Select
+
+_statements: Dict[Hashable, Select] = {}
+_lock = threading.Lock()
+
+
+def cached_statement(key: Hashable, build: Callable[[], Select]) -> Select:
+    """
+    Запрос по ключу; при первом обращении строится build().
+    Ключ должен однозначно определять запрос (имя запроса, модель, проекция)
+    """
+    statement = _statements.get(key)
+    if statement is None:
+        with _lock:
+            statement = _statements.get(key)
+            if statement is None:
+                statement = _statements[key] = build()
+    return statement
@@ -0,0 +1,204 @@
+import copy
+import heapq
+import re
+from array import array
+from bisect import bisect_left
+from typing import Dict, Iterable, List, Optional, Tuple
+
+_WORD = re.compile(r"\w+")
+# Части слитных названий: "АвтоМир" -> "Авто", "Мир"
+_CAMEL_PART = re.compile(r"[A-ZА-ЯЁ][a-zа-яё]+")
+_PREFIX_END = "\U0010ffff"
+
+
+def normalize(value: str) -> str:
+    """
+    Приведение к виду для сравнения: без регистра, ё = е
+    """
+    return value.casefold().replace("ё", "е")
+
+
+def tokenize(name: str) -> List[str]:
+    """
+    Слова названия в нормализованном виде, включая части слитных слов
+    """
+    tokens = []
+    for word in _WORD.findall(name):
+        tokens.append(normalize(word))
+        parts = _CAMEL_PART.findall(word)
+        if len(parts) > 1:
+            tokens.extend(normalize(part) for part in parts)
+    return list(dict.fromkeys(tokens))
+
+
+def rank_key(name: str) -> Tuple[int, str]:
+    # Короче название - выше в подсказках
+    return len(name), normalize(name)
+
+
+class SuggestIndex:
+    """
+    Префиксный индекс названий одного типа в памяти.
+
+    Записи отсортированы по рангу, поэтому номер записи и есть ее ранг.
+    Пары (слово, номер записи) хранятся двумя параллельными массивами, отсортированными по слову:
+    все слова с префиксом - непрерывный диапазон, который находится двоичным поиском.
+    Для префиксов с диапазоном больше scan_limit лучшие top_size записей считаются при построении,
+    поэтому поиск не зависит от того, сколько названий начинается на первые буквы
+    """
+
+    def __init__(self, entries: Iterable[Tuple[int, str]], scan_limit: int = 256, top_size: int = 128):
+        """
+        entries - (id, название)
+        """
+        ranked = sorted(entries, key=lambda entry: (rank_key(entry[1]), entry[0]))
+        self.ids = array("q", [entity_id for entity_id, _ in ranked])
+        self.names: List[str] = [name for _, name in ranked]
+        self.entry_tokens: List[Tuple[str, ...]] = [tuple(tokenize(name)) for name in self.names]
+
+        postings = sorted(
+            (token, position)
+            for position, tokens in enumerate(self.entry_tokens)
+            for token in tokens
+        )
+        self.tokens: List[str] = [token for token, _ in postings]
+        self.positions = array("l", [position for _, position in postings])
+
+        self.scan_limit = scan_limit
+        self.top_size = top_size
+        self._top: Dict[str, array] = {}
+        if len(self.tokens) > scan_limit:
+            self._build_top("", 0, len(self.tokens))
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def _range(self, prefix: str) -> Tuple[int, int]:
+        return bisect_left(self.tokens, prefix), bisect_left(self.tokens, prefix + _PREFIX_END)
+
+    def _scan(self, lo: int, hi: int) -> List[int]:
+        return sorted(set(self.positions[lo:hi]))
+
+    def _build_top(self, prefix: str, lo: int, hi: int) -> List[int]:
+        """
+        Лучшие записи префикса: слияние лучших записей его продолжений на одну букву
+        """
+        if hi - lo <= self.scan_limit:
+            return self._scan(lo, hi)[:self.top_size]
+
+        depth = len(prefix)
+        # Слово, равное префиксу, стоит в диапазоне первым
+        exact_end = lo
+        while exact_end < hi and len(self.tokens[exact_end]) == depth:
+            exact_end += 1
+        parts = [self._scan(lo, exact_end)] if exact_end > lo else []
+
+        start = exact_end
+        while start < hi:
+            child = self.tokens[start][:depth + 1]
+            end = bisect_left(self.tokens, child + _PREFIX_END, start, hi)
+            parts.append(self._build_top(child, start, end))
+            start = end
+
+        top = []
+        for position in heapq.merge(*parts):
+            if not top or top[-1] != position:
+                top.append(position)
+                if len(top) == self.top_size:
+                    break
+        self._top[prefix] = array("l", top)
+        return top
+
+    def _ranked(self, prefix: str, lo: int, hi: int) -> Iterable[int]:
+        if hi - lo <= self.scan_limit:
+            return self._scan(lo, hi)
+        return self._top[prefix]
+
+    def search(self, query_tokens: List[str], limit: int) -> List[Tuple[Tuple[int, str], int, str]]:
+        """
+        (ранг, id, название) записей, у которых каждое слово запроса - начало какого-то слова названия.
+        Для нескольких слов кандидаты берутся у самого редкого; если и оно очень частое,
+        проверяются только его top_size лучших записей
+        """
+        ranges = sorted(
+            ((self._range(token), token) for token in query_tokens),
+            key=lambda item: item[0][1] - item[0][0]
+        )
+        (lo, hi), first_token = ranges[0]
+        if lo == hi:
+            return []
+
+        rest = [token for _, token in ranges[1:]]
+        result = []
+        for position in self._ranked(first_token, lo, hi):
+            entry_tokens = self.entry_tokens[position]
+            if all(any(entry_token.startswith(token) for entry_token in entry_tokens) for token in rest):
+                name = self.names[position]
+                result.append((rank_key(name), self.ids[position], name))
+                if len(result) == limit:
+                    break
+        return result
+
+
+class Suggester:
+    """
+    Подсказки по нескольким типам записей (организации, виды деятельности):
+    у каждого типа свой индекс, результаты сливаются по рангу.
+
+    Изменения после построения (with_changes) не перестраивают индексы: измененные записи исключаются
+    из результатов основного индекса, а их новые названия ищутся в маленьком индексе только по ним
+    """
+
+    def __init__(self, entries: Dict[str, Iterable[Tuple[int, str]]], version: int = 0):
+        """
+        version - seq журнала изменений, по который включительно учтены названия
+        """
+        self.indexes = {kind: SuggestIndex(kind_entries) for kind, kind_entries in entries.items()}
+        self.version = version
+        # kind -> {id: новое название или None, если запись удалена}
+        self.changed: Dict[str, Dict[int, Optional[str]]] = {kind: {} for kind in self.indexes}
+        self._added: Dict[str, SuggestIndex] = {}
+
+    def changed_count(self) -> int:
+        return sum(len(changed) for changed in self.changed.values())
+
+    def with_changes(self, changes: Dict[str, Dict[int, Optional[str]]], version: int) -> "Suggester":
+        """
+        Новый Suggester с теми же индексами и примененными изменениями; текущий не меняется,
+        поэтому выполняющиеся поиски его дочитывают
+        """
+        suggester = copy.copy(self)
+        suggester.version = version
+        suggester.changed = {
+            kind: {**changed, **changes.get(kind, {})} for kind, changed in self.changed.items()
+        }
+        suggester._added = {
+            kind: SuggestIndex([(entity_id, name) for entity_id, name in changed.items() if name is not None])
+            for kind, changed in suggester.changed.items()
+            if changed
+        }
+        return suggester
+
+    def _search_kind(self, kind: str, query_tokens: List[str], limit: int) -> List[Tuple[Tuple[int, str], int, str]]:
+        changed = self.changed[kind]
+        # С запасом на записи, которые будут отброшены как измененные
+        found = [
+            item for item in self.indexes[kind].search(query_tokens, limit + len(changed)) if item[1] not in changed
+        ]
+        added = self._added.get(kind)
+        if added is not None:
+            found = list(heapq.merge(found, added.search(query_tokens, limit)))
+        return found[:limit]
+
+    def search(self, query: str, limit: int = 10, kinds: Optional[Iterable[str]] = None) -> List[Tuple[str, int, str]]:
+        # Запрос на слитные части не делится: "АвтоМир" ищется и в "Автомир"
+        query_tokens = list(dict.fromkeys(normalize(word) for word in _WORD.findall(query)))
+        if not query_tokens:
+            return []
+
+        results = [
+            [(rank, kind, entity_id, name) for rank, entity_id, name in self._search_kind(kind, query_tokens, limit)]
+            for kind in self.indexes
+            if kinds is None or kind in kinds
+        ]
+        return [(kind, entity_id, name) for _, kind, entity_id, name in heapq.merge(*results)][:limit]
@@ -0,0 +1,142 @@
+"""
+Накладные расходы горячих запросов чтения crud на вызов: прежние db.query(...) против готовых select()
+
+    python -m benchmarks.crud_statements --calls 3000
+    python -m benchmarks.crud_statements --database-url postgresql+psycopg://... --calls 3000
+
+По умолчанию - SQLite в памяти, чтобы время выполнения самого запроса было минимальным
+и разница приходилась на построение запроса, ключ кэша и загрузку объектов.
+Таблицы создаются и заполняются в указанной БД, поэтому --database-url - только для пустой тестовой базы
+"""
+import argparse
+import statistics
+import time
+
+from sqlalchemy import select
+from sqlalchemy.orm import joinedload, selectinload
+
+from app import crud, database, models, schemas
+from app.config import Settings
+from app.loaders import get_loader
+from app.phones import normalize_phone
+
+PROJECTION = schemas.OrganizationProjection(columns=["id", "name", "building_id"], relations=["building"])
+
+
+def phone_number(building_id: int, index: int) -> str:
+    return f"8916{building_id:04d}{index:03d}"
+
+
+def seed(db, buildings: int, per_building: int):
+    db_buildings = [
+        models.Building(address=f"Адрес {index}", latitude=55 + index / 1000, longitude=37 + index / 1000)
+        for index in range(buildings)
+    ]
+    db.add_all(db_buildings)
+    db.flush()
+    for building in db_buildings:
+        for index in range(per_building):
+            organization = models.Organization(
+                name=f"Организация {building.id}-{index}",
+                building_id=building.id,
+                geo_region=building.geo_region
+            )
+            number = phone_number(building.id, index)
+            organization.phones.append(models.Phone(number=number, normalized=normalize_phone(number)))
+            db.add(organization)
+    db.commit()
+
+
+# Прежние реализации через legacy Query - точка отсчета
+
+def legacy_get_organization(db, organization_id):
+    return crud.query_organizations(db, PROJECTION).filter(models.Organization.id == organization_id).first()
+
+
+def legacy_by_building(db, building_id):
+    return crud.query_organizations(db, PROJECTION).filter(models.Organization.building_id == building_id).all()
+
+
+def legacy_by_phone(db, number):
+    normalized = normalize_phone(number)
+    owners = select(models.Phone.organization_id).where(models.Phone.normalized == normalized)
+    return crud.query_organizations(db, PROJECTION).filter(models.Organization.id.in_(owners)).all()
+
+
+def legacy_by_name(db, name):
+    return crud.query_organizations(db, PROJECTION).filter(models.Organization.name.ilike(f"%{name}%")).all()
+
+
+def legacy_change_version(db, entity_type):
+    return db.query(models.Change.seq, models.Change.created_at).filter(
+        models.Change.entity_type == entity_type
+    ).order_by(models.Change.seq.desc()).first()
+
+
+def legacy_load_organization(db, organization_id):
+    return db.query(models.Organization).options(
+        joinedload(models.Organization.building), selectinload(models.Organization.phones)
+    ).filter(models.Organization.id.in_([organization_id])).all()
+
+
+def load_organization(db, organization_id):
+    return get_loader(db, models.Organization).load(organization_id)
+
+
+CASES = [
+    ("get_organization", legacy_get_organization, lambda db, value: crud.get_organization(db, value, PROJECTION), 1),
+    ("by_building", legacy_by_building, lambda db, value: crud.get_organizations_by_building(db, value, PROJECTION), 1),
+    ("by_phone", legacy_by_phone, lambda db, value: crud.get_organizations_by_phone(db, value, PROJECTION),
+     phone_number(1, 0)),
+    ("by_name", legacy_by_name, lambda db, value: crud.search_organizations_by_name(db, value, PROJECTION), "1-0"),
+    ("change_version", legacy_change_version, lambda db, value: crud.get_change_version(db, [value]), "organization"),
+    ("loader", legacy_load_organization, load_organization, 1),
+]
+
+
+def measure(function, value, calls: int):
+    timings = []
+    db = database.SessionLocal()
+    try:
+        for _ in range(calls):
+            # Каждый вызов - как в новом запросе: пустая identity map и новые загрузчики
+            db.expunge_all()
+            db.info.pop("loaders", None)
+            started = time.perf_counter()
+            function(db, value)
+            timings.append(time.perf_counter() - started)
+    finally:
+        db.close()
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--database-url", default="sqlite://")
+    parser.add_argument("--buildings", type=int, default=200)
+    parser.add_argument("--per-building", type=int, default=5)
+    parser.add_argument("--calls", type=int, default=3000)
+    args = parser.parse_args()
+
+    database.configure_engine(Settings(DATABASE_URL=args.database_url))
+    database.Base.metadata.create_all(bind=database.engine)
+    db = database.SessionLocal()
+    try:
+        seed(db, args.buildings, args.per_building)
+    finally:
+        db.close()
+
+    for name, before, after, value in CASES:
+        # Прогрев: кэш компиляции и подготовленные на сервере запросы
+        measure(before, value, 100)
+        measure(after, value, 100)
+        before_median = statistics.median(measure(before, value, args.calls))
+        after_median = statistics.median(measure(after, value, args.calls))
+        print(
+            f"{name}: before={before_median * 1e6:.0f}us after={after_median * 1e6:.0f}us "
+            f"(-{(1 - after_median / before_median) * 100:.0f}%)"
+        )
+
+
+if __name__ == "__main__":
+    main()
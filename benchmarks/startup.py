@@ -0,0 +1,63 @@
+"""
+Замер времени старта приложения
+
+    python -m benchmarks.startup --runs 10
+
+import: время `import app.main` в чистом интерпретаторе (без обращений к БД)
+lifespan: время выполнения lifespan (создание таблиц, seed, прогрев), требует БД
+"""
+import argparse
+import asyncio
+import statistics
+import subprocess
+import sys
+import time
+
+
+def measure_import(runs: int):
+    timings = []
+    code = "import time; t = time.perf_counter(); import app.main; print(time.perf_counter() - t)"
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, "-c", code],
+            check=True,
+            capture_output=True,
+            text=True
+        ).stdout
+        timings.append(float(output.strip().splitlines()[-1]))
+    return timings
+
+
+def measure_lifespan(runs: int):
+    from app.main import create_app
+
+    async def run_once():
+        app = create_app()
+        started = time.perf_counter()
+        async with app.router.lifespan_context(app):
+            return time.perf_counter() - started
+
+    return [asyncio.run(run_once()) for _ in range(runs)]
+
+
+def report(name: str, timings):
+    print(
+        f"{name}: min={min(timings) * 1000:.1f}ms "
+        f"median={statistics.median(timings) * 1000:.1f}ms "
+        f"max={max(timings) * 1000:.1f}ms runs={len(timings)}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--skip-lifespan", action="store_true", help="не замерять lifespan (нет БД)")
+    args = parser.parse_args()
+
+    report("import", measure_import(args.runs))
+    if not args.skip_lifespan:
+        report("lifespan", measure_lifespan(args.runs))
+
+
+if __name__ == "__main__":
+    main()
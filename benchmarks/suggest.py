@@ -0,0 +1,74 @@
+"""
+Задержка поиска подсказок по префиксному индексу (без БД и HTTP)
+
+    python -m benchmarks.suggest --organizations 200000 --queries 20000
+"""
+import argparse
+import random
+import statistics
+import time
+
+from app.suggest import Suggester
+
+SYLLABLES = ["ро", "га", "ко", "пы", "та", "мо", "ло", "чн", "ре", "ки", "ав", "то", "ме", "ди", "ст", "ар", "ус", "ин"]
+FORMS = ["ООО", "ЗАО", "АО", "ИП"]
+
+
+def build_entries(organizations: int, activities: int, rng: random.Random):
+    def word():
+        return "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))).capitalize()
+
+    return {
+        "organization": [
+            (index, f'{rng.choice(FORMS)} "{word()}{word() if rng.random() < 0.3 else ""} {word()}"')
+            for index in range(organizations)
+        ],
+        "activity": [(index, f"{word()} {word().lower()}") for index in range(activities)],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--organizations", type=int, default=200000)
+    parser.add_argument("--activities", type=int, default=500)
+    parser.add_argument("--queries", type=int, default=20000)
+    parser.add_argument("--limit", type=int, default=10)
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    entries = build_entries(args.organizations, args.activities, rng)
+
+    started = time.perf_counter()
+    suggester = Suggester(entries)
+    print(f"build: {time.perf_counter() - started:.2f}s, "
+          f"{sum(len(index) for index in suggester.indexes.values())} names")
+
+    # Запросы как при наборе: от одной буквы до целого слова, иногда из двух слов
+    names = [name for kind_entries in entries.values() for _, name in kind_entries]
+    queries = []
+    for _ in range(args.queries):
+        name = rng.choice(names)
+        words = name.replace('"', "").split()
+        word = rng.choice(words)
+        query = word[:rng.randint(1, len(word))]
+        if rng.random() < 0.2:
+            other = rng.choice(words)
+            query = f"{other} {query}"
+        queries.append(query)
+
+    timings = []
+    for query in queries:
+        started = time.perf_counter()
+        suggester.search(query, limit=args.limit)
+        timings.append(time.perf_counter() - started)
+
+    timings.sort()
+    print(
+        f"search: p50={statistics.median(timings) * 1e6:.0f}us "
+        f"p99={timings[int(len(timings) * 0.99)] * 1e6:.0f}us "
+        f"max={timings[-1] * 1e6:.0f}us queries={len(timings)}"
+    )
+
+
+if __name__ == "__main__":
+    main()
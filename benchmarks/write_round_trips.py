@@ -0,0 +1,145 @@
+"""
+Число запросов к БД на запись через crud вместе с сериализацией ответа (как в роутере)
+
+    python -m benchmarks.write_round_trips
+    python -m benchmarks.write_round_trips --database-url postgresql+psycopg://... -v
+
+Завершается с кодом 1, если операция выполняет больше запросов, чем указано в BUDGETS:
+после commit не должно быть ни refresh, ни ленивых загрузок связей при сериализации.
+BEGIN и COMMIT не считаются. Таблицы создаются и заполняются в указанной БД,
+поэтому --database-url - только для пустой тестовой базы. Те же бюджеты на SQLite
+проверяет tests/test_write_round_trips.py (python -m pytest tests)
+"""
+import argparse
+import sys
+from typing import Dict, List
+
+from sqlalchemy import event
+
+from app import crud, database, models, schemas
+from app.config import Settings
+from app.jobs import PURGE_DELETED, enqueue
+
+# Запросы SQLite; на Postgres к каждой записи добавляется pg_notify об устаревших кэшах
+BUDGETS = {
+    # здание, виды деятельности, их дочерние, INSERT организации, связей, телефонов, журнала
+    "create_organization": 8,
+    # организация без заменяемых связей, новое здание, DELETE телефонов и связей, новые виды деятельности
+    # с дочерними, журнал, UPDATE, INSERT связей и телефонов
+    "update_organization": 10,
+    "rename_organization": 6,
+    "create_building": 2,
+    "update_building": 3,
+    "create_activity": 3,
+    # вид деятельности и его дочерние по уровням (у изменяемого есть дочерний без своих)
+    "update_activity": 5,
+    "enqueue_job": 1,
+}
+POSTGRESQL_EXTRA = 1
+
+
+def seed(db):
+    root = models.Activity(name="Еда", level=0)
+    meat = models.Activity(name="Мясо", level=1, parent=root)
+    milk = models.Activity(name="Молоко", level=1, parent=root)
+    buildings = [
+        models.Building(address=f"Адрес {index}", latitude=55.7 + index / 100, longitude=37.6)
+        for index in range(2)
+    ]
+    organization = models.Organization(name="Организация", activities=[meat], building=buildings[0])
+    organization.phones.append(models.Phone(number="8-916-000-00-00", normalized="+79160000000"))
+    db.add_all([root, meat, milk, organization, *buildings])
+    db.commit()
+    return {"organization": organization.id, "buildings": [b.id for b in buildings], "activities": [meat.id, milk.id]}
+
+
+def cases(ids: dict):
+    building_id, other_building_id = ids["buildings"]
+    meat_id, milk_id = ids["activities"]
+    return [
+        ("create_organization", lambda db: schemas.Organization.model_validate(crud.create_organization(
+            db, schemas.OrganizationCreate(
+                name="Новая", building_id=building_id, phone_numbers=["1-111", "2-222"], activity_ids=[meat_id, milk_id]
+            )
+        ))),
+        ("update_organization", lambda db: schemas.Organization.model_validate(crud.update_organization(
+            db, ids["organization"], schemas.OrganizationUpdate(
+                name="Иная", building_id=other_building_id, phone_numbers=["3-333"], activity_ids=[milk_id]
+            )
+        ))),
+        ("rename_organization", lambda db: schemas.Organization.model_validate(crud.update_organization(
+            db, ids["organization"], schemas.OrganizationUpdate(name="Переименована")
+        ))),
+        ("create_building", lambda db: schemas.Building.model_validate(crud.create_building(
+            db, schemas.BuildingCreate(address="Новое", latitude=55.8, longitude=37.5)
+        ))),
+        ("update_building", lambda db: schemas.Building.model_validate(crud.update_building(
+            db, building_id, schemas.BuildingUpdate(address="Другое", latitude=55.81, longitude=37.51)
+        ))),
+        ("create_activity", lambda db: schemas.Activity.model_validate(crud.create_activity(
+            db, schemas.ActivityCreate(name="Сыр", parent_id=milk_id)
+        ))),
+        ("update_activity", lambda db: schemas.Activity.model_validate(crud.update_activity(
+            db, milk_id, schemas.ActivityUpdate(name="Молочная продукция")
+        ))),
+        ("enqueue_job", lambda db: schemas.Job.model_validate(enqueue(db, PURGE_DELETED))),
+    ]
+
+
+def measure(database_url: str) -> Dict[str, List[str]]:
+    """
+    Создает таблицы в database_url, заполняет их и выполняет каждую операцию в новой сессии.
+    Возвращает запросы каждой операции (BEGIN и COMMIT не считаются)
+    """
+    database.configure_engine(Settings(DATABASE_URL=database_url))
+    database.Base.metadata.create_all(bind=database.engine)
+
+    statements: List[str] = []
+
+    @event.listens_for(database.engine, "before_cursor_execute")
+    def record(connection, cursor, statement, parameters, context, executemany):
+        statements.append(" ".join(statement.split())[:120])
+
+    db = database.SessionLocal()
+    try:
+        ids = seed(db)
+    finally:
+        db.close()
+
+    result = {}
+    for name, operation in cases(ids):
+        db = database.SessionLocal()
+        try:
+            statements.clear()
+            operation(db)
+            result[name] = list(statements)
+        finally:
+            db.close()
+    return result
+
+
+def budget(name: str) -> int:
+    return BUDGETS[name] + (POSTGRESQL_EXTRA if database.engine.dialect.name == "postgresql" else 0)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--database-url", default="sqlite://")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Печатать сами запросы")
+    args = parser.parse_args()
+
+    failed = False
+    for name, statements in measure(args.database_url).items():
+        count = len(statements)
+        status = "ok" if count <= budget(name) else "OVER BUDGET"
+        failed = failed or count > budget(name)
+        print(f"{name}: {count} queries (budget {budget(name)}) {status}")
+        if args.verbose:
+            for statement in statements:
+                print(f"    {statement}")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+"""
+Продакшн-конфигурация gunicorn с uvicorn-воркерами
+
+    gunicorn -c gunicorn_conf.py app.main:app
+
+Число воркеров берется из WEB_CONCURRENCY, по умолчанию 2 * CPU + 1 (не больше MAX_WORKERS).
+Значение пробрасывается воркерам через окружение, чтобы пул соединений каждого
+воркера делился из общего бюджета DB_MAX_CONNECTIONS (см. app.database.pool_limits).
+"""
+import multiprocessing
+import os
+
+
+def _default_workers() -> int:
+    workers = multiprocessing.cpu_count() * 2 + 1
+    return min(workers, int(os.getenv("MAX_WORKERS", "8")))
+
+
+workers = int(os.getenv("WEB_CONCURRENCY") or _default_workers())
+os.environ["WEB_CONCURRENCY"] = str(workers)
+
+worker_class = "uvicorn.workers.UvicornWorker"
+bind = os.getenv("BIND", "0.0.0.0:8000")
+timeout = int(os.getenv("WORKER_TIMEOUT", "60"))
+graceful_timeout = int(os.getenv("GRACEFUL_TIMEOUT", "30"))
+keepalive = int(os.getenv("KEEP_ALIVE", "5"))
+accesslog = "-"
+errorlog = "-"
+
+
+def on_starting(server):
+    """
+    Создание таблиц и seed выполняются один раз в мастере, а не в каждом воркере
+    """
+    from app import database
+    from app.config import settings
+    from app.main import initialize_database
+
+    # Воркеры реплики для чтения к БД не подключаются
+    if not settings.READ_SNAPSHOT_MODE:
+        try:
+            initialize_database(settings)
+        except Exception:
+            server.log.exception("Database initialization failed")
+
+    # Воркеры наследуют модули мастера: отключаем повторную инициализацию
+    # и закрываем соединения, чтобы они не разделялись между процессами после fork
+    settings.DB_CREATE_ALL_ON_STARTUP = False
+    settings.SEED_ON_STARTUP = False
+    database.engine.dispose()
@@ -0,0 +1,73 @@
+"""
+Число запросов к БД на чтение через API (SQLite во временном файле: TestClient выполняет
+обработчики в другом потоке, а у SQLite в памяти на каждый поток своя база)
+"""
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+
+from app import database, models
+from app.config import Settings, settings
+from app.main import create_app
+
+
+@pytest.fixture(scope="module")
+def client(tmp_path_factory):
+    url = f"sqlite:///{tmp_path_factory.mktemp('read_queries') / 'db.sqlite'}"
+    app = create_app(Settings(DATABASE_URL=url))
+    database.Base.metadata.create_all(bind=database.engine)
+    # Без контекстного менеджера: lifespan (прогрев кэшей, воркер задач) не запускается
+    return TestClient(app, headers={"X-API-Key": settings.API_KEY})
+
+
+@pytest.fixture()
+def statements():
+    executed = []
+
+    def record(connection, cursor, statement, parameters, context, executemany):
+        executed.append(" ".join(statement.split())[:120])
+
+    event.listen(database.engine, "before_cursor_execute", record)
+    yield executed
+    event.remove(database.engine, "before_cursor_execute", record)
+
+
+def seed_organization(activity_count: int) -> int:
+    """
+    Организация с activity_count видами деятельности, у каждого по два дочерних и у них по одному
+    """
+    db = database.SessionLocal()
+    try:
+        root = models.Activity(name="Корень", level=0)
+        activities = []
+        for index in range(activity_count):
+            activity = models.Activity(name=f"Вид {index}", level=1, parent=root)
+            for child_index in range(2):
+                child = models.Activity(name=f"Вид {index}.{child_index}", level=2, parent=activity)
+                models.Activity(name=f"Вид {index}.{child_index}.0", level=3, parent=child)
+            activities.append(activity)
+        building = models.Building(address="Адрес", latitude=55.75, longitude=37.61)
+        organization = models.Organization(name="Организация", building=building, activities=activities)
+        db.add_all([root, organization])
+        db.commit()
+        return organization.id
+    finally:
+        db.close()
+
+
+@pytest.mark.parametrize("path", [
+    "/api/v1/organizations/{id}?include=activities",
+    "/api/v1/organizations/{id}",
+])
+def test_organization_activities_loaded_per_level(client, statements, path):
+    # Дочерние виды деятельности грузятся одним запросом на уровень, а не на каждый вид деятельности
+    counts = []
+    for activity_count in (1, 5):
+        organization_id = seed_organization(activity_count)
+        statements.clear()
+        response = client.get(path.format(id=organization_id))
+        assert response.status_code == 200
+        assert len(response.json()["activities"]) == activity_count
+        assert response.json()["activities"][0]["children"][0]["children"]
+        counts.append(len(statements))
+    assert counts[0] == counts[1], "\n".join(statements)
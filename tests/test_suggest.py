@@ -0,0 +1,27 @@
+"""
+Изменения названий поверх построенного индекса подсказок (Suggester.with_changes)
+"""
+from app.suggest import Suggester
+
+
+def names(suggester: Suggester, query: str, **kwargs):
+    return [name for _, _, name in suggester.search(query, **kwargs)]
+
+
+def test_with_changes_matches_rebuilt_index():
+    organizations = [(index, f"Кафе {index}") for index in range(300)]
+    suggester = Suggester({"organization": organizations, "activity": [(1, "Кафе и рестораны")]})
+
+    # Переименование, удаление и новая запись; исходный Suggester не меняется
+    changes = {"organization": {5: "Столовая", 7: None, 1000: "Кафе"}, "activity": {1: None}}
+    updated = suggester.with_changes(changes, version=10)
+
+    current = dict(organizations)
+    current.update({5: "Столовая", 1000: "Кафе"})
+    del current[7]
+    rebuilt = Suggester({"organization": list(current.items()), "activity": []})
+
+    for query in ("кафе", "кафе 7", "столов", "рест"):
+        assert names(updated, query, limit=20) == names(rebuilt, query, limit=20)
+    assert names(suggester, "кафе 7", limit=1) == ["Кафе 7"]
+    assert updated.version == 10 and updated.changed_count() == 4
@@ -0,0 +1,33 @@
+"""
+Число запросов к БД на запись через crud (бюджеты benchmarks/write_round_trips.py) на SQLite в памяти
+"""
+import pytest
+
+from benchmarks import write_round_trips
+
+
+@pytest.fixture(scope="module")
+def statements():
+    return write_round_trips.measure("sqlite://")
+
+
+@pytest.mark.parametrize("name", sorted(write_round_trips.BUDGETS))
+def test_within_budget(statements, name):
+    executed = statements[name]
+    assert len(executed) <= write_round_trips.budget(name), "\n".join(executed)
+
+
+# Начало запросов selectinload телефонов и видов деятельности организации
+RELATION_LOADS = ("SELECT phones.", "SELECT organizations_1.id AS organizations_1_id")
+
+
+def test_update_does_not_load_replaced_relations(statements):
+    # Телефоны и виды деятельности заменяются целиком: прежние не читаются, только удаляются
+    executed = statements["update_organization"]
+    assert not [statement for statement in executed if statement.startswith(RELATION_LOADS)], "\n".join(executed)
+
+
+def test_rename_loads_relations_for_response(statements):
+    # Без замены связи нужны ответу и загружаются
+    executed = statements["rename_organization"]
+    assert len([statement for statement in executed if statement.startswith(RELATION_LOADS)]) == 2